@@ -19,11 +19,15 @@ setuptools.setup(
     ],
     entry_points = {
         "console_scripts": [
+            "waafle_prefilter = waafle.waafle_prefilter:main",
             "waafle_search = waafle.waafle_search:main",
             "waafle_genecaller = waafle.waafle_genecaller:main",
             "waafle_orgscorer = waafle.waafle_orgscorer:main",
+            "waafle_pipeline = waafle.waafle_pipeline:main",
             "waafle_junctions = waafle.waafle_junctions:main",
             "waafle_qc = waafle.waafle_qc:main",
+            "waafle_taxonomy_compile = waafle.waafle_taxonomy_compile:main",
+            "waafle_coverage = waafle.waafle_coverage:main",
         ],
     },
     install_requires = [
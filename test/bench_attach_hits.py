@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of waafle_orgscorer's Contig.attach_hits (matching hits to the
+loci they overlap) on one synthetic contig with many loci and hits. Also
+prints a digest of the resulting gene scores and locus annotations, which
+must be the same when the benchmark is repeated against another version.
+
+e.g. cd test && PYTHONPATH=.. python bench_attach_hits.py --loci 400 --hits 20000
+"""
+
+from __future__ import print_function
+import hashlib
+import argparse
+
+from bench_utils import synthetic_contig, make_hits, orgscorer_args, best_of
+from waafle import utils as wu
+from waafle import waafle_orgscorer
+
+def get_args( ):
+    parser = argparse.ArgumentParser( )
+    parser.add_argument( "--length", type=int, default=200000, help="contig length [default: 200000]" )
+    parser.add_argument( "--loci", type=int, default=400, help="loci on the contig [default: 400]" )
+    parser.add_argument( "--hits", type=int, default=20000, help="hits on the contig [default: 20000]" )
+    parser.add_argument( "--stranded", action="store_true", help="pass --stranded to the orgscorer" )
+    parser.add_argument( "--repeat", type=int, default=3, help="runs (fastest is kept) [default: 3]" )
+    parser.add_argument( "--seed", type=int, default=1 )
+    return parser.parse_args( )
+
+def attach( gff_rows, hits, args ):
+    contig = waafle_orgscorer.Contig( "bench", args )
+    contig.attach_loci( [wu.Locus( row ) for row in gff_rows] )
+    contig.attach_hits( hits )
+    return contig
+
+def digest( contig ):
+    """ SHA-1 of the gene scores and locus annotations """
+    contig.update_gene_scores( )
+    h = hashlib.sha1( )
+    for clade in sorted( contig.gene_scores ):
+        h.update( "{}\t{}\n".format( clade, " ".join( "{:.10f}".format( k ) for k in contig.gene_scores[clade] ) ).encode( ) )
+    for L in contig.loci:
+        h.update( "{}\t{}\n".format( L.code, sorted( L.annotations.items( ) ) ).encode( ) )
+    return h.hexdigest( )
+
+def main( ):
+    args = get_args( )
+    gff_rows, blast_rows = synthetic_contig( "bench", args.length, args.loci, args.hits, seed=args.seed )
+    hits = make_hits( blast_rows )
+    options = ["--stranded"] if args.stranded else []
+    seconds, contig = best_of( args.repeat, attach, gff_rows, hits, orgscorer_args( *options ) )
+    print( "{:,} bp contig, {:,} loci, {:,} hits{}".format(
+        args.length, args.loci, args.hits, " (stranded)" if args.stranded else "" ) )
+    print( "attach_hits (s)\t{:.2f}".format( seconds ) )
+    print( "digest\t{}".format( digest( contig ) ) )
+
+if __name__ == "__main__":
+    main( )
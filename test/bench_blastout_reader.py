@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the blastout readers: groups the hits of <copies> copies of
+the demo blastout by contig, as a list of Hit objects per contig and (if
+this WAAFLE has it) as one columnar HitBatch per contig, and reports
+rows/s for each. Every field of every row is checked to match.
+
+e.g. cd test && PYTHONPATH=.. python bench_blastout_reader.py --copies 100
+"""
+
+from __future__ import print_function
+import sys
+import shutil
+import argparse
+import tempfile
+
+from bench_utils import write_scaled_demo, best_of
+from waafle import utils as wu
+
+c_fields = [fname for fname, ftype in wu.c_blast_fields] + \
+    ["scov", "qcov", "ltrim", "rtrim", "scov_modified", "waafle_score", "geneid", "taxon", "annotations"]
+
+def get_args( ):
+    parser = argparse.ArgumentParser( )
+    parser.add_argument( "--copies", type=int, default=100, help="copies of the demo blastout [default: 100]" )
+    parser.add_argument( "--repeat", type=int, default=3, help="runs per reader (fastest is kept) [default: 3]" )
+    parser.add_argument( "--tmpdir", default=None, help="where to write the scaled blastout [default: system temp]" )
+    return parser.parse_args( )
+
+def read_hits( path ):
+    return list( wu.iter_contig_hits( path ) )
+
+def read_batches( path ):
+    return list( wu.iter_contig_hits( path, columnar=True ) )
+
+def main( ):
+    args = get_args( )
+    workdir = tempfile.mkdtemp( prefix="waafle_bench.", dir=args.tmpdir )
+    try:
+        path = write_scaled_demo( workdir, args.copies )["blastout"]
+        seconds, hits = best_of( args.repeat, read_hits, path )
+        rows = sum( len( k ) for contig, k in hits )
+        print( "{:,} copies of the demo blastout: {:,} rows in {:,} contigs".format( args.copies, rows, len( hits ) ) )
+        print( "reader\tseconds\trows/s" )
+        print( "Hit\t{:.2f}\t{:,.0f}".format( seconds, rows / seconds ) )
+        if not hasattr( wu, "HitBatch" ):
+            print( "HitBatch\t-\t- (not in this version)" )
+            return
+        seconds, batches = best_of( args.repeat, read_batches, path )
+        print( "HitBatch\t{:.2f}\t{:,.0f}".format( seconds, rows / seconds ) )
+        if [contig for contig, k in hits] != [contig for contig, k in batches]:
+            sys.exit( "Contigs differ between the readers" )
+        for [contig, contig_hits], [contig, batch] in zip( hits, batches ):
+            if len( contig_hits ) != len( batch ):
+                sys.exit( "Hit counts differ for " + contig )
+            for hit, row in zip( contig_hits, batch.iter_rows( ) ):
+                for fname in c_fields:
+                    if getattr( hit, fname ) != getattr( row, fname ):
+                        sys.exit( "{} differs for a hit on {}".format( fname, contig ) )
+    finally:
+        shutil.rmtree( workdir )
+
+if __name__ == "__main__":
+    main( )
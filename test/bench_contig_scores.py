@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of waafle_orgscorer's per-contig scoring: attaches the hits of
+one synthetic contig to its loci, computes gene scores, and raises the
+taxonomy 4 times (species to class, in the demo taxonomy). Reports the
+time and the peak memory traced by tracemalloc for attaching the hits and
+for the scoring that follows, and prints a digest of the gene scores at
+each level, which must be the same when the benchmark is repeated against
+another version.
+
+e.g. cd test && PYTHONPATH=.. python bench_contig_scores.py --loci 150 --hits 6000
+"""
+
+from __future__ import print_function
+import time
+import hashlib
+import argparse
+import tracemalloc
+
+from bench_utils import synthetic_contig, make_hits, orgscorer_args, c_demo_taxonomy
+from waafle import utils as wu
+from waafle import waafle_orgscorer
+
+c_raises = 4
+
+def get_args( ):
+    parser = argparse.ArgumentParser( )
+    parser.add_argument( "--length", type=int, default=100000, help="contig length [default: 100000]" )
+    parser.add_argument( "--loci", type=int, default=150, help="loci on the contig [default: 150]" )
+    parser.add_argument( "--hits", type=int, default=6000, help="hits on the contig [default: 6000]" )
+    parser.add_argument( "--repeat", type=int, default=5, help="timed runs (fastest is kept) [default: 5]" )
+    parser.add_argument( "--seed", type=int, default=1 )
+    return parser.parse_args( )
+
+def attach( gff_rows, hits, args ):
+    contig = waafle_orgscorer.Contig( "bench", args )
+    contig.attach_loci( [wu.Locus( row ) for row in gff_rows] )
+    contig.attach_hits( hits )
+    return contig
+
+def score( contig, taxonomy ):
+    """ [gene scores at each level] """
+    contig.update_gene_scores( )
+    levels = [contig.gene_scores]
+    for i in range( c_raises ):
+        contig.raise_taxonomy( taxonomy )
+        levels.append( contig.gene_scores )
+    return levels
+
+def digest( levels ):
+    """ SHA-1 of the gene scores at each level """
+    h = hashlib.sha1( )
+    for gene_scores in levels:
+        for clade in sorted( gene_scores ):
+            h.update( "{}\t{}\n".format( clade, " ".join( "{:.10f}".format( k ) for k in gene_scores[clade] ) ).encode( ) )
+    return h.hexdigest( )
+
+def measure( function, setup ):
+    """ [seconds, peak traced MB, result] of <function>( *<setup>( ) ), timed and traced in separate calls """
+    args = setup( )
+    tracemalloc.start( )
+    function( *args )
+    peak = tracemalloc.get_traced_memory( )[1]
+    tracemalloc.stop( )
+    args = setup( )
+    start = time.time( )
+    result = function( *args )
+    return [time.time( ) - start, peak / 1e6, result]
+
+def main( ):
+    args = get_args( )
+    gff_rows, blast_rows = synthetic_contig( "bench", args.length, args.loci, args.hits, seed=args.seed )
+    hits = make_hits( blast_rows )
+    taxonomy = wu.Taxonomy( c_demo_taxonomy )
+    orgscorer = orgscorer_args( )
+    steps = [
+        ["attach_hits", attach, lambda: [gff_rows, hits, orgscorer]],
+        ["gene scores + {} raises".format( c_raises ), score, lambda: [attach( gff_rows, hits, orgscorer ), taxonomy]],
+        ]
+    print( "{:,} bp contig, {:,} loci, {:,} hits".format( args.length, args.loci, args.hits ) )
+    print( "step\tseconds\tpeak traced MB" )
+    for name, function, setup in steps:
+        # fastest run is kept
+        runs = [measure( function, setup ) for i in range( args.repeat )]
+        seconds, peak, result = min( runs, key=lambda run: run[0] )
+        print( "{}\t{:.3f}\t{:.1f}".format( name, seconds, peak ) )
+    print( "digest\t{}".format( digest( result ) ) )
+
+if __name__ == "__main__":
+    main( )
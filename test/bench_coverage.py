@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the binary coverage store (.wcov) against the gzipped
+site_hits text that waafle_junctions --write-detailed-output used to
+write: synthetic per-site depths (random fragments over <contigs>
+contigs) are written both ways, then read back in full, and regions are
+read from the .wcov file. Depths read from both are checked to match.
+
+e.g. cd test && PYTHONPATH=.. python bench_coverage.py --contigs 1000
+"""
+
+from __future__ import print_function
+import io
+import os
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from bench_utils import best_of
+from waafle import utils as wu
+from waafle.waafle_coverage import c_formats
+
+def get_args( ):
+    parser = argparse.ArgumentParser( )
+    parser.add_argument( "--contigs", type=int, default=1000, help="synthetic contigs [default: 1000]" )
+    parser.add_argument( "--depth", type=float, default=50, help="mean fragment depth [default: 50]" )
+    parser.add_argument( "--regions", type=int, default=1000, help="500-bp regions read from the .wcov [default: 1000]" )
+    parser.add_argument( "--repeat", type=int, default=3, help="runs per step (fastest is kept) [default: 3]" )
+    parser.add_argument( "--seed", type=int, default=1 )
+    parser.add_argument( "--tmpdir", default=None, help="where to write the outputs [default: system temp]" )
+    return parser.parse_args( )
+
+def make_coverage( ncontigs, depth, rng ):
+    """ {contig: int depths} from random 150-600 bp fragments on 2-20 kb contigs """
+    coverage = {}
+    for i in range( ncontigs ):
+        length = int( rng.integers( 2000, 20001 ) )
+        nfrags = int( depth * length / 375 )
+        starts = rng.integers( 0, length, nfrags )
+        stops = np.minimum( starts + rng.integers( 150, 601, nfrags ), length )
+        diff = np.zeros( length + 1, dtype=np.int64 )
+        np.add.at( diff, starts, 1 )
+        np.add.at( diff, stops, -1 )
+        coverage["contig_{:05d}".format( i )] = np.cumsum( diff[:-1] )
+    return coverage
+
+def write_text( path, coverage ):
+    """ the site_hits writer waafle_junctions used before the .wcov store (float depths) """
+    with io.TextIOWrapper( wu.try_open( path, "wb" ) ) as fh:
+        wu.write_rowdict( format=c_formats["site_hits"], file=fh )
+        for c in sorted( coverage ):
+            depths = coverage[c].astype( np.float64 )
+            rowdict = {
+                "contig" : c,
+                "mean"   : np.mean( depths ),
+                "stdev"  : np.std( depths ),
+                "depths" : " ".join( ["{:.0f}".format( k ) for k in depths] ),
+                }
+            wu.write_rowdict( rowdict=rowdict, format=c_formats["site_hits"], file=fh )
+
+def read_text( path ):
+    coverage = {}
+    with io.TextIOWrapper( wu.try_open( path, "rb" ) ) as fh:
+        next( fh )
+        for line in fh:
+            contig, mean, stdev, depths = line.rstrip( "\n" ).split( "\t" )
+            coverage[contig] = np.array( depths.split( " " ), dtype=np.int64 )
+    return coverage
+
+def read_store( path ):
+    store = wu.CoverageStore( path )
+    return {contig: store.get_depths( contig ) for contig in store}
+
+def read_regions( path, regions ):
+    store = wu.CoverageStore( path )
+    return [store.get_depths( contig, start, stop ) for contig, start, stop in regions]
+
+def main( ):
+    args = get_args( )
+    rng = np.random.default_rng( args.seed )
+    coverage = make_coverage( args.contigs, args.depth, rng )
+    sites = sum( len( k ) for k in coverage.values( ) )
+    print( "{:,} contigs, {:,} sites, ~{:.0f}x fragment depth".format( len( coverage ), sites, args.depth ) )
+    workdir = tempfile.mkdtemp( prefix="waafle_bench.", dir=args.tmpdir )
+    try:
+        p_text = os.path.join( workdir, "bench.site_hits.tsv.gz" )
+        p_store = os.path.join( workdir, "bench" + wu.c_coverage_ext )
+        t_text = best_of( args.repeat, write_text, p_text, coverage )[0]
+        t_store = best_of( args.repeat, wu.write_coverage, p_store, coverage )[0]
+        print( "step\tgz text\twcov" )
+        print( "write (s)\t{:.2f}\t{:.2f}".format( t_text, t_store ) )
+        print( "size (MB)\t{:.2f}\t{:.2f}".format(
+            os.path.getsize( p_text ) / 1e6, os.path.getsize( p_store ) / 1e6 ) )
+        t_text, from_text = best_of( args.repeat, read_text, p_text )
+        t_store, from_store = best_of( args.repeat, read_store, p_store )
+        print( "read all (s)\t{:.2f}\t{:.2f}".format( t_text, t_store ) )
+        for contig, depths in coverage.items( ):
+            if not (np.array_equal( depths, from_text[contig] ) and np.array_equal( depths, from_store[contig] )):
+                raise AssertionError( "Depths differ for " + contig )
+        # regions: the text has no index, so only the .wcov is timed
+        names = sorted( coverage )
+        regions = []
+        for i in range( args.regions ):
+            contig = names[int( rng.integers( len( names ) ) )]
+            start = int( rng.integers( 0, len( coverage[contig] ) - 500 ) )
+            regions.append( [contig, start, start + 500] )
+        t_store, depths = best_of( args.repeat, read_regions, p_store, regions )
+        for [contig, start, stop], region in zip( regions, depths ):
+            if not np.array_equal( coverage[contig][start:stop], region ):
+                raise AssertionError( "Region depths differ for " + contig )
+        print( "{:,} x 500-bp regions (s)\t-\t{:.2f}".format( len( regions ), t_store ) )
+    finally:
+        shutil.rmtree( workdir )
+
+if __name__ == "__main__":
+    main( )
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of waafle_genecaller's overlap_intervals (merging overlapping
+hits into genes) on synthetic piles of 0.3-3 kb hits on both
+strands. Prints a digest of the merged genes per pile, which must be the
+same when the benchmark is repeated against another version.
+
+e.g. cd test && PYTHONPATH=.. python bench_gene_overlaps.py --min-overlap 0.1
+"""
+
+from __future__ import print_function
+import random
+import hashlib
+import argparse
+
+import numpy as np
+
+from bench_utils import best_of
+from waafle import waafle_genecaller as gc
+
+# [hits, span (bp)] of each pile; the last is sparse, so it yields many genes
+c_piles = [[2000, 20000], [5000, 20000], [10000, 100000], [10000, 5000000]]
+
+def get_args( ):
+    parser = argparse.ArgumentParser( )
+    parser.add_argument( "--min-overlap", type=float, default=0.1, help="overlap threshold [default: 0.1]" )
+    parser.add_argument( "--unstranded", action="store_true", help="merge hits regardless of strand" )
+    parser.add_argument( "--repeat", type=int, default=3, help="runs per pile (fastest is kept) [default: 3]" )
+    parser.add_argument( "--seed", type=int, default=1 )
+    return parser.parse_args( )
+
+def make_pile( nhits, span, rng ):
+    """ [starts, stops, strands] of <nhits> 0.3-3 kb hits within <span> bp """
+    starts, stops, strands = [], [], []
+    for i in range( nhits ):
+        size = rng.randint( 300, 3000 )
+        start = rng.randint( 1, span - size )
+        starts.append( start )
+        stops.append( start + size - 1 )
+        strands.append( rng.choice( "+-" ) )
+    return [starts, stops, strands]
+
+def overlap_intervals( pile, threshold, stranded ):
+    """ call this version's overlap_intervals (arrays since the sweep line; lists before) """
+    starts, stops, strands = pile
+    if hasattr( gc, "link_intervals" ):
+        return gc.overlap_intervals( np.array( starts ), np.array( stops ), np.array( strands ), threshold, stranded )
+    return gc.overlap_intervals( [list( k ) for k in zip( starts, stops, strands )], threshold, stranded )
+
+def main( ):
+    args = get_args( )
+    rng = random.Random( args.seed )
+    stranded = not args.unstranded
+    print( "--min-overlap {}, {}".format( args.min_overlap, "stranded" if stranded else "unstranded" ) )
+    print( "hits\tspan (bp)\tgenes\tseconds\tdigest" )
+    for nhits, span in c_piles:
+        pile = make_pile( nhits, span, rng )
+        seconds, genes = best_of( args.repeat, overlap_intervals, pile, args.min_overlap, stranded )
+        genes = sorted( [int( start ), int( stop ), strand] for start, stop, strand in genes )
+        h = hashlib.sha1( "{}".format( genes ).encode( ) ).hexdigest( )
+        print( "{:,}\t{:,}\t{:,}\t{:.3f}\t{}".format( nhits, span, len( genes ), seconds, h ) )
+
+if __name__ == "__main__":
+    main( )
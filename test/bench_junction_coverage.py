@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of waafle_junctions' per-site coverage: random 150-600 bp
+fragments on a synthetic assembly are counted with CoverageCounter and
+with the per-fragment slice increments (cov[L:R+1] += 1 on float64
+arrays) it replaced, and the depths are checked to match. Optionally,
+also times waafle_junctions end to end on pairs simulated by fake_sam.py
+on the demo contigs (with -basic-cigars, which every version reads),
+printing a digest of the junctions report, which must be the same when
+the benchmark is repeated against another version.
+
+e.g. cd test && PYTHONPATH=.. python bench_junction_coverage.py --sites 100000000 --pairs 200000
+"""
+
+from __future__ import print_function
+import os
+import sys
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+import subprocess
+from collections import OrderedDict
+
+import numpy as np
+
+from bench_utils import best_of, c_demo_contigs, c_demo_gff
+from waafle import waafle_junctions
+
+def get_args( ):
+    parser = argparse.ArgumentParser( )
+    parser.add_argument( "--sites", type=int, default=100000000, help="assembly size (bp) [default: 100000000]" )
+    parser.add_argument( "--fragments", type=int, default=5000000, help="fragments counted [default: 5000000]" )
+    parser.add_argument( "--pairs", type=int, default=200000, help="pairs for the end-to-end run (0 to skip) [default: 200000]" )
+    parser.add_argument( "--repeat", type=int, default=1, help="runs per step (fastest is kept) [default: 1]" )
+    parser.add_argument( "--seed", type=int, default=1 )
+    parser.add_argument( "--tmpdir", default=None, help="where to write the SAM and outputs [default: system temp]" )
+    return parser.parse_args( )
+
+def make_fragments( sites, nfragments, rng ):
+    """ [contig lengths, fragments] on an assembly of 2-20 kb contigs """
+    lengths = OrderedDict( )
+    total = 0
+    while total < sites:
+        length = min( rng.randint( 2000, 20000 ), sites - total )
+        lengths["contig_{:06d}".format( len( lengths ) )] = length
+        total += length
+    names = list( lengths )
+    fragments = []
+    for i in range( nfragments ):
+        contig = rng.choice( names )
+        # base-0, inclusive; like clipped reads, fragments may hang off the end
+        start = rng.randint( 0, lengths[contig] - 1 )
+        fragments.append( [contig, start, start + rng.randint( 150, 600 ) - 1] )
+    return [lengths, fragments]
+
+def count_slices( lengths, fragments ):
+    """ the per-fragment slice increments waafle_junctions used before CoverageCounter """
+    coverage = {name: np.zeros( length ) for name, length in lengths.items( )}
+    for contig, L, R in fragments:
+        coverage[contig][L:R+1] += 1
+    return coverage
+
+def count_counter( lengths, fragments ):
+    counter = waafle_junctions.CoverageCounter( lengths )
+    for contig, L, R in fragments:
+        counter.add( contig, L, R )
+    return counter.get_coverage( )
+
+def run_junctions( sam, workdir ):
+    """ digest of the junctions report """
+    command = [
+        sys.executable, waafle_junctions.__file__.replace( ".pyc", ".py" ),
+        c_demo_contigs, c_demo_gff, "--sam", sam,
+        "--outdir", workdir, "--basename", "bench",
+        ]
+    with open( os.devnull, "w" ) as devnull:
+        subprocess.check_call( command, stderr=devnull )
+    with open( os.path.join( workdir, "bench.junctions.tsv" ), "rb" ) as fh:
+        return hashlib.sha1( fh.read( ) ).hexdigest( )
+
+def main( ):
+    args = get_args( )
+    rng = random.Random( args.seed )
+    lengths, fragments = make_fragments( args.sites, args.fragments, rng )
+    print( "{:,} fragments of 150-600 bp on {:,} contigs ({:,} bp)".format(
+        len( fragments ), len( lengths ), sum( lengths.values( ) ) ) )
+    print( "step\tseconds" )
+    seconds, expected = best_of( args.repeat, count_slices, lengths, fragments )
+    print( "coverage, slices\t{:.2f}".format( seconds ) )
+    if hasattr( waafle_junctions, "CoverageCounter" ):
+        seconds, coverage = best_of( args.repeat, count_counter, lengths, fragments )
+        print( "coverage, CoverageCounter\t{:.2f}".format( seconds ) )
+        for name in lengths:
+            if not np.array_equal( expected[name], coverage[name] ):
+                sys.exit( "Depths differ for " + name )
+    del expected
+    if args.pairs > 0:
+        workdir = tempfile.mkdtemp( prefix="waafle_bench.", dir=args.tmpdir )
+        try:
+            sam = os.path.join( workdir, "bench.sam" )
+            subprocess.check_call( [
+                sys.executable, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), "fake_sam.py" ),
+                c_demo_contigs, "-out", sam, "-pairs", str( args.pairs ),
+                "-seed", str( args.seed ), "-basic-cigars",
+                ] )
+            seconds, result = best_of( args.repeat, run_junctions, sam, workdir )
+            print( "waafle_junctions, {:,} pairs\t{:.2f}".format( args.pairs, seconds ) )
+            print( "digest\t{}".format( result ) )
+        finally:
+            shutil.rmtree( workdir )
+
+if __name__ == "__main__":
+    main( )
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""
+Scaling benchmark for waafle_orgscorer --workers: runs the orgscorer on
+<copies> copies of the demo data for each worker count (1 up to the
+number of cores by default), checks that every run's outputs match the
+single-process run, and reports the wall time, speedup, and efficiency.
+
+e.g. cd test && PYTHONPATH=.. python bench_orgscorer_workers.py --copies 200
+"""
+
+from __future__ import print_function
+import os
+import sys
+import shutil
+import filecmp
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+from bench_utils import write_scaled_demo, best_of
+from waafle import waafle_orgscorer
+
+c_outputs = ["lgt.tsv", "no_lgt.tsv", "unclassified.tsv"]
+
+def get_args( ):
+    parser = argparse.ArgumentParser( )
+    cores = multiprocessing.cpu_count( )
+    counts = [1]
+    while 2 * counts[-1] <= cores:
+        counts.append( 2 * counts[-1] )
+    if counts[-1] != cores:
+        counts.append( cores )
+    parser.add_argument( "--copies", type=int, default=100, help="copies of the demo data [default: 100]" )
+    parser.add_argument( "--workers", type=int, nargs="+", default=counts, help="worker counts [default: 1 2 4 ... cores]" )
+    parser.add_argument( "--repeat", type=int, default=1, help="runs per worker count (fastest is kept) [default: 1]" )
+    parser.add_argument( "--stream", action="store_true", help="also pass --stream" )
+    parser.add_argument( "--tmpdir", default=None, help="where to write the scaled inputs [default: system temp]" )
+    return parser.parse_args( )
+
+def run_orgscorer( paths, outdir, workers, stream ):
+    command = [
+        sys.executable, waafle_orgscorer.__file__.replace( ".pyc", ".py" ),
+        paths["contigs"], paths["blastout"], paths["gff"], paths["taxonomy"],
+        "--outdir", outdir, "--basename", "bench", "--quiet",
+        ]
+    if workers > 1:
+        command += ["--workers", str( workers )]
+    if stream:
+        command += ["--stream"]
+    with open( os.devnull, "w" ) as devnull:
+        subprocess.check_call( command, stderr=devnull )
+
+def main( ):
+    args = get_args( )
+    workdir = tempfile.mkdtemp( prefix="waafle_bench.", dir=args.tmpdir )
+    try:
+        paths = write_scaled_demo( workdir, args.copies )
+        with open( paths["blastout"] ) as fh:
+            rows = sum( 1 for line in fh )
+        print( "{:,} copies of the demo data: {:,} blastout rows; {} cores".format(
+            args.copies, rows, multiprocessing.cpu_count( ) ) )
+        print( "workers\tseconds\tspeedup\tefficiency" )
+        base = None
+        for workers in args.workers:
+            outdir = os.path.join( workdir, "workers_{}".format( workers ) )
+            os.makedirs( outdir )
+            seconds = best_of( args.repeat, run_orgscorer, paths, outdir, workers, args.stream )[0]
+            if base is None:
+                base = [seconds, outdir]
+            for ext in c_outputs:
+                a, b = [os.path.join( d, "bench." + ext ) for d in [base[1], outdir]]
+                if not filecmp.cmp( a, b, shallow=False ):
+                    sys.exit( "Output differs from the first run: {}".format( b ) )
+            speedup = base[0] / seconds
+            print( "{}\t{:.2f}\t{:.2f}\t{:.2f}".format( workers, seconds, speedup, speedup / workers ) )
+    finally:
+        shutil.rmtree( workdir )
+
+if __name__ == "__main__":
+    main( )
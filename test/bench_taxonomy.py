@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of wu.Taxonomy: loads a synthetic 8-rank taxonomy (k__ to t__,
+random fan-outs), then runs LCA + tails + lineage + leaf-count queries
+on 2-4 clades drawn from a recurring set (as the orgscorer's queries
+recur over a sample's clades). Prints a digest of the query results,
+which must be the same when the benchmark is repeated against another
+version.
+
+e.g. cd test && PYTHONPATH=.. python bench_taxonomy.py --queries 50000
+"""
+
+from __future__ import print_function
+import os
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+from bench_utils import best_of
+from waafle import utils as wu
+
+# ranks below the root and the range of children per clade
+c_ranks = [["k", 2, 2], ["p", 3, 5], ["c", 3, 5], ["o", 3, 5], ["f", 3, 5], ["g", 4, 8], ["s", 4, 12], ["t", 8, 24]]
+
+def get_args( ):
+    parser = argparse.ArgumentParser( )
+    parser.add_argument( "--queries", type=int, default=50000, help="queries [default: 50000]" )
+    parser.add_argument( "--clades", type=int, default=2000, help="recurring clades the queries draw from [default: 2000]" )
+    parser.add_argument( "--repeat", type=int, default=3, help="runs per step (fastest is kept) [default: 3]" )
+    parser.add_argument( "--seed", type=int, default=1 )
+    parser.add_argument( "--tmpdir", default=None, help="where to write the taxonomy [default: system temp]" )
+    return parser.parse_args( )
+
+def write_taxonomy( path, rng ):
+    """ write a clade/parent TSV; returns [species, strains] """
+    level, ranks = [wu.c_root], []
+    with open( path, "w" ) as fh:
+        for rank, lo, hi in c_ranks:
+            children = []
+            for parent in level:
+                for i in range( rng.randint( lo, hi ) ):
+                    children.append( "{}__{}_{}".format( rank, parent.split( "__" )[-1], i ) )
+                    print( children[-1], parent, sep="\t", file=fh )
+            level = children
+            ranks.append( level )
+    return ranks[-2:]
+
+def run_queries( taxonomy, queries ):
+    results = []
+    for clades in queries:
+        lca = taxonomy.get_lca( *clades )
+        tails = taxonomy.get_tails( clades, lca )
+        lineages = [taxonomy.get_lineage( c ) for c in clades]
+        results.append( [lca, tails, lineages, taxonomy.get_leaf_count( lca )] )
+    return results
+
+def digest( results ):
+    """ SHA-1 of the query results """
+    h = hashlib.sha1( )
+    for result in results:
+        h.update( "{}\n".format( result ).encode( ) )
+    return h.hexdigest( )
+
+def main( ):
+    args = get_args( )
+    rng = random.Random( args.seed )
+    workdir = tempfile.mkdtemp( prefix="waafle_bench.", dir=args.tmpdir )
+    try:
+        path = os.path.join( workdir, "taxonomy.tsv" )
+        species, strains = write_taxonomy( path, rng )
+        seconds, taxonomy = best_of( args.repeat, wu.Taxonomy, path )
+        print( "8-rank taxonomy: {:,} species, {:,} strains (leaves)".format( len( species ), len( strains ) ) )
+        print( "load (s)\t{:.2f}".format( seconds ) )
+        if hasattr( taxonomy, "write" ):
+            compiled = os.path.join( workdir, "taxonomy.compiled" )
+            taxonomy.write( compiled )
+            print( "load compiled (s)\t{:.2f}".format( best_of( args.repeat, wu.Taxonomy, compiled )[0] ) )
+        # recurring clades: mostly strains, some species (e.g. after raising the taxonomy)
+        clades = [rng.choice( strains if rng.random( ) < 0.8 else species ) for i in range( args.clades )]
+        queries = [rng.sample( clades, rng.randint( 2, 4 ) ) for i in range( args.queries )]
+        # a fresh taxonomy per run, so that cached lineages are rebuilt each time
+        seconds = None
+        for i in range( args.repeat ):
+            taxonomy = wu.Taxonomy( path )
+            start = time.time( )
+            result = run_queries( taxonomy, queries )
+            elapsed = time.time( ) - start
+            seconds = elapsed if seconds is None else min( seconds, elapsed )
+        print( "{:,} queries (s)\t{:.2f}".format( len( queries ), seconds ) )
+        print( "digest\t{}".format( digest( result ) ) )
+    finally:
+        shutil.rmtree( workdir )
+
+if __name__ == "__main__":
+    main( )
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+"""
+Helpers shared by the test/bench_*.py benchmarks. Each benchmark times
+the WAAFLE that is found on PYTHONPATH (e.g. PYTHONPATH=.. from test/);
+to compare with an earlier version, run it again with PYTHONPATH set to
+a checkout of that version, e.g. one made by:
+
+$ git worktree add /tmp/waafle_old <commit>
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import random
+
+c_demo = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), os.pardir, "demo" )
+c_demo_contigs  = os.path.join( c_demo, "input", "demo_contigs.fna" )
+c_demo_taxonomy = os.path.join( c_demo, "input", "demo_taxonomy.tsv" )
+c_demo_blastout = os.path.join( c_demo, "output", "demo_contigs.blastout" )
+c_demo_gff      = os.path.join( c_demo, "output", "demo_contigs.gff" )
+
+def best_of( repeat, function, *args, **kwargs ):
+    """ [fastest of <repeat> timed calls in seconds, result of the last call] """
+    best, result = None, None
+    for i in range( repeat ):
+        start = time.time( )
+        result = function( *args, **kwargs )
+        elapsed = time.time( ) - start
+        best = elapsed if best is None else min( best, elapsed )
+    return [best, result]
+
+def rename_line( line, copy, kind ):
+    """ the contig name in a demo FASTA/blastout/GFF line, made unique to <copy> """
+    if kind == "contigs":
+        return line.rstrip( "\n" ) + "_{}\n".format( copy ) if line.startswith( ">" ) else line
+    name, rest = line.split( "\t", 1 )
+    return "{}_{}\t{}".format( name, copy, rest )
+
+def write_scaled_demo( outdir, copies ):
+    """
+    Write <copies> renamed copies of the demo contigs, blastout, and GFF
+    to <outdir> (each file grouped by contig, as WAAFLE writes them);
+    returns {kind: path}, including the (unchanged) demo taxonomy
+    """
+    if not os.path.exists( outdir ):
+        os.makedirs( outdir )
+    paths = {"taxonomy": c_demo_taxonomy}
+    for kind, source, ext in [
+            ["contigs", c_demo_contigs, ".fna"],
+            ["blastout", c_demo_blastout, ".blastout"],
+            ["gff", c_demo_gff, ".gff"],
+            ]:
+        with open( source ) as fh:
+            lines = fh.readlines( )
+        paths[kind] = os.path.join( outdir, "scaled_{}{}".format( copies, ext ) )
+        with open( paths[kind], "w" ) as fh:
+            for copy in range( copies ):
+                fh.writelines( rename_line( line, copy, kind ) for line in lines )
+    return paths
+
+def demo_species( ):
+    """ species in the demo taxonomy (the level of the demo blastout subjects) """
+    with open( c_demo_taxonomy ) as fh:
+        return sorted( line.split( "\t" )[0] for line in fh if line.startswith( "s__" ) )
+
+def synthetic_contig( name, length, nloci, nhits, seed=1 ):
+    """
+    [GFF rows, blastout rows] (as lists of fields) for a synthetic contig
+    of <length> bp: <nloci> loci of 300-1,500 bp at random positions and
+    strands, and <nhits> hits of demo species, each near a random locus
+    (mostly on its strand) and carrying one annotation
+    """
+    rng = random.Random( seed )
+    species = demo_species( )
+    loci = []
+    for i in range( nloci ):
+        size = rng.randint( 300, 1500 )
+        start = rng.randint( 1, length - size )
+        loci.append( [name, "bench", "gene", str( start ), str( start + size - 1 ),
+                      ".", rng.choice( "+-" ), "0", "."] )
+    hits = []
+    for i in range( nhits ):
+        locus = rng.choice( loci )
+        l1, l2 = int( locus[3] ), int( locus[4] )
+        qstart = max( 1, l1 + rng.randint( -200, 200 ) )
+        qend = min( length, max( qstart + 50, l2 + rng.randint( -200, 200 ) ) )
+        size = qend - qstart + 1
+        slen = size + rng.randint( 0, 300 )
+        plus = (locus[6] == "+") != (rng.random( ) < 0.1)
+        sstart, send = [1, size] if plus else [size, 1]
+        gene = rng.randint( 1, 2000 )
+        sseqid = "GENE{:06d}|{}|UniRef90=U{:06d}".format( gene, rng.choice( species ), gene )
+        hits.append( [name, sseqid, str( length ), str( slen ), str( size ), str( qstart ), str( qend ),
+                      str( sstart ), str( send ), "{:.3f}".format( rng.uniform( 70, 100 ) ),
+                      str( size ), "0", "1e-50", "500", "plus" if plus else "minus"] )
+    return [loci, hits]
+
+def make_hits( rows ):
+    """ blastout rows (lists of fields) as this version's contig hits: a HitBatch, or a list of Hits """
+    from waafle import utils as wu
+    if hasattr( wu, "parse_hit_block" ):
+        return wu.parse_hit_block( "".join( "\t".join( row ) + "\n" for row in rows ) )
+    return [wu.Hit( row ) for row in rows]
+
+def orgscorer_args( *options ):
+    """ waafle_orgscorer's default args (plus <options>), for calling its internals """
+    from waafle import waafle_orgscorer
+    argv = sys.argv
+    try:
+        sys.argv = ["waafle_orgscorer.py", c_demo_contigs, c_demo_blastout, c_demo_gff, c_demo_taxonomy] + list( options )
+        return waafle_orgscorer.get_args( )
+    finally:
+        sys.argv = argv
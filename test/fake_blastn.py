@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""
+Stand-in for blastn when testing waafle_search (and waafle_pipeline)
+without BLAST installed: accepts the options waafle_search passes and
+writes a few deterministic WAAFLE-format hits per query contig (to
+-out, or to stdout), in query order as blastn would. -db is ignored.
+With -fail_after <n>, it exits with an error after <n> query contigs.
+
+e.g. waafle_search contigs.fna db --blastn "python test/fake_blastn.py"
+"""
+
+from __future__ import print_function
+import sys
+import zlib
+import argparse
+
+def get_args( ):
+    parser = argparse.ArgumentParser( )
+    parser.add_argument( "-query", required=True )
+    parser.add_argument( "-db", required=True )
+    parser.add_argument( "-out", default=None )
+    parser.add_argument( "-max_target_seqs", type=int, default=500 )
+    parser.add_argument( "-num_threads", type=int, default=1 )
+    parser.add_argument( "-outfmt", default="6" )
+    parser.add_argument( "-fail_after", type=int, default=None )
+    return parser.parse_args( )
+
+def iter_fasta( path ):
+    name, seq = None, []
+    with open( path ) as fh:
+        for line in fh:
+            line = line.strip( )
+            if line.startswith( ">" ):
+                if name is not None:
+                    yield name, "".join( seq )
+                name, seq = line[1:].split( )[0], []
+            else:
+                seq.append( line )
+    if name is not None:
+        yield name, "".join( seq )
+
+def fake_hits( name, seq ):
+    """ a few hits placed by a checksum of the contig """
+    qlen = len( seq )
+    seed = zlib.crc32( (name + seq).encode( "utf-8" ) ) & 0xffffffff
+    for k in range( 1 + seed % 4 ):
+        seed = (seed * 1103515245 + 12345) % 2 ** 31
+        length = min( qlen, 200 + seed % 800 )
+        qstart = 1 + (seed // 7) % max( 1, qlen - length + 1 )
+        qend = qstart + length - 1
+        minus = seed % 2 == 1
+        sstart, send = (length, 1) if minus else (1, length)
+        pident = 70 + seed % 30
+        yield [
+            name, "GENE{}|s__Species_{}".format( seed % 1000, seed % 5 ), qlen, length, length,
+            qstart, qend, sstart, send, "{:.3f}".format( pident ), length * pident // 100,
+            0, "1e-50", "{:.1f}".format( length * 1.5 ), "minus" if minus else "plus",
+            ]
+
+def main( ):
+    args = get_args( )
+    fh = sys.stdout if args.out is None else open( args.out, "w" )
+    for counter, [name, seq] in enumerate( iter_fasta( args.query ) ):
+        if counter == args.fail_after:
+            fh.flush( )
+            sys.exit( "fake_blastn: failing after {} contigs".format( counter ) )
+        for row in fake_hits( name, seq ):
+            print( "\t".join( map( str, row ) ), file=fh )
+    if fh is not sys.stdout:
+        fh.close( )
+
+if __name__ == "__main__":
+    main( )
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""
+Writes a deterministic mapping of simulated read pairs to a set of contigs,
+as bowtie2 would report it (mates adjacent, a few pairs unaligned), for
+testing waafle_junctions without reads or bowtie2. The output is SAM, or
+gzipped SAM if <out> ends in .gz, or BAM if it ends in .bam.
+
+e.g. python test/fake_sam.py demo/input/demo_contigs.fna -out reads.bam
+"""
+
+from __future__ import print_function
+import gzip
+import random
+import struct
+import zlib
+import argparse
+
+c_read_length = 100
+c_cigars      = ["100M"] * 12 + ["30S70M", "60M2I38M", "45M3D55M", "98M2S", "48=1X51="]
+c_cigar_ops   = "MIDNSHP=X"
+
+def get_args( ):
+    parser = argparse.ArgumentParser( )
+    parser.add_argument( "contigs" )
+    parser.add_argument( "-out", required=True )
+    parser.add_argument( "-pairs", type=int, default=20000 )
+    parser.add_argument( "-seed", type=int, default=1 )
+    parser.add_argument( "-basic-cigars", action="store_true", help="only M/I/D/S cigars (no =/X), as older readers expect" )
+    return parser.parse_args( )
+
+def read_contigs( path ):
+    contigs, name = [], None
+    with open( path ) as fh:
+        for line in fh:
+            line = line.strip( )
+            if line.startswith( ">" ):
+                name = line[1:].split( )[0]
+                contigs.append( [name, []] )
+            elif name is not None:
+                contigs[-1][1].append( line )
+    return [[name, "".join( seq )] for name, seq in contigs]
+
+def iter_rows( contigs, pairs, seed, cigars=c_cigars ):
+    rng = random.Random( seed )
+    weights = [len( seq ) for name, seq in contigs]
+    total = sum( weights )
+    for pair in range( pairs ):
+        qname = "read{:08d}".format( pair )
+        if rng.random( ) < 0.03:
+            for flag in [77, 141]:
+                yield [qname, flag, "*", 0, 0, "*", "*", 0, 0, "N" * c_read_length, "I" * c_read_length]
+            continue
+        # contig chosen by length, fragment placed uniformly on it
+        pick = rng.randrange( total )
+        for name, seq in contigs:
+            if pick < len( seq ):
+                break
+            pick -= len( seq )
+        size = rng.randint( 200, 500 )
+        if len( seq ) < size:
+            continue
+        start = rng.randrange( len( seq ) - size + 1 )
+        pos1, pos2 = start + 1, start + size - c_read_length + 1
+        read1 = seq[start:start + c_read_length]
+        read2 = seq[start + size - c_read_length:start + size]
+        yield [qname, 99, name, pos1, 42, rng.choice( cigars ), "=", pos2, size, read1, "I" * len( read1 )]
+        yield [qname, 147, name, pos2, 42, rng.choice( cigars ), "=", pos1, -size, read2, "I" * len( read2 )]
+
+def get_header( contigs ):
+    lines = ["@HD\tVN:1.0\tSO:unsorted"]
+    lines += ["@SQ\tSN:{}\tLN:{}".format( name, len( seq ) ) for name, seq in contigs]
+    return "".join( line + "\n" for line in lines )
+
+def pack_bam_record( row, refids ):
+    qname, flag, rname, pos, mapq, cigar, rnext, pnext, tlen, seq, qual = row
+    name = qname.encode( "ascii" ) + b"\0"
+    ops = []
+    if cigar != "*":
+        number = ""
+        for char in cigar:
+            if char.isdigit( ):
+                number += char
+            else:
+                ops.append( int( number ) << 4 | c_cigar_ops.index( char ) )
+                number = ""
+    codes = ["=ACMGRSVTWYHKDBN".find( base ) % 16 for base in seq.upper( )]
+    codes += [0] * (len( codes ) % 2)
+    packed = bytearray( codes[i] << 4 | codes[i + 1] for i in range( 0, len( codes ), 2 ) )
+    refid = refids.get( rname, -1 )
+    nextid = refid if rnext == "=" else -1
+    body = struct.pack( "<iiBBHHHiiii", refid, pos - 1, len( name ), mapq, 4680, len( ops ),
+                        flag, len( seq ), nextid, pnext - 1, tlen )
+    body += name + struct.pack( "<{}I".format( len( ops ) ), *ops ) + bytes( packed )
+    body += bytearray( ord( q ) - 33 for q in qual )
+    return struct.pack( "<i", len( body ) ) + body
+
+def write_bgzf( data, fh ):
+    """ BGZF blocks of <= 60 kB of <data>, then the empty EOF block """
+    for i in range( 0, len( data ), 60000 ):
+        block = data[i:i + 60000]
+        packer = zlib.compressobj( 6, zlib.DEFLATED, -15 )
+        payload = packer.compress( block ) + packer.flush( )
+        fh.write( b"\x1f\x8b\x08\x04\0\0\0\0\0\xff\x06\0BC\x02\0" + struct.pack( "<H", len( payload ) + 25 ) )
+        fh.write( payload + struct.pack( "<II", zlib.crc32( block ) & 0xffffffff, len( block ) ) )
+    fh.write( b"\x1f\x8b\x08\x04\0\0\0\0\0\xff\x06\0BC\x02\0\x1b\0\x03\0\0\0\0\0\0\0\0\0" )
+
+def main( ):
+    args = get_args( )
+    contigs = read_contigs( args.contigs )
+    header = get_header( contigs )
+    cigars = [k for k in c_cigars if "=" not in k and "X" not in k] if args.basic_cigars else c_cigars
+    rows = iter_rows( contigs, args.pairs, args.seed, cigars )
+    if args.out.endswith( ".bam" ):
+        refids = {name: i for i, [name, seq] in enumerate( contigs )}
+        data = [b"BAM\x01", struct.pack( "<i", len( header ) ), header.encode( "ascii" )]
+        data.append( struct.pack( "<i", len( contigs ) ) )
+        for name, seq in contigs:
+            data.append( struct.pack( "<i", len( name ) + 1 ) + name.encode( "ascii" ) + b"\0" )
+            data.append( struct.pack( "<i", len( seq ) ) )
+        data += [pack_bam_record( row, refids ) for row in rows]
+        with open( args.out, "wb" ) as fh:
+            write_bgzf( b"".join( data ), fh )
+    else:
+        fh = gzip.open( args.out, "wt" ) if args.out.endswith( ".gz" ) else open( args.out, "w" )
+        fh.write( header )
+        for row in rows:
+            print( "\t".join( map( str, row ) ), file=fh )
+        fh.close( )
+
+if __name__ == "__main__":
+    main( )
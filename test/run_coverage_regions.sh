@@ -0,0 +1,67 @@
+# checks that waafle_coverage --region exports exactly the matching slice
+# of the full per-site depths, for whole contigs and 1-based, inclusive
+# regions (first base, last base, and interior), and that regions outside
+# a contig or on an unknown contig are rejected
+
+PYTHONPATH=$PYTHONPATH:..
+export PYTHONPATH
+
+python fake_sam.py \
+       ../demo/input/demo_contigs.fna \
+       -pairs 20000 \
+       -out coverage_reads.sam \
+
+python ../waafle/waafle_junctions.py \
+       ../demo/input/demo_contigs.fna \
+       ../demo/output/demo_contigs.gff \
+       --sam coverage_reads.sam \
+       --basename coverage_reads \
+       --write-detailed-output \
+
+python ../waafle/waafle_coverage.py \
+       coverage_reads.coverage.wcov \
+       --out coverage_all.tsv \
+
+# the first contig and its length, from the full export
+read contig length <<< $(awk -F '\t' 'NR == 2 {print $1, split( $4, k, " " )}' coverage_all.tsv)
+regions="$contig $contig:1-1 $contig:1-$length $contig:$length-$length $contig:101-600"
+
+status=0
+python ../waafle/waafle_coverage.py \
+       coverage_reads.coverage.wcov \
+       $(for region in $regions; do echo --region $region; done) \
+       --out coverage_regions.tsv \
+       || status=1
+
+python -c "
+import sys, re
+def read( path ):
+    rows = [line.rstrip( '\n' ).split( '\t' ) for line in open( path )][1:]
+    return [[row[0], row[3].split( ' ' )] for row in rows]
+full = dict( read( 'coverage_all.tsv' ) )
+regions = read( 'coverage_regions.tsv' )
+if [label for label, depths in regions] != sys.argv[1:]:
+    sys.exit( 'Exported regions differ from those requested' )
+for label, depths in regions:
+    match = re.search( r'^(.*):([0-9]+)-([0-9]+)$', label )
+    if match is None:
+        expected = full[label]
+    else:
+        expected = full[match.group( 1 )][int( match.group( 2 ) ) - 1:int( match.group( 3 ) )]
+    if depths != expected:
+        sys.exit( 'Depths differ for region: ' + label )
+" $regions || status=1
+
+for region in $contig:0-10 $contig:10-5 $contig:1-$((length + 1)) no_such_contig; do
+    python ../waafle/waafle_coverage.py \
+           coverage_reads.coverage.wcov \
+           --region $region \
+           --out coverage_bad.tsv \
+           2> /dev/null \
+           && echo "Accepted a bad region: $region" && status=1
+done
+
+if [ $status -eq 0 ]; then
+    echo "Coverage regions match the full export."
+fi
+exit $status
@@ -0,0 +1,40 @@
+# checks that waafle_junctions --workers matches serial mode exactly, for
+# SAM, gzipped SAM, and BAM input; uses reads simulated by fake_sam.py
+# (60k pairs, so the inputs span several chunks), so bowtie2 need not be installed
+
+PYTHONPATH=$PYTHONPATH:..
+export PYTHONPATH
+
+status=0
+for sam in demo_reads.sam demo_reads.sam.gz demo_reads.bam; do
+
+    python fake_sam.py \
+           ../demo/input/demo_contigs.fna \
+           -pairs 60000 \
+           -out $sam \
+
+    python ../waafle/waafle_junctions.py \
+           ../demo/input/demo_contigs.fna \
+           ../demo/output/demo_contigs.gff \
+           --sam $sam \
+           --write-detailed-output \
+           --basename $sam.serial \
+
+    python ../waafle/waafle_junctions.py \
+           ../demo/input/demo_contigs.fna \
+           ../demo/output/demo_contigs.gff \
+           --sam $sam \
+           --workers 3 \
+           --queue-depth 4 \
+           --write-detailed-output \
+           --basename $sam.workers \
+
+    for ext in junctions.tsv gene_hits.tsv coverage.wcov; do
+        cmp $sam.serial.$ext $sam.workers.$ext || status=1
+    done
+done
+
+if [ $status -eq 0 ]; then
+    echo "Junctions with --workers match serial mode."
+fi
+exit $status
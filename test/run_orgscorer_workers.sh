@@ -0,0 +1,41 @@
+# checks that waafle_orgscorer --workers (with and without --stream)
+# matches a default, single-process run exactly on the demo data; a
+# --stream-buffer of 2 spills and merges sorted runs on the way out, and
+# one of 1 spills more runs (115) than are merged at once (64)
+
+PYTHONPATH=$PYTHONPATH:..
+export PYTHONPATH
+
+orgscorer ( ) {
+    python ../waafle/waafle_orgscorer.py \
+           ../demo/input/demo_contigs.fna \
+           ../demo/output/demo_contigs.blastout \
+           ../demo/output/demo_contigs.gff \
+           ../demo/input/demo_taxonomy.tsv \
+           --quiet \
+           "$@"
+}
+
+orgscorer --basename orgscorer_serial
+
+status=0
+check ( ) {
+    name=$1
+    shift
+    orgscorer --basename $name "$@"
+    for ext in lgt.tsv no_lgt.tsv unclassified.tsv; do
+        cmp orgscorer_serial.$ext $name.$ext || status=1
+    done
+}
+
+check orgscorer_workers --workers 3
+check orgscorer_stream --stream
+check orgscorer_stream_workers --stream --workers 3
+check orgscorer_stream_spill --stream --stream-buffer 2
+check orgscorer_stream_spill_workers --stream --stream-buffer 2 --workers 3
+check orgscorer_stream_fanin --stream --stream-buffer 1
+
+if [ $status -eq 0 ]; then
+    echo "Orgscorer outputs with --workers/--stream match the default run."
+fi
+exit $status
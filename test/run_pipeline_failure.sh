@@ -0,0 +1,32 @@
+# checks that waafle_pipeline --workers exits with an error (rather than
+# hanging) when blastn fails part-way; uses the fake_blastn.py stub
+
+PYTHONPATH=$PYTHONPATH:..
+export PYTHONPATH
+
+timeout 300 python ../waafle/waafle_pipeline.py \
+       ../demo/input/demo_contigs.fna \
+       fake_db \
+       ../demo/input/demo_taxonomy.tsv \
+       --blastn "python fake_blastn.py -fail_after 20" \
+       --workers 2 \
+       --basename failing_search \
+       2> failing_search.log \
+
+status=$?
+if [ $status -eq 124 ]; then
+    echo "Pipeline hung after blastn failed."
+    exit 1
+elif [ $status -eq 0 ]; then
+    echo "Pipeline did not report the blastn failure."
+    exit 1
+elif [ $status -eq 2 ]; then
+    # argparse (or python itself) rejected the command line
+    echo "Pipeline did not start (status 2); see failing_search.log."
+    exit 1
+elif ! grep -q "blastn exited with status" failing_search.log; then
+    echo "Pipeline failed (status $status) for another reason; see failing_search.log."
+    exit 1
+else
+    echo "Pipeline exited with status $status after blastn failed."
+fi
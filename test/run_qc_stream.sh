@@ -0,0 +1,67 @@
+# checks that waafle_qc --stream matches the default (in-memory) join:
+# co-sorted inputs take the merge join, others the partitioned join;
+# uses a junctions report from reads simulated by fake_sam.py
+
+PYTHONPATH=$PYTHONPATH:..
+export PYTHONPATH
+
+python fake_sam.py \
+       ../demo/input/demo_contigs.fna \
+       -pairs 20000 \
+       -out qc_reads.sam \
+
+python ../waafle/waafle_junctions.py \
+       ../demo/input/demo_contigs.fna \
+       ../demo/output/demo_contigs.gff \
+       --sam qc_reads.sam \
+       --basename qc_reads \
+
+# sorted and shuffled copies of both inputs; the junctions of the first
+# lgt contig are dropped, so that one has no junction data
+python -c "
+import random
+def split( path ):
+    lines = open( path ).readlines( )
+    return lines[0], lines[1:]
+def write( path, header, rows ):
+    open( path, 'w' ).writelines( [header] + rows )
+head, lgt = split( '../demo/output/demo_contigs.lgt.tsv' )
+missing = lgt[0].split( '\t' )[0]
+lgt.sort( key=lambda row: row.split( '\t' )[0] )
+write( 'qc_sorted.lgt.tsv', head, lgt )
+random.Random( 1 ).shuffle( lgt )
+write( 'qc_shuffled.lgt.tsv', head, lgt )
+head, junctions = split( 'qc_reads.junctions.tsv' )
+junctions = [row for row in junctions if row.split( '\t' )[0] != missing]
+junctions.sort( key=lambda row: row.split( '\t' )[0] )
+write( 'qc_sorted.junctions.tsv', head, junctions )
+random.Random( 1 ).shuffle( junctions )
+write( 'qc_shuffled.junctions.tsv', head, junctions )
+"
+
+qc ( ) {
+    python ../waafle/waafle_qc.py \
+           qc_$1.lgt.tsv \
+           qc_$2.junctions.tsv \
+           --min-junction-hits 3 \
+           --min-junction-ratio 1 \
+           --outfile qc_$1_$2$3.qc_pass \
+           $4 \
+
+}
+
+status=0
+for lgt in sorted shuffled; do
+    qc $lgt sorted "" ""
+    for junctions in sorted shuffled; do
+        qc $lgt $junctions _stream --stream
+        cmp qc_${lgt}_sorted.qc_pass qc_${lgt}_${junctions}_stream.qc_pass || status=1
+    done
+    qc $lgt shuffled "" ""
+    cmp qc_${lgt}_sorted.qc_pass qc_${lgt}_shuffled.qc_pass || status=1
+done
+
+if [ $status -eq 0 ]; then
+    echo "waafle_qc --stream matches the in-memory join."
+fi
+exit $status
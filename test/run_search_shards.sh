@@ -0,0 +1,38 @@
+# checks that a sharded waafle_search (--processes) matches a single blastn call;
+# uses the fake_blastn.py stub, so BLAST need not be installed
+
+PYTHONPATH=$PYTHONPATH:..
+export PYTHONPATH
+
+python ../waafle/waafle_search.py \
+       ../demo/input/demo_contigs.fna \
+       fake_db \
+       --blastn "python fake_blastn.py" \
+       --out single.blastout \
+
+python ../waafle/waafle_search.py \
+       ../demo/input/demo_contigs.fna \
+       fake_db \
+       --blastn "python fake_blastn.py" \
+       --threads 4 \
+       --processes 3 \
+       --out sharded.blastout \
+
+cmp single.blastout sharded.blastout && echo "Sharded search output matches."
+
+# contigs with duplicate names stay separate records when split into chunks
+printf ">a\nACGTACGT\n>b\nACGT\n>a\nACGTACGTAA\n>c\nAC\n" > duplicates.fna
+
+python fake_blastn.py \
+       -query duplicates.fna \
+       -db fake_db \
+       -out duplicates.single.blastout \
+
+python ../waafle/waafle_search.py \
+       duplicates.fna \
+       fake_db \
+       --blastn "python fake_blastn.py" \
+       --processes 2 \
+       --out duplicates.sharded.blastout \
+
+cmp duplicates.single.blastout duplicates.sharded.blastout && echo "Sharded search of duplicate names matches."
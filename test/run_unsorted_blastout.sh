@@ -0,0 +1,67 @@
+# checks that a blastout whose rows are not grouped by contig (here, the
+# demo blastout shuffled) gives the same results as the sorted original,
+# and that waafle_genecaller --workers matches serial mode on both
+
+PYTHONPATH=$PYTHONPATH:..
+export PYTHONPATH
+
+python -c "
+import random
+lines = open( '../demo/output/demo_contigs.blastout' ).readlines( )
+random.Random( 1 ).shuffle( lines )
+open( 'shuffled.blastout', 'w' ).writelines( lines )
+"
+
+status=0
+for blastout in ../demo/output/demo_contigs.blastout shuffled.blastout; do
+    python ../waafle/waafle_orgscorer.py \
+           ../demo/input/demo_contigs.fna \
+           $blastout \
+           ../demo/output/demo_contigs.gff \
+           ../demo/input/demo_taxonomy.tsv \
+           --basename $(basename $blastout .blastout) \
+           --quiet \
+
+done
+for ext in lgt.tsv no_lgt.tsv unclassified.tsv; do
+    cmp demo_contigs.$ext shuffled.$ext || status=1
+done
+
+# genes are written in order of first appearance, so compare them sorted
+for blastout in ../demo/output/demo_contigs.blastout shuffled.blastout; do
+    python ../waafle/waafle_genecaller.py \
+           $blastout \
+           --gff $(basename $blastout .blastout).gff \
+
+    sort $(basename $blastout .blastout).gff > $(basename $blastout .blastout).sorted.gff
+done
+cmp demo_contigs.sorted.gff shuffled.sorted.gff || status=1
+
+# --workers must give exactly the serial GFF, also from gzipped input and
+# from 120 renamed, shuffled copies of the demo (~21 MB, so two shards)
+gzip -c shuffled.blastout > shuffled.blastout.gz
+python -c "
+import random
+lines = open( '../demo/output/demo_contigs.blastout' ).readlines( )
+scaled = [line.replace( '\t', '_{}\t'.format( k ), 1 ) for k in range( 120 ) for line in lines]
+random.Random( 1 ).shuffle( scaled )
+open( 'shuffled_scaled.blastout', 'w' ).writelines( scaled )
+"
+for blastout in ../demo/output/demo_contigs.blastout shuffled.blastout.gz shuffled_scaled.blastout; do
+    name=$(basename $blastout)
+    python ../waafle/waafle_genecaller.py \
+           $blastout \
+           --gff $name.serial.gff \
+
+    python ../waafle/waafle_genecaller.py \
+           $blastout \
+           --workers 3 \
+           --gff $name.workers.gff \
+
+    cmp $name.serial.gff $name.workers.gff || status=1
+done
+
+if [ $status -eq 0 ]; then
+    echo "Outputs from the shuffled blastout match the sorted one."
+fi
+exit $status
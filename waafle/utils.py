@@ -33,7 +33,21 @@ import csv
 import re
 import gzip
 import bz2
+import codecs
+import hashlib
+import itertools
+import heapq
+import struct
+import zlib
+import shutil
+import tempfile
+import threading
 from collections import OrderedDict
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 
@@ -71,6 +85,52 @@ def try_open( path, *args ):
         sys.exit( "Can't open file: {}".format( path ) )
     return fh
 
+def hash_file( path ):
+    """ SHA-1 of a file's contents """
+    h = hashlib.sha1( )
+    with open( path, "rb" ) as fh:
+        for block in iter( lambda: fh.read( 2 ** 20 ), b"" ):
+            h.update( block )
+    return h.hexdigest( )
+
+# items per hand-off between a reader thread and its consumer
+c_queue_batch = 2 ** 12
+
+def fill_queue( items, buffer, batch ):
+    try:
+        while True:
+            chunk = list( itertools.islice( items, batch ) )
+            if len( chunk ) == 0:
+                break
+            buffer.put( chunk )
+        buffer.put( None )
+    except BaseException as e:
+        # re-raised by the consumer (incl. SystemExit from die)
+        buffer.put( e )
+
+def iter_threaded( items, depth, batch=c_queue_batch ):
+    """ 
+    Draw <items> on a reader thread, at most <depth> batches ahead
+    of the consumer, so that producing and consuming them overlap
+    (the thread starts now, not at the first next)
+    """
+    buffer = queue.Queue( maxsize=depth )
+    thread = threading.Thread( target=fill_queue, args=( iter( items ), buffer, batch ) )
+    thread.daemon = True
+    thread.start( )
+    return drain_queue( buffer, thread )
+
+def drain_queue( buffer, thread ):
+    while True:
+        chunk = buffer.get( )
+        if chunk is None:
+            break
+        elif isinstance( chunk, BaseException ):
+            raise chunk
+        for item in chunk:
+            yield item
+    thread.join( )
+
 def describe( text, width=80, margin=2 ):
     margin = " " * margin
     # remove flanking whitespace
@@ -106,19 +166,217 @@ def describe( text, width=80, margin=2 ):
     newlines += ["\n", rule]
     return "\n".join( [k for k in newlines] )
 
-def read_contig_lengths( fasta ):
-    data = OrderedDict( )
-    header = None
-    with try_open( fasta ) as fh:
-        for line in fh:
-            line = line.strip( )
-            if line[0] == ">":
-                header = line[1:].split( )[0]
-                data[header] = 0
-            else:
-                data[header] += len( line )
+# FASTA index sidecar (samtools faidx layout)
+c_fai_ext         = ".fai"
+# bytes of FASTA scanned at once when building an index
+c_fai_chunk_bytes = 2 ** 24
+# bytes in sequence lines that aren't bases
+c_fai_blanks      = [b"\n", b"\r", b" ", b"\t"]
+# records whose header is checked against the FASTA before trusting a .fai
+c_fai_checks      = 64
+# longest header line looked for when checking a .fai
+c_fai_peek        = 2 ** 12
+
+def read_contig_lengths( fasta, write_index=False ):
+    """
+    Contig name -> length (in file order). Uses <fasta>.fai if it matches
+    <fasta> (see read_fasta_index); otherwise scans <fasta>. If <write_index>,
+    the scan is saved as <fasta>.fai, but only for an uncompressed FASTA
+    with the regular line layout that samtools-style indexes require
+    """
+    data = read_fasta_index( fasta )
+    if data is not None:
+        return data
+    write_index = write_index and not is_compressed( fasta )
+    records, regular = index_fasta( fasta, check_layout=write_index )
+    data = OrderedDict( (record[0], record[1]) for record in records )
+    if write_index:
+        index = fasta + c_fai_ext
+        if not regular:
+            say( "  Not writing FASTA index", index, "(irregular line widths)" )
+            return data
+        try:
+            with open( index, "w" ) as fh:
+                for record in records:
+                    print( "\t".join( map( str, record ) ), file=fh )
+        except (IOError, OSError):
+            say( "  Can't write FASTA index", index, "(continuing without it)" )
     return data
 
+def is_compressed( path ):
+    return path.endswith( ".gz" ) or path.endswith( ".bz2" )
+
+def read_fasta_index( fasta ):
+    """
+    Contig name -> length from <fasta>.fai, or None if there is no usable index:
+    <fasta> must be uncompressed, and the index no older than <fasta> and
+    consistent with it (the file size implied by the last record, and the
+    header line before each of ~c_fai_checks records), so that a FASTA
+    replaced by one with an older timestamp is not misread
+    """
+    index = fasta + c_fai_ext
+    if is_compressed( fasta ) or not os.path.exists( index ):
+        return None
+    if os.path.getmtime( index ) < os.path.getmtime( fasta ):
+        return None
+    with open( index ) as fh:
+        records = [line.rstrip( "\n" ).split( "\t" ) for line in fh]
+    if any( len( items ) < 5 or not all( k.isdigit( ) for k in items[1:5] ) for items in records ):
+        return None
+    records = [[items[0]] + [int( k ) for k in items[1:5]] for items in records]
+    if len( records ) > 0:
+        # the last record must end where the file does (with or without a final newline)
+        name, length, start, linebases, linewidth = records[-1]
+        full, rest = divmod( length, linebases ) if linebases > 0 else [0, 0]
+        end = start + full * linewidth + (rest + linewidth - linebases if rest > 0 else 0)
+        if os.path.getsize( fasta ) not in [end, end - (linewidth - linebases)]:
+            return None
+        step = max( 1, len( records ) // c_fai_checks )
+        with open( fasta, "rb" ) as fh:
+            for name, length, start, linebases, linewidth in records[::step] + records[-1:]:
+                fh.seek( max( 0, start - c_fai_peek ) )
+                text = fh.read( start - max( 0, start - c_fai_peek ) )
+                header = text[text.rfind( b"\n", 0, len( text ) - 1 ) + 1:]
+                if not header.endswith( b"\n" ) or header[1:].split( )[:1] != [name.encode( "utf-8" )] \
+                        or not header.startswith( b">" ):
+                    return None
+    return OrderedDict( (record[0], record[1]) for record in records )
+
+def index_fasta( fasta, check_layout=False ):
+    """
+    Scan <fasta> (as bytes, in chunks) for .fai records:
+    [name, length, offset of first base, bases per line, bytes per line]
+    Newline, header, and blank positions are found per chunk with NumPy;
+    lengths count all sequence bytes except whitespace. Returns [records,
+    regular]: if <check_layout>, regular is True if every line of a record
+    but the last is as wide as its first, with no other blanks (as a .fai
+    requires); otherwise it is None
+    """
+    records, counts, current = [], [], None
+    offset, carry, line_start, last = 0, b"", True, b""
+    regular, pending = check_layout, None
+    with try_open( fasta, "rb" ) as fh:
+        while True:
+            chunk = fh.read( c_fai_chunk_bytes )
+            data = carry + chunk
+            if chunk == b"" and data != b"" and not data.endswith( b"\n" ):
+                data += b"\n"
+            array = np.frombuffer( data, dtype=np.uint8 )
+            newlines = np.flatnonzero( array == ord( "\n" ) )
+            # headers: ">" at the start of a line (a carried header always is)
+            after = newlines[newlines + 1 < len( array )] + 1
+            heads = after[array[after] == ord( ">" )]
+            if (line_start or len( carry ) > 0) and data.startswith( b">" ):
+                heads = np.concatenate( [[0], heads] ).astype( np.int64 )
+            ends = np.searchsorted( newlines, heads )
+            carry, used = b"", len( data )
+            if len( heads ) > 0 and ends[-1] == len( newlines ):
+                # the last header continues in the next chunk
+                used = int( heads[-1] )
+                carry, heads, ends = data[used:], heads[:-1], ends[:-1]
+            ends = newlines[ends]
+            # sequence segments: before the first header, then after each header line
+            starts = np.concatenate( [[0], ends + 1] ).astype( np.int64 )
+            stops = np.concatenate( [heads, [used]] ).astype( np.int64 )
+            # (blanks in header lines are outside every segment, so don't count)
+            blanks = [newlines] + [np.flatnonzero( array == ord( k ) ) for k in c_fai_blanks[1:] if k in data]
+            blanks = np.sort( np.concatenate( blanks ) ) if len( blanks ) > 1 else newlines
+            lengths = stops - starts - ( np.searchsorted( blanks, stops ) - np.searchsorted( blanks, starts ) )
+            # each segment's first newline (if any) gives its line width
+            firsts = np.append( newlines, used )[np.searchsorted( newlines, starts )]
+            found = firsts < stops
+            widths = firsts - starts + 1
+            # the first segment continues the current record
+            head = current
+            if current is not None:
+                current[1] += int( lengths[0] )
+                if current[4] is None and found[0]:
+                    current[4] = offset + int( firsts[0] ) + 1 - current[2]
+                    before = data[firsts[0] - 1:firsts[0]] if firsts[0] > 0 else last
+                    current[3] = current[4] - (2 if before == b"\r" else 1)
+            # the others start new records (their first line ends after the header's newline)
+            crlf = array[firsts[1:] - 1] == ord( "\r" )
+            names = [data[h + 1:e].split( )[0].decode( "utf-8" ) for h, e in zip( heads.tolist( ), ends.tolist( ) )]
+            for name, seq_start, length, width, cr, ok in zip( 
+                    names, (offset + starts[1:]).tolist( ), lengths[1:].tolist( ), 
+                    widths[1:].tolist( ), crlf.tolist( ), found[1:].tolist( ) ):
+                current = [name, length, seq_start, width - 1 - cr if ok else None, width if ok else None]
+                records.append( current )
+                counts.append( 0 )
+            if regular:
+                regular, pending = check_fasta_layout( 
+                    array, offset, newlines, starts, stops, widths, found, head, counts, pending )
+            offset += used
+            line_start = data[:used].endswith( b"\n" )
+            last = data[used - 1:used] if used > 0 else last
+            if chunk == b"":
+                break
+    # records without a complete sequence line: empty, or one line at EOF lacking "\n"
+    for record in records:
+        if record[4] is None:
+            record[3:5] = [0, 0] if record[2] >= offset else [record[1], offset - record[2] + 1]
+    if not check_layout:
+        return [records, None]
+    if len( counts ) > 0 and last not in [b"", b"\n"]:
+        # the file's last line lacks a newline, so the one before it wasn't the record's last
+        counts[-1] += 1
+        regular = regular and (pending is None or check_fasta_pending( pending ))
+    # a record's last line may be short, but not long (or follow an empty first line)
+    for record, count in zip( records, counts ):
+        if record[1] > 0 and (record[3] == 0 or record[1] > count * record[3]):
+            regular = False
+    return [records, regular]
+
+def check_fasta_layout( array, offset, newlines, starts, stops, widths, found, head, counts, pending ):
+    """
+    Check the line layout of one chunk for index_fasta: within a record, each
+    newline but the last must fall at a multiple of the first line's width
+    from the record's start. The last newline of the chunk's final (open)
+    segment is returned as <pending>: it is checked once the record goes on
+    (and is exempt if the record ends first)
+    """
+    # segment of each newline (those in header lines are skipped)
+    seg = np.searchsorted( starts, newlines, side="right" ) - 1
+    inside = newlines < stops[seg]
+    seg, positions = seg[inside], newlines[inside] + offset
+    per = np.bincount( seg, minlength=len( starts ) )
+    # segment 0 continues <head> (or precedes the first header)
+    rec_starts = offset + starts
+    rec_widths = np.where( found, widths, 0 )
+    if head is None:
+        if per[0] > 0 or stops[0] > starts[0]:
+            return [False, None]
+    else:
+        rec_starts[0], rec_widths[0] = head[2], head[4] or 0
+        counts[-len( starts )] += int( per[0] )
+        if pending is not None and per[0] > 0 and not check_fasta_pending( pending ):
+            return [False, None]
+    for k in range( 1, len( starts ) ):
+        counts[k - len( starts )] = int( per[k] )
+    # other blanks in sequence lines; a "\r" must end its line
+    for char in [" ", "\t", "\r"]:
+        spots = np.flatnonzero( array == ord( char ) )
+        if char == "\r":
+            spots = spots[spots + 1 < len( array )]
+            spots = spots[array[spots + 1] != ord( "\n" )]
+        spot_segs = np.searchsorted( starts, spots, side="right" ) - 1
+        if np.any( spots < stops[spot_segs] ):
+            return [False, None]
+    # each segment's last newline is exempt (but the open segment's is pending)
+    closing = np.append( seg[1:] != seg[:-1], True )[:len( seg )]
+    if len( seg ) > 0 and seg[-1] == len( starts ) - 1:
+        pending = [int( positions[-1] ), int( rec_starts[seg[-1]] ), int( rec_widths[seg[-1]] )]
+    elif len( starts ) > 1 or per[0] > 0:
+        # (a record with no newline in this chunk keeps its pending one)
+        pending = None
+    check = ~closing
+    offsets = positions[check] - rec_starts[seg[check]] + 1
+    return [bool( np.all( offsets % rec_widths[seg[check]] == 0 ) ), pending]
+
+def check_fasta_pending( pending ):
+    position, start, width = pending
+    return (position - start + 1) % width == 0
+
 def write_rowdict( rowdict=None, format=None, file=None, 
                    delim="\t", precision=4, empty_field="--", ):
     """ write rowdict line conditioned on format """
@@ -240,6 +498,165 @@ class Hit( ):
                 system, name = k.split( "=" )
                 self.annotations[system] = name
 
+# ---------------------------------------------------------------
+# columnar (batched) blast hits
+# ---------------------------------------------------------------
+
+c_blast_dtypes = {int:np.int64, float:np.float64}
+# bytes of blastout parsed (or scanned by iter_hit_runs) together (contigs are never split)
+c_batch_bytes = 2 ** 22
+# initial span searched for the end of a query's run by iter_hit_runs
+c_scan_window = 2 ** 12
+# bytes of rows sorted in memory (one run) when grouping an unsorted blastout
+c_sort_bytes = 2 ** 26
+# max sorted runs merged at once when grouping an unsorted blastout
+c_sort_fanin = 64
+
+class SubjectTable( ):
+
+    """
+    Interns subject sequence ids (see Hit) as integer codes, parsing
+    each distinct sseqid only once per blastout file. Genes and taxa
+    are interned in turn, and each subject code points to its gene
+    and taxon codes.
+    """
+
+    def __init__( self ):
+        self.codes = {}
+        self.annotations = []
+        self.subject_gene = []
+        self.subject_taxon = []
+        self.genes, self.gene_codes = [], {}
+        self.taxa, self.taxon_codes = [], {}
+
+    def encode( self, sseqid ):
+        code = self.codes.get( sseqid, None )
+        if code is None:
+            items = sseqid.split( "|" )
+            if len( items ) < 2:
+                die( "bad subject id header:", sseqid )
+            geneid, taxon = items[0:2]
+            annotations = {}
+            for k in items[2:]:
+                system, name = k.split( "=" )
+                annotations[system] = name
+            if geneid not in self.gene_codes:
+                self.gene_codes[geneid] = len( self.genes )
+                self.genes.append( geneid )
+            if taxon not in self.taxon_codes:
+                self.taxon_codes[taxon] = len( self.taxa )
+                self.taxa.append( taxon )
+            code = self.codes[sseqid] = len( self.annotations )
+            self.annotations.append( annotations )
+            self.subject_gene.append( self.gene_codes[geneid] )
+            self.subject_taxon.append( self.taxon_codes[taxon] )
+        return code
+
+class HitRow( ):
+
+    """ Hit-like view of a single row of a HitBatch """
+
+    def __init__( self, batch, i ):
+        for fname in HitBatch.c_row_fields:
+            setattr( self, fname, getattr( batch, fname )[i].item( ) )
+        self.qseqid = batch.qseqids[i]
+        self.sseqid = batch.sseqid[i]
+        self.geneid = batch.genes[batch.gene_codes[i]]
+        self.taxon = batch.taxa[batch.taxon_codes[i]]
+        self.annotations = batch.annotations[batch.subject_codes[i]]
+
+class HitBatch( ):
+
+    """
+    Columnar alternative to a list of Hit objects.
+    Numeric BLAST fields become NumPy arrays, the derived coverage and
+    score columns of Hit are computed as vectorized expressions, and
+    subjects/genes/taxa are interned as integer codes into the tables
+    of a SubjectTable. Rows can be sliced (e.g. per contig) into new
+    batches that share those tables.
+    """
+
+    # numeric fields (+ derived values) copied into a HitRow
+    c_row_fields = [fname for fname, ftype in c_blast_fields if ftype is not str] + \
+        ["sstrand", "scov", "qcov", "ltrim", "rtrim", "scov_modified", "waafle_score"]
+    # per-row attributes (sliced by subset)
+    c_columns = c_row_fields + \
+        ["qseqids", "sseqid", "subject_codes", "gene_codes", "taxon_codes"]
+    # per-row code -> shared table
+    c_tables = [
+        ["subject_codes", "annotations"], 
+        ["gene_codes", "genes"], 
+        ["taxon_codes", "taxa"],
+        ]
+
+    def __init__( self, columns, subjects=None ):
+        """ <columns> holds one sequence of raw values per field in c_blast_fields """
+        subjects = SubjectTable( ) if subjects is None else subjects
+        # pull values from blast columns and coerce to appropriate types
+        for [fname, ftype], values in zip( c_blast_fields, columns ):
+            if ftype is str:
+                setattr( self, fname, list( values ) )
+            else:
+                setattr( self, fname, np.array( values, dtype=c_blast_dtypes[ftype] ) )
+        # query per row; qseqid is the shared query of a per-contig batch
+        self.qseqids = self.qseqid
+        self.qseqid = self.qseqids[0] if len( self.qseqids ) > 0 else None
+        # overrides
+        minus = np.array( self.sstrand, dtype=str ) == "minus"
+        self.sstrand = np.where( minus, "-", "+" )
+        # derived coverage stats
+        self.scov = ( np.abs( self.send - self.sstart ) + 1 ) / self.slen.astype( float )
+        self.qcov = ( np.abs( self.qend - self.qstart ) + 1 ) / self.qlen.astype( float )
+        # special scoverage that doesn't penalize hanging off contig end
+        sstart = np.where( minus, self.slen - self.sstart + 1, self.sstart )
+        send   = np.where( minus, self.slen - self.send + 1, self.send )
+        self.ltrim = np.maximum( 0, sstart - self.qstart )
+        self.rtrim = np.maximum( 0, self.slen - sstart - self.qlen + self.qstart )
+        self.scov_modified = (send - sstart + 1) / \
+            ( self.slen - self.ltrim - self.rtrim ).astype( float )
+        # waafle score
+        self.waafle_score = self.scov_modified * self.pident / 100.0
+        # values extracted from subject header (interned)
+        codes = subjects.codes
+        self.subject_codes = np.array( 
+            [codes[k] if k in codes else subjects.encode( k ) for k in self.sseqid],
+            dtype=np.int64 )
+        used, inverse = np.unique( self.subject_codes, return_inverse=True )
+        used = used.tolist( )
+        self.gene_codes = np.array( 
+            [subjects.subject_gene[k] for k in used], dtype=np.int64 )[inverse]
+        self.taxon_codes = np.array( 
+            [subjects.subject_taxon[k] for k in used], dtype=np.int64 )[inverse]
+        self.annotations = subjects.annotations
+        self.genes = subjects.genes
+        self.taxa = subjects.taxa
+
+    def __len__( self ):
+        return len( self.sseqid )
+
+    def __getstate__( self ):
+        """ when pickling (e.g. for --workers), only ship the table entries in use """
+        state = dict( self.__dict__ )
+        for column, table in self.c_tables:
+            used, state[column] = np.unique( state[column], return_inverse=True )
+            state[table] = [state[table][k] for k in used.tolist( )]
+        return state
+
+    def subset( self, start, stop ):
+        """ rows [start, stop) as a new HitBatch sharing this batch's tables """
+        batch = HitBatch.__new__( HitBatch )
+        batch.__dict__.update( self.__dict__ )
+        for column in self.c_columns:
+            setattr( batch, column, getattr( self, column )[start:stop] )
+        batch.qseqid = batch.qseqids[0] if stop > start else None
+        return batch
+
+    def iter_rows( self, select=None ):
+        """ yield Hit-like rows, optionally for a boolean/index selection """
+        indices = range( len( self ) ) if select is None else np.arange( len( self ) )[select]
+        for i in indices:
+            yield HitRow( self, i )
+
 # ---------------------------------------------------------------
 # blast utils
 # ---------------------------------------------------------------
@@ -252,10 +669,16 @@ def iter_hits( blastoutfile ):
         for row in csv.reader( fh, dialect="excel-tab" ):
             yield Hit( row )
 
-def iter_contig_hits( blastoutfile ):
+def iter_contig_hits( blastoutfile, columnar=False, tmpdir=None ):
     """
     Iterate through hits by contig (assumes file is sorted by query)
+    If <columnar>, each contig's hits are yielded as a HitBatch, and
+    the file need not be sorted (see iter_contig_hit_batches)
     """
+    if columnar:
+        for contig, batch in iter_contig_hit_batches( blastoutfile, tmpdir=tmpdir ):
+            yield contig, batch
+        return
     contig, hits = None, []
     with try_open( blastoutfile ) as fh:                 
         for row in csv.reader( fh, dialect="excel-tab" ):
@@ -269,6 +692,277 @@ def iter_contig_hits( blastoutfile ):
         # last case cleanup
         yield contig, hits
 
+def parse_hit_block( text, subjects=None ):
+    """ parse a block of complete blastout lines into a HitBatch in one pass """
+    nfields = len( c_blast_fields )
+    lines = text.count( "\n" )
+    fields = text.replace( "\r", "" ).replace( "\n", "\t" ).split( "\t" )[:-1]
+    if len( fields ) != nfields * lines:
+        # locate the offending row for the error message
+        for line in text.split( "\n" )[:-1]:
+            row = line.rstrip( "\r" ).split( "\t" )
+            if len( row ) != nfields:
+                die( "inconsistent blast row: {}".format( str( row ) ) )
+    columns = [fields[i::nfields] for i in range( nfields )]
+    return HitBatch( columns, subjects )
+
+def iter_hit_blocks( blastoutfile ):
+    """ yield blastout text in ~c_batch_bytes blocks of whole contigs """
+    with try_open( blastoutfile, "rb" ) as fh:
+        for text in iter_stream_hit_blocks( fh ):
+            yield text
+
+def iter_stream_hit_blocks( fh, tee=None ):
+    """
+    Yield text in ~c_batch_bytes blocks of whole contigs from an open
+    (binary) blastout stream, e.g. a blastn pipe; the raw data is also
+    written to <tee> if given
+    """
+    decoder = codecs.getincrementaldecoder( "utf-8" )( )
+    tail = text = ""
+    while True:
+        chunk = fh.read( c_batch_bytes )
+        if tee is not None:
+            tee.write( chunk )
+        text = tail + decoder.decode( chunk, final=len( chunk ) == 0 )
+        if len( chunk ) == 0:
+            break
+        # hold back the last (possibly incomplete) line, then the rest of its contig
+        cut = text.rfind( "\n" ) + 1
+        if cut > 0:
+            last = text[text.rfind( "\n", 0, cut - 1 ) + 1:cut]
+            prefix = last.split( "\t", 1 )[0] + "\t"
+            while cut > 0:
+                start = text.rfind( "\n", 0, cut - 1 ) + 1
+                if not text.startswith( prefix, start ):
+                    break
+                cut = start
+        if cut > 0:
+            yield text[:cut]
+        tail = text[cut:]
+    # last case cleanup (may lack a final newline)
+    if text != "":
+        yield text if text.endswith( "\n" ) else text + "\n"
+
+def iter_hit_runs( blastoutfile ):
+    """
+    Scan a blastout file for runs of adjacent rows with the same query;
+    yield [query, start, stop] byte ranges in file order as they are found
+    """
+    run = None
+    offset, tail = 0, b""
+    with try_open( blastoutfile, "rb" ) as fh:
+        while True:
+            chunk = fh.read( c_batch_bytes )
+            text = tail + chunk
+            if chunk == b"" and text != b"" and not text.endswith( b"\n" ):
+                text += b"\n"
+            # only whole lines are scanned; the remainder waits for the next chunk
+            cut = text.rfind( b"\n" ) + 1
+            pos = 0
+            while pos < cut:
+                stop = text.find( b"\n", pos, cut ) + 1
+                tab = text.find( b"\t", pos, stop )
+                name = text[pos:tab if tab >= 0 else stop - 1]
+                # jump to the query's last row in a growing window; the rows
+                # between must all be the query's, else walk row by row
+                prefix = b"\n" + name + b"\t"
+                window = c_scan_window
+                while stop < cut:
+                    limit = min( cut, stop - 1 + window )
+                    last = text.rfind( prefix, stop - 1, limit )
+                    if last < 0:
+                        break
+                    end = text.find( b"\n", last + 1, cut ) + 1
+                    if text.count( prefix, stop - 1, end ) != text.count( b"\n", stop - 1, end - 1 ):
+                        while stop < cut and text.startswith( prefix[1:], stop ):
+                            stop = text.find( b"\n", stop, cut ) + 1
+                        break
+                    stop = end
+                    window *= 2
+                if run is not None and run[0] == name and run[2] == offset + pos:
+                    # run continued from the previous chunk
+                    run[2] = offset + stop
+                else:
+                    if run is not None:
+                        yield run
+                    run = [name, offset + pos, offset + stop]
+                pos = stop
+            offset += cut
+            tail = text[cut:]
+            if chunk == b"":
+                break
+    if run is not None:
+        yield run
+
+def find_split_query( blastoutfile ):
+    """
+    Return the first query whose rows are not adjacent in <blastoutfile>
+    (e.g. concatenated outputs of sharded searches), or None if the file
+    is grouped by query; the scan stops at the first such query
+    """
+    seen = set( )
+    for name, start, stop in iter_hit_runs( blastoutfile ):
+        if name in seen:
+            return decode_block( name )
+        seen.add( name )
+    return None
+
+def iter_hit_shards( runs, shard_bytes=c_batch_bytes ):
+    """
+    Yield [[start, stop]] byte spans holding ~<shard_bytes> of whole queries
+    from the <runs> of a blastout file that is grouped by query
+    """
+    start = stop = None
+    for name, run_start, run_stop in runs:
+        start = run_start if start is None else start
+        stop = run_stop
+        if stop - start >= shard_bytes:
+            yield [[start, stop]]
+            start = None
+    if start is not None:
+        yield [[start, stop]]
+
+def seekable_copy( blastoutfile, tmpdir=None ):
+    """
+    Return a path to <blastoutfile> that can be read by byte offset; compressed
+    streams can't seek cheaply, so they are inflated to a temp file in <tmpdir>
+    (the caller removes it when the path differs from <blastoutfile>)
+    """
+    path = blastoutfile
+    if blastoutfile.endswith( ".gz" ) or blastoutfile.endswith( ".bz2" ):
+        fd, path = tempfile.mkstemp( prefix="waafle_hits.", suffix=".blastout", dir=tmpdir )
+        with os.fdopen( fd, "wb" ) as out, try_open( blastoutfile, "rb" ) as fh:
+            shutil.copyfileobj( fh, out )
+    return path
+
+def grouped_copy( blastoutfile, tmpdir=None ):
+    """
+    Write the rows of <blastoutfile> grouped by query (see iter_query_sorted_lines)
+    to a temp file in <tmpdir>; return its path (the caller removes it)
+    """
+    fd, path = tempfile.mkstemp( prefix="waafle_hits.", suffix=".blastout", dir=tmpdir )
+    with os.fdopen( fd, "wb" ) as out:
+        out.writelines( iter_query_sorted_lines( blastoutfile, tmpdir ) )
+    return path
+
+def read_hit_spans( fh, spans ):
+    """ read the [start, stop] byte <spans> of an open blastout as one text block """
+    pieces = []
+    for start, stop in spans:
+        fh.seek( start )
+        piece = fh.read( stop - start )
+        pieces.append( piece if piece.endswith( b"\n" ) else piece + b"\n" )
+    return decode_block( b"".join( pieces ) )
+
+def decode_block( data ):
+    return data if isinstance( data, str ) else data.decode( "utf-8" )
+
+def iter_query_sorted_lines( blastoutfile, tmpdir=None ):
+    """
+    Yield the (byte) rows of a blastout file grouped by query: queries in
+    order of first appearance, rows in file order. This is an external
+    merge sort: runs of ~c_sort_bytes are sorted in memory and spilled to
+    <tmpdir>, then merged, so memory is one run plus a rank per query.
+    """
+    ranks = {}
+    workdir = tempfile.mkdtemp( prefix="waafle_sort.", dir=tmpdir )
+    try:
+        runs, rows, size = [], [], 0
+        with try_open( blastoutfile, "rb" ) as fh:
+            for line in fh:
+                rank = ranks.setdefault( line.split( b"\t", 1 )[0], len( ranks ) )
+                rows.append( [rank, line if line.endswith( b"\n" ) else line + b"\n"] )
+                size += len( line )
+                if size >= c_sort_bytes:
+                    runs.append( write_sorted_run( rows, workdir ) )
+                    rows, size = [], 0
+                    # keep the number of open runs (and the final merge) bounded
+                    if len( runs ) >= c_sort_fanin:
+                        runs = [write_sorted_run( merge_sorted_runs( runs, ranks ), workdir, presorted=True )]
+        rows.sort( key=lambda row: row[0] )
+        for rank, line in merge_sorted_runs( runs, ranks, extra=rows ):
+            yield line
+    finally:
+        shutil.rmtree( workdir, ignore_errors=True )
+
+def write_sorted_run( rows, workdir, presorted=False ):
+    """ write [rank, line] <rows> (stably sorted by rank) to a file in <workdir> """
+    if not presorted:
+        rows.sort( key=lambda row: row[0] )
+    fd, path = tempfile.mkstemp( suffix=".run", dir=workdir )
+    with os.fdopen( fd, "wb" ) as fh:
+        for rank, line in rows:
+            fh.write( line )
+    return path
+
+def merge_sorted_runs( runs, ranks, extra=None ):
+    """ merge sorted runs into [rank, line] rows; ties go to earlier runs (file order) """
+    streams = [iter_sorted_run( path, ranks, index ) for index, path in enumerate( runs )]
+    if extra is not None:
+        streams.append( [rank, len( runs ), line] for rank, line in extra )
+    for rank, index, line in heapq.merge( *streams ):
+        yield [rank, line]
+
+def iter_sorted_run( path, ranks, index ):
+    """ yield [rank, <index>, line] for the rows of one run, then delete it """
+    with open( path, "rb" ) as fh:
+        for line in fh:
+            yield [ranks[line.split( b"\t", 1 )[0]], index, line]
+    os.remove( path )
+
+def iter_line_blocks( lines ):
+    """ join (byte) rows grouped by query into ~c_batch_bytes text blocks of whole contigs """
+    pieces, size, query = [], 0, None
+    for line in lines:
+        name = line.split( b"\t", 1 )[0]
+        if size >= c_batch_bytes and name != query:
+            yield decode_block( b"".join( pieces ) )
+            pieces, size = [], 0
+        query = name
+        pieces.append( line )
+        size += len( line )
+    if len( pieces ) > 0:
+        yield decode_block( b"".join( pieces ) )
+
+def iter_contig_hit_batches( blastoutfile, tmpdir=None ):
+    """
+    Iterate through hits by contig as HitBatch objects
+    Blocks of many contigs are parsed together and then sliced per contig
+    If the file is not grouped by query, its rows are first grouped by an
+    external sort (with temp files in <tmpdir>)
+    """
+    split = find_split_query( blastoutfile )
+    if split is None:
+        blocks = iter_hit_blocks( blastoutfile )
+    else:
+        say( "  Rows for some queries are not adjacent in", blastoutfile, "(e.g. {}); grouping by query".format( split ) )
+        blocks = iter_line_blocks( iter_query_sorted_lines( blastoutfile, tmpdir ) )
+    for contig, batch in iter_block_contigs( blocks ):
+        yield contig, batch
+
+def iter_block_contigs( blocks ):
+    """
+    Parse blocks of whole-contig blastout text; yield [contig, HitBatch]
+    per contig (one [None, <empty batch>] if there are no hits)
+    """
+    subjects = SubjectTable( )
+    contig, batch = None, None
+    for text in blocks:
+        block = parse_hit_block( text, subjects )
+        qseqids = block.qseqids
+        start = 0
+        for i in range( 1, len( qseqids ) + 1 ):
+            if i == len( qseqids ) or qseqids[i] != qseqids[start]:
+                if contig is not None:
+                    yield contig, batch
+                contig, batch = qseqids[start], block.subset( start, i )
+                start = i
+    # last case cleanup
+    if contig is None:
+        batch = parse_hit_block( "", subjects )
+    yield contig, batch
+
 # ---------------------------------------------------------------
 # ---------------------------------------------------------------
 # WORKING WITH GFFS
@@ -367,61 +1061,281 @@ def iter_contig_loci( gff_file, attach_annotations=True ):
 c_unknown = "Unknown"
 c_root    = "r__Root"
 
+# compiled (binary) taxonomy format: a header, then these arrays in order
+# (each 8-byte aligned), then the utf-8 clade names
+c_taxonomy_magic   = b"WAAFLETX"
+c_taxonomy_version = 1
+c_taxonomy_header  = np.dtype( [("magic", "S8"), ("version", "<i8"), ("size", "<i8"), ("nbytes", "<i8")] )
+c_taxonomy_arrays  = [
+    # name            dtype   length (as a function of clade count)
+    ["parent_ids",    "<i4",  lambda n: n],
+    ["listed",        "<i1",  lambda n: n],
+    ["child_offsets", "<i4",  lambda n: n + 1],
+    ["child_ids",     "<i4",  lambda n: max( 0, n - 1 )],
+    ["depths",        "<i4",  lambda n: n],
+    ["tin",           "<i4",  lambda n: n],
+    ["tout",          "<i4",  lambda n: n],
+    ["leaf_counts",   "<i8",  lambda n: n],
+    ["name_offsets",  "<i8",  lambda n: n + 1],
+    ]
+
 # ---------------------------------------------------------------
 # taxonomy object
 # ---------------------------------------------------------------
 
+class StringTable( ):
+
+    """ read-only list of strings stored as utf-8 bytes + offsets (e.g. in a mmap) """
+
+    def __init__( self, data, offsets ):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__( self ):
+        return len( self.offsets ) - 1
+
+    def __getitem__( self, i ):
+        return self.data[self.offsets[i]:self.offsets[i+1]].tobytes( ).decode( "utf-8" )
+
+class SortedIds( ):
+
+    """
+    Mapping of name -> index for a StringTable whose entries after the
+    first are sorted; lookups bisect the table and are memoized
+    """
+
+    def __init__( self, names ):
+        self.names = names
+        self.known = {names[0]:0}
+
+    def get( self, name, default=None ):
+        ret = self.known.get( name, None )
+        if ret is None:
+            lo, hi = 1, len( self.names )
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.names[mid] < name:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo < len( self.names ) and self.names[lo] == name:
+                ret = self.known[name] = lo
+        return default if ret is None else ret
+
+    def __contains__( self, name ):
+        return self.get( name ) is not None
+
+    def __getitem__( self, name ):
+        ret = self.get( name )
+        if ret is None:
+            raise KeyError( name )
+        return ret
+
 class Taxonomy( ):
 
+    """
+    Clade -> parent tree loaded from a two-column TSV, or from the binary
+    form written by waafle_taxonomy_compile (which is memory-mapped, so
+    loading is near-instant and processes share its pages). Clades whose
+    parent is not itself listed hang off c_root. Clades are interned as
+    integer ids (c_root is 0; the rest are sorted by name) with precomputed
+    depths, pre/post-order ranks (for O(1) ancestor tests), and leaf counts.
+    Lineages of listed clades are cached as tuples, so the LCA of k clades
+    costs O(k) plus a bisection of one cached lineage. The <parents> and
+    <children> dicts of earlier versions are built on first use.
+    """
+
     def __init__( self, path ):
-        self.parents = {}
-        self.children = {}
-        with try_open( path ) as fh:
-            for clade, parent in csv.reader( fh, csv.excel_tab ):
-                self.parents[clade] = parent
-                self.children.setdefault( parent, set( ) ).add( clade )
-        # memoizer for get_leaf_count( )
-        self.known_leaf_count = {}
+        if is_compiled_taxonomy( path ):
+            self.load_compiled( path )
+        else:
+            parents = {}
+            with try_open( path ) as fh:
+                for clade, parent in csv.reader( fh, csv.excel_tab ):
+                    parents[clade] = parent
+            self.build_index( parents )
+        # memoizer for get_lineage( ) (clades in the taxonomy only)
+        self.known_lineages = {}
+        self.parent_map = None
+        self.child_map = None
+
+    def build_index( self, parents ):
+        """ intern clades and precompute depths, ranks, and leaf counts """
+        names = {c_root}
+        names.update( parents )
+        names.update( parents.values( ) )
+        names.discard( c_root )
+        self.names = [c_root] + sorted( names )
+        self.ids = {name:i for i, name in enumerate( self.names )}
+        size = len( self.names )
+        # parent ids (root is its own parent); "listed" clades have a parent in the file
+        parent = [0] * size
+        listed = [0] * size
+        for i in range( 1, size ):
+            name = self.names[i]
+            if name in parents:
+                parent[i] = self.ids[parents[name]]
+                listed[i] = 1
+        self.parent_ids = np.array( parent, dtype=np.int32 )
+        self.listed = np.array( listed, dtype=np.int8 )
+        # child lists in CSR form, ordered by id
+        order = np.argsort( self.parent_ids[1:], kind="mergesort" ) + 1
+        counts = np.bincount( self.parent_ids[1:], minlength=size )
+        self.child_ids = order.astype( np.int32 )
+        self.child_offsets = np.concatenate( [[0], np.cumsum( counts )] ).astype( np.int32 )
+        # iterative dfs for depths and pre/post-order ranks
+        depth, tin, tout = [0] * size, [0] * size, [0] * size
+        child_ids, offsets = self.child_ids.tolist( ), self.child_offsets.tolist( )
+        preorder = [0]
+        stack = [[0, offsets[0]]]
+        clock = 0
+        while len( stack ) > 0:
+            node, cursor = stack[-1]
+            if cursor < offsets[node + 1]:
+                stack[-1][1] += 1
+                child = child_ids[cursor]
+                clock += 1
+                tin[child] = clock
+                depth[child] = depth[node] + 1
+                preorder.append( child )
+                stack.append( [child, offsets[child]] )
+            else:
+                tout[node] = clock
+                stack.pop( )
+        if len( preorder ) != size:
+            lost = [self.names[i] for i in range( 1, size ) if tin[i] == 0]
+            die( "Taxonomy contains a cycle involving:", lost[0] )
+        self.depths = np.array( depth, dtype=np.int32 )
+        self.tin = np.array( tin, dtype=np.int32 )
+        self.tout = np.array( tout, dtype=np.int32 )
+        # leaf count: 1 for clades without (listed) children, else the sum over them
+        has_children = [0] * size
+        for i in range( 1, size ):
+            if listed[i]:
+                has_children[parent[i]] = 1
+        leaf_counts = [0] * size
+        for i in reversed( preorder ):
+            if not has_children[i]:
+                leaf_counts[i] = 1
+            if listed[i]:
+                leaf_counts[parent[i]] += leaf_counts[i]
+        self.leaf_counts = np.array( leaf_counts, dtype=np.int64 )
+        # names as a string table (what the compiled form stores)
+        encoded = [name.encode( "utf-8" ) for name in self.names]
+        self.name_offsets = np.concatenate( 
+            [[0], np.cumsum( [len( k ) for k in encoded] )] ).astype( np.int64 )
+        self.name_bytes = b"".join( encoded )
+
+    def write( self, path ):
+        """ write the compiled (binary) form of this taxonomy """
+        header = np.zeros( 1, dtype=c_taxonomy_header )
+        header["magic"] = c_taxonomy_magic
+        header["version"] = c_taxonomy_version
+        header["size"] = len( self.names )
+        header["nbytes"] = len( self.name_bytes )
+        with open( path, "wb" ) as fh:
+            fh.write( header.tobytes( ) )
+            for name, dtype, length in c_taxonomy_arrays:
+                array = np.ascontiguousarray( getattr( self, name ), dtype=dtype )
+                fh.write( array.tobytes( ) )
+                fh.write( b"\0" * (-array.nbytes % 8) )
+            fh.write( self.name_bytes )
+
+    def load_compiled( self, path ):
+        """ memory-map the compiled (binary) form of a taxonomy """
+        data = np.memmap( path, dtype=np.uint8, mode="r" )
+        header = data[:c_taxonomy_header.itemsize].view( c_taxonomy_header )[0]
+        if header["version"] != c_taxonomy_version:
+            die( "Unsupported compiled taxonomy version:", header["version"], path )
+        size = int( header["size"] )
+        offset = c_taxonomy_header.itemsize
+        for name, dtype, length in c_taxonomy_arrays:
+            nbytes = np.dtype( dtype ).itemsize * length( size )
+            setattr( self, name, data[offset:offset+nbytes].view( dtype ) )
+            offset += nbytes + (-nbytes % 8)
+        self.name_bytes = data[offset:offset+int( header["nbytes"] )]
+        self.names = StringTable( self.name_bytes, self.name_offsets )
+        self.ids = SortedIds( self.names )
+
+    @property
+    def parents( self ):
+        """ {clade: parent} for the clades listed in the taxonomy file """
+        if self.parent_map is None:
+            self.parent_map = {self.names[i]: self.names[self.parent_ids[i]] 
+                               for i in np.flatnonzero( self.listed ).tolist( )}
+        return self.parent_map
+
+    @property
+    def children( self ):
+        """ {parent: set of listed clades under it} """
+        if self.child_map is None:
+            self.child_map = {}
+            for clade, parent in self.parents.items( ):
+                self.child_map.setdefault( parent, set( ) ).add( clade )
+        return self.child_map
 
     def get_parent( self, clade ):
-        return self.parents.get( clade, c_root )
+        i = self.ids.get( clade, None )
+        return c_root if i is None or not self.listed[i] else self.names[self.parent_ids[i]]
 
     def get_children( self, clade ):
-        return self.children.get( clade, set( ) )
+        ret = set( )
+        i = self.ids.get( clade, None )
+        if i is not None:
+            for c in self.child_ids[self.child_offsets[i]:self.child_offsets[i+1]]:
+                if self.listed[c]:
+                    ret.add( self.names[c] )
+        return ret
 
     def get_lineage( self, clade ):
-        l = [clade]
-        while l[-1] != c_root:
-            parent = self.get_parent( clade )
-            l.append( parent )
-            clade = parent
-        l.reverse( )
-        return l
+        """ root -> clade """
+        return list( self.get_lineage_tuple( clade ) )
+
+    def get_lineage_tuple( self, clade ):
+        """ root -> clade as a shared (cached) tuple """
+        ret = self.known_lineages.get( clade, None )
+        if ret is None:
+            if clade == c_root:
+                ret = (c_root,)
+            elif clade not in self.ids:
+                # clades outside the taxonomy hang off the root (not cached)
+                return (c_root, clade)
+            else:
+                ret = self.get_lineage_tuple( self.names[self.parent_ids[self.ids[clade]]] ) + (clade,)
+            self.known_lineages[clade] = ret
+        return ret
 
     def get_lca( self, *clades ):
-        lca = c_root
-        lineages = [self.get_lineage( c ) for c in clades]
-        min_depth = min( [len( l ) for l in lineages] )
-        for i in range( 0, min_depth ):
-            level = {l[i] for l in lineages}
-            if len( level ) == 1:
-                lca = list( level )[0]
+        ids = [self.ids.get( c, None ) for c in clades]
+        if None in ids:
+            # a clade outside the taxonomy only shares the root (or itself)
+            return clades[0] if len( set( clades ) ) == 1 else c_root
+        tin, tout = self.tin, self.tout
+        first = min( ids, key=lambda i: tin[i] )
+        reach = max( [tout[i] for i in ids] )
+        # deepest ancestor of <first> whose subtree also reaches every other clade
+        lineage = self.get_lineage_tuple( self.names[first] )
+        lo, hi = 0, len( lineage ) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if tout[self.ids[lineage[mid]]] >= reach:
+                lo = mid
             else:
-                break
-        return lca
+                hi = mid - 1
+        return lineage[lo]
 
     def get_tails( self, clades, lca ):
         tails = []
         for c in clades:
-            l = self.get_lineage( c )
-            l.reverse( )
-            t = []
-            for c2 in l:
-                if c2 == lca:
-                    break
-                else:
-                    t.append( c2 )
-            t.reverse( )
+            l = self.get_lineage_tuple( c )
+            # the part of the lineage below <lca> (or all of it if lca isn't an ancestor)
+            i = int( self.depths[self.ids[lca]] ) if lca in self.ids else len( l ) - 1
+            if i < len( l ) and l[i] == lca:
+                t = list( l[i+1:] )
+            elif lca in l:
+                t = list( l[l.index( lca )+1:] )
+            else:
+                t = list( l )
             tails.append( t )
         return tails
 
@@ -434,17 +1348,13 @@ class Taxonomy( ):
         return ret
 
     def get_leaf_count( self, clade ):
-        ret = None
-        if clade in self.known_leaf_count:
-            ret = self.known_leaf_count[clade]
-        elif clade not in self.children:
-            ret = 1
-        else:
-            ret = 0
-            for c in self.children[clade]:
-                ret += self.get_leaf_count( c )
-        self.known_leaf_count[clade] = ret
-        return ret
+        i = self.ids.get( clade, None )
+        return 1 if i is None else int( self.leaf_counts[i] )
+
+def is_compiled_taxonomy( path ):
+    """ check for the magic bytes of a compiled taxonomy """
+    with open( path, "rb" ) as fh:
+        return fh.read( len( c_taxonomy_magic ) ) == c_taxonomy_magic
 
 # ---------------------------------------------------------------
 # ---------------------------------------------------------------
@@ -484,6 +1394,42 @@ class INode:
     def to_list( self ):
         return [self.start, self.stop, self.strand] 
 
+class IntervalIndex( ):
+
+    """
+    Sorted-endpoint index over a fixed set of intervals. Intervals are
+    sorted by start, with a running max of their stops ("reach"), so the
+    intervals that can overlap a query form one contiguous sorted range.
+    """
+
+    def __init__( self, starts, stops ):
+        starts = np.asarray( starts, dtype=np.int64 )
+        stops = np.asarray( stops, dtype=np.int64 )
+        starts, stops = np.minimum( starts, stops ), np.maximum( starts, stops )
+        self.order = np.argsort( starts, kind="mergesort" )
+        self.starts = starts[self.order]
+        self.stops = stops[self.order]
+        self.reach = np.maximum.accumulate( self.stops ) if len( stops ) > 0 else self.stops
+
+    def __len__( self ):
+        return len( self.order )
+
+    def iter_overlaps( self, starts, stops ):
+        """ for each query interval, yield the (input) indices of overlapping intervals """
+        starts = np.asarray( starts, dtype=np.int64 )
+        stops = np.asarray( stops, dtype=np.int64 )
+        starts, stops = np.minimum( starts, stops ), np.maximum( starts, stops )
+        # everything left of <lo> ends before the query; everything from <hi> starts after it
+        los = np.searchsorted( self.reach, starts, side="left" ).tolist( )
+        his = np.searchsorted( self.starts, stops, side="right" ).tolist( )
+        for start, lo, hi in zip( starts.tolist( ), los, his ):
+            if hi - lo == 1:
+                yield self.order[lo:hi].tolist( ) if self.stops[lo] >= start else []
+            elif hi > lo:
+                yield np.sort( self.order[lo:hi][self.stops[lo:hi] >= start] ).tolist( )
+            else:
+                yield []
+
 def calc_overlap( a1, a2, b1, b2, normalize=True ):
     """ compute overlap between two intervals """
     overlap = None
@@ -525,31 +1471,502 @@ class SAMHit:
 
     """ Some data about an aligned read in a SAM file """
 
-    def __init__( self, sam_row ):
+    def __init__( self, sam_row, length=None ):
 
+        if length is None:
+            length = cigar_length( sam_row[5] )
         self.qseqid  = sam_row[0]
         self.sseqid  = sam_row[2]
         self.sstart  = int( sam_row[3] )
-        self.send    = self.sstart + cigar_length( sam_row[5] ) - 1
+        self.send    = self.sstart + length - 1
+
+class BAMHit( ):
+
+    """ SAMHit-like view of the BAM record starting at buf[i] """
+
+    def __init__( self, buf, i, refs, lengths ):
+
+        refid, pos, l_name, n_cigar = c_bam_record.unpack_from( buf, i )
+        i += c_bam_record.size
+        self.qseqid  = buf[i:i + l_name - 1].decode( "utf-8" )
+        self.sseqid  = refs[refid]
+        self.sstart  = pos + 1
+        i += l_name
+        cigar = buf[i:i + 4 * n_cigar]
+        length = lengths.get( cigar )
+        if length is None:
+            ops = struct.unpack( "<{}I".format( n_cigar ), cigar )
+            length = lengths[cigar] = sum( [k >> 4 for k in ops if k & 0xf in c_bam_ref_ops] )
+        self.send    = self.sstart + length - 1
+
+c_cigar_pattern = re.compile( "([0-9]+)([MIDNSHP=X])" )
 
 def cigar_length( cigar ):
-    counts = [int( c ) for c in re.split( "[A-Z]+", cigar ) if c != ""]
-    sigils = [s        for s in re.split( "[0-9]+", cigar ) if s != ""]
     # ignore read-only bands
-    return sum( [c for c, s in zip( counts, sigils ) if s in "DHMNSX="] )
+    return sum( [int( c ) for c, s in c_cigar_pattern.findall( cigar ) if s in "DHMNSX="] )
+
+def iter_sam_rows( lines, lengths=None ):
+    # cigar strings repeat heavily (e.g. "101M"), so their lengths are memoized
+    lengths = {} if lengths is None else lengths
+    for line in lines:
+        row = line.split( b"\t", 10 )
+        # header
+        if row[0][0:1] == b"@":
+            continue
+        # mandatory fields for a hit line
+        elif len( row ) < 11:
+            continue
+        # aligned read (only the fields SAMHit reads are decoded)
+        elif row[2] != b"*":
+            cigar = row[5]
+            length = lengths.get( cigar )
+            if length is None:
+                length = lengths[cigar] = cigar_length( cigar.decode( "utf-8" ) )
+            row = [row[0].decode( "utf-8" ), None, row[2].decode( "utf-8" ), row[3]]
+            yield SAMHit( row, length=length )
+
+def sam_line_read( line ):
+    """ read name of an aligned SAM line (else None) """
+    row = line.split( b"\t", 3 )
+    if row[0][0:1] == b"@" or len( row ) < 4 or row[2] == b"*":
+        return None
+    elif line.count( b"\t" ) < 10:
+        return None
+    return row[0]
+
+def find_sam_cut( data ):
+    """ 
+    Offset of a line break in <data> with aligned lines of different reads
+    on either side of it, so that no (mate) pair spans the cut; 0 if none
+    """
+    pos = data.rfind( b"\n" ) + 1
+    last = None
+    while pos > 0:
+        start = data.rfind( b"\n", 0, pos - 1 ) + 1
+        read = sam_line_read( data[start:pos - 1] )
+        if read is None:
+            pass
+        elif last is None:
+            last = read
+        elif read != last:
+            return pos
+        pos = start
+    return 0
+
+def iter_sam_text_chunks( fh, tee=None, chunk_bytes=c_batch_bytes ):
+    """ 
+    Whole lines of an open SAM stream in ~chunk_bytes pieces, cut only
+    where find_sam_cut allows; the raw data is also written to <tee>
+    """
+    tail = b""
+    while True:
+        chunk = fh.read( chunk_bytes )
+        if tee is not None:
+            tee.write( chunk )
+        if len( chunk ) == 0:
+            break
+        data = tail + chunk
+        cut = find_sam_cut( data )
+        if cut > 0:
+            yield data[:cut]
+        tail = data[cut:]
+    if tail != b"":
+        yield tail
+
+def iter_sam_chunks( sam_file, threads=1, chunk_bytes=c_batch_bytes ):
+    """ 
+    [refs, data] pieces of a SAM or BAM for parse_sam_chunk, never
+    splitting the records of one read; refs is None for SAM text
+    """
+    if is_bam( sam_file ):
+        with open( sam_file, "rb" ) as fh:
+            reader = BGZFReader( fh, threads=threads )
+            refs = read_bam_header( reader, sam_file )
+            for data in reader.iter_record_chunks( chunk_bytes=chunk_bytes ):
+                yield [refs, data]
+    else:
+        with try_open( sam_file, "rb" ) as fh:
+            for data in iter_sam_text_chunks( fh, chunk_bytes=chunk_bytes ):
+                yield [None, data]
+
+def parse_sam_chunk( refs, data, lengths=None ):
+    """ hits from one [refs, data] piece (see iter_sam_chunks) """
+    if refs is None:
+        return iter_sam_rows( data.split( b"\n" ), lengths=lengths )
+    return iter_bam_chunk_hits( data, refs, {} if lengths is None else lengths )
+
+def iter_chunk_hits( chunks ):
+    lengths = {}
+    for refs, data in chunks:
+        for hit in parse_sam_chunk( refs, data, lengths=lengths ):
+            yield hit
 
-def iter_sam_hits( sam_file ):
-    with try_open( sam_file ) as fh:
-        for row in csv.reader( fh, dialect="excel-tab" ):
-            # header
-            if row[0][0] == "@":
-                continue
-            # mandatory fields for a hit line
-            elif len( row ) < 11:
+# ---------------------------------------------------------------
+# BAM: BGZF blocks are inflated on a thread pool (zlib releases
+# the GIL) while the main thread walks the decoded records
+# ---------------------------------------------------------------
+
+c_bgzf_magic   = b"\x1f\x8b\x08\x04"
+c_bgzf_head    = struct.Struct( "<4s6xH" )
+c_bgzf_batch   = 256
+c_bam_magic    = b"BAM\x01"
+# block_size, refID, pos, l_read_name
+c_bam_prefix   = struct.Struct( "<iiiB" )
+# refID, pos, l_read_name, (mapq, bin), n_cigar_op, (flag, l_seq, next_refID, next_pos, tlen)
+c_bam_record   = struct.Struct( "<iiB3xH18x" )
+# cigar ops that count toward cigar_length: M D N S H = X
+c_bam_ref_ops  = frozenset( [0, 2, 3, 4, 5, 7, 8] )
+
+def is_bam( path ):
+    """ BGZF container holding BAM (bgzipped SAM text is not BAM) """
+    with open( path, "rb" ) as fh:
+        head = fh.read( 14 )
+    if head[0:4] != c_bgzf_magic or head[12:14] != b"BC":
+        return False
+    with gzip.GzipFile( path, "rb" ) as fh:
+        return fh.read( 4 ) == c_bam_magic
+
+def iter_bgzf_blocks( fh ):
+    """ Yield the raw deflate payload of each BGZF block in an open file """
+    while True:
+        head = fh.read( c_bgzf_head.size )
+        if len( head ) == 0:
+            break
+        elif len( head ) < c_bgzf_head.size or head[0:4] != c_bgzf_magic:
+            die( "Malformed BGZF block header." )
+        xlen = c_bgzf_head.unpack( head )[1]
+        extra = fh.read( xlen )
+        bsize = None
+        i = 0
+        while i + 4 <= len( extra ):
+            slen = struct.unpack_from( "<H", extra, i + 2 )[0]
+            if extra[i:i + 2] == b"BC":
+                bsize = struct.unpack_from( "<H", extra, i + 4 )[0]
+            i += 4 + slen
+        if bsize is None:
+            die( "BGZF block lacks a BSIZE field." )
+        # block is bsize + 1 bytes; the payload is followed by CRC32 and ISIZE
+        body = fh.read( bsize + 1 - c_bgzf_head.size - xlen )
+        if len( body ) < 8:
+            die( "Truncated BGZF block." )
+        yield body[:-8]
+
+def inflate_block( data ):
+    return zlib.decompress( data, -15 )
+
+def iter_bgzf_data( fh, threads=1 ):
+    """ 
+    Inflated BGZF data in batches; the next batch inflates while one is
+    consumed. Batches start at one block and double up to c_bgzf_batch,
+    so short (indexed) reads don't inflate far past what they need.
+    """
+    blocks = iter_bgzf_blocks( fh )
+    pool = ThreadPool( max( 1, threads ) )
+    size = 1
+    try:
+        pending = pool.map_async( inflate_block, list( itertools.islice( blocks, size ) ) )
+        while True:
+            batch = pending.get( )
+            if len( batch ) == 0:
+                break
+            size = min( 2 * size, c_bgzf_batch )
+            pending = pool.map_async( inflate_block, list( itertools.islice( blocks, size ) ) )
+            yield b"".join( batch )
+    finally:
+        pool.terminate( )
+
+class BGZFReader( ):
+
+    """ Sequential reads over the inflated contents of a BGZF file """
+
+    def __init__( self, fh, threads=1 ):
+        self.chunks = iter_bgzf_data( fh, threads=threads )
+        self.buf = b""
+        self.pos = 0
+
+    def fill( self ):
+        chunk = next( self.chunks, None )
+        if chunk is None:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def close( self ):
+        """ stop reading ahead (before the underlying file is moved) """
+        self.chunks.close( )
+
+    def read( self, size ):
+        while len( self.buf ) - self.pos < size and self.fill( ):
+            pass
+        data = self.buf[self.pos:self.pos + size]
+        self.pos += len( data )
+        if len( data ) < size:
+            die( "Truncated BAM file." )
+        return data
+
+    def iter_records( self ):
+        """ (buffer, offset) of each length-prefixed record body """
+        while True:
+            buf, i, end = self.buf, self.pos, len( self.buf )
+            while i + 4 <= end:
+                size = struct.unpack_from( "<i", buf, i )[0]
+                if i + 4 + size > end:
+                    break
+                yield buf, i + 4
+                i += 4 + size
+            self.pos = i
+            if not self.fill( ):
+                if self.pos < len( self.buf ):
+                    die( "Truncated BAM record." )
+                break
+
+    def iter_record_chunks( self, chunk_bytes=c_batch_bytes ):
+        """ 
+        Whole records in ~chunk_bytes pieces, cut only between aligned
+        records of different reads (so no mate pair spans a cut)
+        """
+        pieces, size, last = [], 0, None
+        for buf, i in self.iter_records( ):
+            block_size, refid, pos, l_name = c_bam_prefix.unpack_from( buf, i - 4 )
+            if refid >= 0:
+                read = buf[i + 32:i + 31 + l_name]
+                if size >= chunk_bytes and read != last:
+                    yield b"".join( pieces )
+                    pieces, size = [], 0
+                last = read
+            pieces.append( buf[i - 4:i + block_size] )
+            size += 4 + block_size
+        if len( pieces ) > 0:
+            yield b"".join( pieces )
+
+def read_bam_header( reader, path ):
+    """ reference names (indexed by refID) from a BGZFReader at the start of a BAM """
+    if reader.read( 4 ) != c_bam_magic:
+        die( "Not a BAM file:", path )
+    # header text, then reference names and lengths
+    l_text = struct.unpack( "<i", reader.read( 4 ) )[0]
+    reader.read( l_text )
+    refs = []
+    for i in range( struct.unpack( "<i", reader.read( 4 ) )[0] ):
+        l_name = struct.unpack( "<i", reader.read( 4 ) )[0]
+        refs.append( reader.read( l_name )[:-1].decode( "utf-8" ) )
+        reader.read( 4 )
+    return refs
+
+# BAI: bin id of the per-reference metadata pseudo-bin
+c_bai_magic      = b"BAI\x01"
+c_bai_pseudo_bin = 37450
+
+def find_bam_index( bam_file ):
+    """ <x.bam>.bai or <x>.bai, if present """
+    for path in [bam_file + ".bai", re.sub( r"\.bam$", ".bai", bam_file )]:
+        if path != bam_file and os.path.exists( path ):
+            return path
+    return None
+
+def read_bam_index( bai_file ):
+    """ first virtual offset of each reference's reads (by refID; None if it has none) """
+    with open( bai_file, "rb" ) as fh:
+        data = fh.read( )
+    if data[0:4] != c_bai_magic:
+        die( "Not a BAM index:", bai_file )
+    starts = []
+    i = 4
+    n_ref = struct.unpack_from( "<i", data, i )[0]
+    i += 4
+    for r in range( n_ref ):
+        first = None
+        n_bin = struct.unpack_from( "<i", data, i )[0]
+        i += 4
+        for b in range( n_bin ):
+            bin_id, n_chunk = struct.unpack_from( "<Ii", data, i )
+            i += 8
+            # chunks are [begin, end) pairs of virtual offsets
+            chunks = np.frombuffer( data, dtype="<u8", count=2 * n_chunk, offset=i )
+            i += 16 * n_chunk
+            if bin_id != c_bai_pseudo_bin and n_chunk > 0:
+                begin = int( chunks[0::2].min( ) )
+                first = begin if first is None else min( first, begin )
+        n_intv = struct.unpack_from( "<i", data, i )[0]
+        i += 4 + 8 * n_intv
+        starts.append( first )
+    return starts
+
+def iter_bam_contig_hits( bam_file, contigs, bai_file, threads=1 ):
+    """ 
+    [contig, hits] for each of <contigs> found in a coordinate-sorted,
+    indexed BAM; only those contigs' records are read (by seeking)
+    """
+    starts = read_bam_index( bai_file )
+    with open( bam_file, "rb" ) as fh:
+        reader = BGZFReader( fh, threads=threads )
+        refs = read_bam_header( reader, bam_file )
+        reader.close( )
+        refids = {name: refid for refid, name in enumerate( refs )}
+        for refid in sorted( [refids[c] for c in contigs if c in refids] ):
+            if refid >= len( starts ) or starts[refid] is None:
                 continue
-            # aligned read
-            elif row[2] != "*":
-                yield SAMHit( row )
+            # virtual offset: compressed block offset << 16 | offset within the block
+            fh.seek( starts[refid] >> 16 )
+            reader = BGZFReader( fh, threads=threads )
+            reader.read( starts[refid] & 0xffff )
+            hits, lengths = [], {}
+            for buf, i in reader.iter_records( ):
+                if struct.unpack_from( "<i", buf, i )[0] != refid:
+                    break
+                hits.append( BAMHit( buf, i, refs, lengths ) )
+            reader.close( )
+            yield [refs[refid], hits]
+
+def iter_bam_chunk_hits( data, refs, lengths ):
+    """ hits from whole BAM records laid end to end in <data> """
+    i = 0
+    while i < len( data ):
+        block_size, refid = struct.unpack_from( "<ii", data, i )
+        if refid >= 0:
+            yield BAMHit( data, i + 4, refs, lengths )
+        i += 4 + block_size
+
+# ---------------------------------------------------------------
+# ---------------------------------------------------------------
+# WORKING WITH COVERAGE
+# ---------------------------------------------------------------
+# ---------------------------------------------------------------
+
+"""
+Per-site depths are stored per contig as runs of equal depth: the run
+lengths and the depth change at the start of each run (delta-encoded),
+each in the narrowest integer type that holds them, then compressed.
+An index of contig offsets allows reading (and decoding) one contig or
+region at a time. The layout follows the compiled taxonomy: a fixed
+header, 8-byte aligned arrays, a string table of contig names, and
+finally the compressed runs.
+"""
+
+c_coverage_ext     = ".wcov"
+c_coverage_magic   = b"WAAFLECV"
+c_coverage_version = 1
+c_coverage_level   = 6
+c_coverage_header  = np.dtype( [("magic", "S8"), ("version", "<i8"), ("size", "<i8"), ("nbytes", "<i8")] )
+# integer types for run lengths / depth deltas (by code)
+c_coverage_codes   = ["<u1", "<u2", "<u4", "<u8", "<i1", "<i2", "<i4", "<i8"]
+c_coverage_arrays  = [
+    # name            dtype   length (as a function of contig count)
+    ["lengths",       "<i8",  lambda n: n],
+    ["runs",          "<i8",  lambda n: n],
+    ["codes",         "<u1",  lambda n: 2 * n],
+    ["blob_offsets",  "<i8",  lambda n: n + 1],
+    ["name_offsets",  "<i8",  lambda n: n + 1],
+    ]
+
+def narrow_code( values ):
+    """ code of the narrowest type in c_coverage_codes that holds <values> """
+    dtype = np.uint8
+    if len( values ) > 0:
+        dtype = np.result_type( np.min_scalar_type( values.min( ) ), np.min_scalar_type( values.max( ) ) )
+        # negative values with others >= 2^32 promote to float64 (int8 + uint64)
+        if dtype.kind == "f" and values.dtype.kind == "i":
+            dtype = np.dtype( "<i8" )
+    for code, name in enumerate( c_coverage_codes ):
+        if np.can_cast( dtype, name ):
+            return code
+    die( "Coverage values out of range." )
+
+def write_coverage( path, contig_coverage ):
+    """ write {contig: per-site depths} in the compact (binary) form """
+    names = list( contig_coverage )
+    arrays = {name: [] for name, dtype, length in c_coverage_arrays}
+    blobs = []
+    for name in names:
+        depths = np.asarray( contig_coverage[name], dtype=np.int64 )
+        starts = np.flatnonzero( depths[1:] != depths[:-1] ) + 1
+        starts = np.concatenate( [[0], starts] ) if len( depths ) > 0 else starts
+        lengths = np.diff( np.append( starts, len( depths ) ) )
+        deltas = np.diff( np.concatenate( [[0], depths[starts]] ) )
+        codes = [narrow_code( lengths ), narrow_code( deltas )]
+        blobs.append( zlib.compress( 
+            lengths.astype( c_coverage_codes[codes[0]] ).tobytes( ) +
+            deltas.astype( c_coverage_codes[codes[1]] ).tobytes( ), c_coverage_level ) )
+        arrays["lengths"].append( len( depths ) )
+        arrays["runs"].append( len( starts ) )
+        arrays["codes"] += codes
+    arrays["blob_offsets"] = np.concatenate( [[0], np.cumsum( [len( k ) for k in blobs] )] )
+    encoded = [name.encode( "utf-8" ) for name in names]
+    arrays["name_offsets"] = np.concatenate( [[0], np.cumsum( [len( k ) for k in encoded] )] )
+    name_bytes = b"".join( encoded )
+    header = np.zeros( 1, dtype=c_coverage_header )
+    header["magic"] = c_coverage_magic
+    header["version"] = c_coverage_version
+    header["size"] = len( names )
+    header["nbytes"] = len( name_bytes )
+    with open( path, "wb" ) as fh:
+        fh.write( header.tobytes( ) )
+        for name, dtype, length in c_coverage_arrays:
+            array = np.ascontiguousarray( arrays[name], dtype=dtype )
+            fh.write( array.tobytes( ) )
+            fh.write( b"\0" * (-array.nbytes % 8) )
+        fh.write( name_bytes )
+        fh.write( b"\0" * (-len( name_bytes ) % 8) )
+        for blob in blobs:
+            fh.write( blob )
+
+class CoverageStore( ):
+
+    """ per-site depths written by write_coverage (memory-mapped; decoded per contig) """
+
+    def __init__( self, path ):
+        data = np.memmap( path, dtype=np.uint8, mode="r" )
+        header = data[:c_coverage_header.itemsize].view( c_coverage_header )[0]
+        if header["magic"] != c_coverage_magic:
+            die( "Not a WAAFLE coverage file:", path )
+        elif header["version"] != c_coverage_version:
+            die( "Unsupported coverage file version:", header["version"], path )
+        size = int( header["size"] )
+        offset = c_coverage_header.itemsize
+        for name, dtype, length in c_coverage_arrays:
+            nbytes = np.dtype( dtype ).itemsize * length( size )
+            setattr( self, name, data[offset:offset+nbytes].view( dtype ) )
+            offset += nbytes + (-nbytes % 8)
+        nbytes = int( header["nbytes"] )
+        self.names = StringTable( data[offset:offset+nbytes], self.name_offsets )
+        self.blobs = data[offset + nbytes + (-nbytes % 8):]
+        self.index = {self.names[i]: i for i in range( size )}
+
+    def __iter__( self ):
+        """ contig names, in stored order """
+        for i in range( len( self.index ) ):
+            yield self.names[i]
+
+    def __contains__( self, contig ):
+        return contig in self.index
+
+    def get_length( self, contig ):
+        return int( self.lengths[self.index[contig]] )
+
+    def get_runs( self, contig ):
+        """ [exclusive run ends, run depths] of a contig """
+        i = self.index[contig]
+        runs = int( self.runs[i] )
+        blob = zlib.decompress( self.blobs[self.blob_offsets[i]:self.blob_offsets[i+1]].tobytes( ) )
+        lengths = np.frombuffer( blob, dtype=c_coverage_codes[self.codes[2 * i]], count=runs )
+        deltas = np.frombuffer( blob, dtype=c_coverage_codes[self.codes[2 * i + 1]], offset=lengths.nbytes )
+        return [np.cumsum( lengths, dtype=np.int64 ), np.cumsum( deltas, dtype=np.int64 )]
+
+    def get_depths( self, contig, start=0, stop=None ):
+        """ depths at base-0 sites [start, stop) of a contig """
+        length = self.get_length( contig )
+        stop = length if stop is None else min( stop, length )
+        start = max( 0, start )
+        if start >= stop:
+            return np.zeros( 0, dtype=np.int64 )
+        ends, depths = self.get_runs( contig )
+        # runs overlapping the region, trimmed to it
+        first = np.searchsorted( ends, start, side="right" )
+        last = np.searchsorted( ends, stop, side="left" ) + 1
+        ends = np.minimum( ends[first:last], stop )
+        begins = np.maximum( np.concatenate( [[start], ends[:-1]] ), start )
+        return np.repeat( depths[first:last], ends - begins )
 
 # ---------------------------------------------------------------
 # ---------------------------------------------------------------
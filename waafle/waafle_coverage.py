@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""
+This module is a part of:
+WAAFLE, a [W]orkflow to [A]nnotate [A]ssemblies and [F]ind [L]GT [E]vents
+
+Copyright (c) 2019 Harvard T.H. Chan School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from __future__ import print_function # Python 2.7+ required
+import os
+import sys
+import io
+import re
+import argparse
+
+import numpy as np
+
+from waafle import utils as wu
+
+# ---------------------------------------------------------------
+# description
+# ---------------------------------------------------------------
+
+description = wu.describe( """
+{SCRIPT}: Export per-site coverage from waafle_junctions
+
+Convert a binary coverage file (.coverage.wcov, written by
+waafle_junctions --write-detailed-output) to the site_hits text
+format: one row per contig (or region) with the mean and standard
+deviation of its depths, followed by the depths themselves.
+""" )
+
+# ---------------------------------------------------------------
+# output formats
+# ---------------------------------------------------------------
+
+c_formats = {}
+
+c_formats["site_hits"] = """
+contig
+mean
+stdev
+depths
+"""
+
+for name, items in c_formats.items( ):
+    c_formats[name] = [k for k in items.split( "\n" ) if k != ""]
+
+# ---------------------------------------------------------------
+# cli
+# ---------------------------------------------------------------
+
+def get_args( ):
+    parser = argparse.ArgumentParser(
+        description=description, 
+        formatter_class=argparse.RawTextHelpFormatter,
+        )
+    parser.add_argument( 
+        "coverage",
+        help="coverage file from waafle_junctions (.wcov)",
+        )
+    parser.add_argument( 
+        "--region",
+        action="append",
+        default=None,
+        metavar="<contig[:start-end]>",
+        help="only export this contig or (1-based, inclusive) region;\nmay be repeated\n[default: all contigs]",
+        )
+    parser.add_argument( 
+        "--out",
+        default=None,
+        metavar="<path>",
+        help="path for the text output (.gz to compress)\n[default: <derived from input>.site_hits.tsv.gz]",
+        )
+    args = parser.parse_args( )
+    return args
+
+# ---------------------------------------------------------------
+# utils
+# ---------------------------------------------------------------
+
+def parse_region( region, store ):
+    """ [label, contig, base-0 start, stop] """
+    match = re.search( r"^(.*):([0-9]+)-([0-9]+)$", region )
+    if region in store or match is None:
+        contig, start, stop = region, 0, None
+    else:
+        contig, start, stop = match.group( 1 ), int( match.group( 2 ) ) - 1, int( match.group( 3 ) )
+    if contig not in store:
+        wu.die( "Contig not in coverage file:", contig )
+    if stop is not None and not 0 <= start < stop <= store.get_length( contig ):
+        wu.die( "Region must satisfy 1 <= start <= end <= {:,} (contig length):".format( store.get_length( contig ) ), region )
+    return [region, contig, start, stop]
+
+def write_site_hits( fh, store, regions ):
+    wu.write_rowdict( 
+        format=c_formats["site_hits"], 
+        file=fh, )
+    for label, contig, start, stop in regions:
+        depths = store.get_depths( contig, start, stop )
+        rowdict = {
+            "contig" : label,
+            "mean"   : np.mean( depths ),
+            "stdev"  : np.std( depths ),
+            "depths" : " ".join( map( str, depths.tolist( ) ) ),
+            }
+        wu.write_rowdict( 
+            rowdict=rowdict, 
+            format=c_formats["site_hits"], 
+            file=fh, )
+
+# ---------------------------------------------------------------
+# main
+# ---------------------------------------------------------------
+
+def main( ):
+    args = get_args( )
+    store = wu.CoverageStore( args.coverage )
+    if args.region is None:
+        regions = [[contig, contig, 0, None] for contig in store]
+    else:
+        regions = [parse_region( region, store ) for region in args.region]
+    if args.out is None:
+        name = wu.path2name( args.coverage )
+        args.out = wu.name2path( name, os.path.dirname( args.coverage ), ".site_hits.tsv.gz" )
+    wu.say( "Writing {:,} rows to: {}".format( len( regions ), args.out ) )
+    with io.TextIOWrapper( wu.try_open( args.out, "wb" ) ) as fh:
+        write_site_hits( fh, store, regions )
+    wu.say( "Finished successfully." )
+
+if __name__ == "__main__":
+    main( )
@@ -30,6 +30,15 @@ import os
 import sys
 import csv
 import argparse
+import heapq
+import multiprocessing
+from collections import OrderedDict, deque
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import numpy as np
 
 from waafle import utils as wu
 
@@ -46,6 +55,15 @@ in the next step. Users can optionally supply their own (independently-generated
 GFF file.
 """ )
 
+# ---------------------------------------------------------------
+# constants
+# ---------------------------------------------------------------
+
+# bytes of blastout (whole contigs) per --workers shard
+c_shard_bytes = 2 ** 24
+# shards in flight per --workers process
+c_worker_backlog = 4
+
 # ---------------------------------------------------------------
 # cli
 # ---------------------------------------------------------------
@@ -74,6 +92,19 @@ def get_args( ):
         help=("if a large hit covers this fraction of a smaller hit, "
               "consider them part of the same gene group\n[default: 0.1]"),
         )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        metavar="<int>",
+        help="number of processes for calling genes (on shards of <blastout>)\n[default: 1]",
+        )
+    parser.add_argument(
+        "--tmpdir",
+        default=None,
+        metavar="<path>",
+        help="where to place temp files (inflated or regrouped copies of <blastout>)\n[default: <gff dir>]",
+        )
     attach_shared_args( parser )
     args = parser.parse_args( )
     return args
@@ -105,69 +136,182 @@ def attach_shared_args( parser ):
 # ---------------------------------------------------------------
 
 def hits2ints( hits, scov ):
-    """ filter hits by scoverage; convert to intervals """
-    intervals = []
-    for hit in hits:
-        if hit.scov_modified >= scov:
-            intervals.append( [hit.qstart, hit.qend, hit.sstrand] )
-    return intervals
-
-def overlap_inodes( inode1, inode2 ):
-    """ compute overlap between two intervals """
-    a1, b1 = inode1.start, inode1.stop
-    a2, b2 = inode2.start, inode2.stop
-    overlap = wu.calc_overlap( a1, b1, a2, b2 )
-    return overlap
-    
-def merge_inodes( *inodes ):
-    """ merge overlapping intervals into a single node """
-    start = stop = None
-    strand_rank = []
-    for inode in inodes:
-        if start is None or inode.start < start:
-            start = inode.start
-        if stop is None or inode.stop > stop:
-            stop = inode.stop
-        strand_rank.append( [len( inode ), inode.strand] )
-    # assign strand of largest interval to the merged interval
-    strand = sorted( strand_rank )[-1][1]
-    return wu.INode( start, stop, strand )
-
-def make_inodes( intervals ):
-    """ convert list of intervals to list of inodes """
-    inodes = []
-    for interval in intervals:
-        start, stop = interval[0:2]
-        strand = "+" if len( interval ) < 3 else interval[2]
-        inodes.append( wu.INode( start, stop, strand ) )
-    return inodes
-        
-def overlap_intervals( intervals, threshold, stranded ):
-    """ find and collapse overlapping intervals """
-    inodes = make_inodes( intervals )
-    inodes = sorted( inodes, key=lambda inode: inode.start )
-    for index, inode1 in enumerate( inodes ):
-        for inode2 in inodes[index+1:]:
-            if not stranded or inode1.strand == inode2.strand:
-                score = overlap_inodes( inode1, inode2 )
-                if score >= threshold:
-                    # store as edge in network
-                    inode1.attach( inode2 )
-                    inode2.attach( inode1 )
-                elif score == 0:
-                    # no further inode2 can overlap this inode1
-                    break
-    # divide intervals into "connected components"
-    ccs = []
-    for inode in inodes:
-        if not inode.visited:
-            ccs.append( inode.get_connected_component( ) )
-    # merge intervals and report as simple lists
-    new_intervals = []
-    for cc in ccs:
-        merged = merge_inodes( *cc ).to_list( )
-        new_intervals.append( merged )
-    return new_intervals
+    """ filter hits (a wu.HitBatch) by scoverage; convert to [starts, stops, strands] arrays """
+    keep = hits.scov_modified >= scov
+    return [hits.qstart[keep], hits.qend[keep], hits.sstrand[keep]]
+
+def min_overlaps( lengths, threshold ):
+    """ smallest overlap (1+ sites) scoring >= threshold against each length, as in wu.calc_overlap """
+    lengths = lengths.astype( float )
+    need = np.maximum( 1, np.ceil( threshold * lengths ) )
+    # calc_overlap divides, so correct for rounding in the product above
+    need = np.where( (need > 1) & ((need - 1) / lengths >= threshold), need - 1, need )
+    need = np.where( need / lengths < threshold, need + 1, need )
+    return need.astype( np.int64 )
+
+def find_root( parent, i ):
+    """ union-find lookup with path halving """
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def link_intervals( members, starts, stops, threshold, parent ):
+    """
+    union (in <parent>) the intervals among <members> (in start order) that overlap
+    by >= <threshold> of the shorter one. For interval i before j, that holds iff
+    stop_i reaches j's minimum overlap ("reach") or start_j falls before the last
+    start that i's minimum overlap allows ("key"; only decisive when i is shorter).
+    Components are kept in max-heaps by their largest stop and key, so each
+    interval pops exactly the components it joins: O(n log n).
+    """
+    members = members.tolist( )
+    if threshold <= 0:
+        # every pair scores >= 0
+        for i in members:
+            parent[i] = members[0]
+        return
+    if threshold > 1:
+        # scores never exceed 1
+        return
+    if len( members ) == 0:
+        return
+    need = min_overlaps( stops[members] - starts[members] + 1, threshold )
+    reach = (starts[members] - 1 + need).tolist( )
+    key = (stops[members] + 1 - need).tolist( )
+    max_stop, max_key = {}, {}
+    stop_heap, key_heap = [], []
+    for j, [i, start, stop] in enumerate( zip( 
+            members, starts[members].tolist( ), stops[members].tolist( ) ) ):
+        joined = [i]
+        while len( stop_heap ) > 0 and -stop_heap[0][0] >= reach[j]:
+            joined.append( heapq.heappop( stop_heap )[1] )
+        while len( key_heap ) > 0 and -key_heap[0][0] >= start:
+            joined.append( heapq.heappop( key_heap )[1] )
+        top_stop, top_key = stop, key[j]
+        for other in joined[1:]:
+            other = find_root( parent, other )
+            if other != i:
+                parent[other] = i
+                top_stop = max( top_stop, max_stop.pop( other ) )
+                top_key = max( top_key, max_key.pop( other ) )
+        max_stop[i], max_key[i] = top_stop, top_key
+        heapq.heappush( stop_heap, (-top_stop, i) )
+        heapq.heappush( key_heap, (-top_key, i) )
+
+def overlap_intervals( starts, stops, strands, threshold, stranded ):
+    """ find and collapse overlapping intervals; returns [start, stop, strand] lists """
+    starts, stops = np.minimum( starts, stops ), np.maximum( starts, stops )
+    strands = np.asarray( strands )
+    order = np.argsort( starts, kind="mergesort" )
+    parent = list( range( len( order ) ) )
+    if not stranded:
+        link_intervals( order, starts, stops, threshold, parent )
+    else:
+        for strand in set( strands.tolist( ) ):
+            link_intervals( order[strands[order] == strand], starts, stops, threshold, parent )
+    # merge components in order of their first interval; the merged interval
+    # takes the strand of the largest member (as in the original INode version)
+    merged = OrderedDict( )
+    for i, start, stop, strand in zip( 
+            order.tolist( ), starts[order].tolist( ), stops[order].tolist( ), strands[order].tolist( ) ):
+        root = find_root( parent, i )
+        rank = [stop - start + 1, strand]
+        if root not in merged:
+            merged[root] = [start, stop, rank]
+        else:
+            m = merged[root]
+            m[1] = max( m[1], stop )
+            m[2] = max( m[2], rank )
+    return [[start, stop, rank[1]] for start, stop, rank in merged.values( )]
+
+def iter_gene_rows( contig, hits, args ):
+    """ call genes on one contig's hits (a wu.HitBatch); yield GFF rows """
+    starts, stops, strands = hits2ints( 
+        hits, 
+        args.min_scov,
+        )
+    intervals = overlap_intervals( 
+        starts, 
+        stops, 
+        strands, 
+        args.min_overlap, 
+        args.stranded == "on",
+        )
+    for start, stop, strand in intervals:
+        gene_length = stop - start + 1
+        if gene_length >= args.min_gene_length:
+            items = [
+                contig,
+                "waafle_genecaller",
+                "gene",
+                start,
+                stop,
+                ".",
+                strand,
+                0,
+                ".",
+                ]
+            yield [str( k ) for k in items]
+
+# ---------------------------------------------------------------
+# shards (--workers)
+# ---------------------------------------------------------------
+
+# per-process state for --workers (see init_worker)
+g_worker_state = {}
+
+def init_worker( path, args ):
+    """ open the (seekable) blastout once per worker process """
+    g_worker_state["fh"] = open( path, "rb" )
+    g_worker_state["args"] = args
+
+def run_worker_shard( spans ):
+    """ call genes on the contigs in one shard of byte <spans>; return GFF text """
+    args = g_worker_state["args"]
+    text = wu.read_hit_spans( g_worker_state["fh"], spans )
+    try:
+        block = wu.parse_hit_block( text )
+    except SystemExit as e:
+        # wu.die( ) would otherwise take down the worker and hang the pool
+        raise RuntimeError( str( e ) )
+    fh_gff = StringIO( )
+    writer = csv.writer( fh_gff, csv.excel_tab )
+    qseqids = block.qseqids
+    start = 0
+    for i in range( 1, len( qseqids ) + 1 ):
+        if i == len( qseqids ) or qseqids[i] != qseqids[start]:
+            writer.writerows( iter_gene_rows( qseqids[start], block.subset( start, i ), args ) )
+            start = i
+    return fh_gff.getvalue( )
+
+def write_parallel_genes( fh_gff, args ):
+    """ split <blastout> at contig boundaries; call genes on shards in a process pool """
+    paths = [wu.seekable_copy( args.blastout, tmpdir=args.tmpdir )]
+    pending = deque( )
+    pool = None
+    try:
+        split = wu.find_split_query( paths[-1] )
+        if split is not None:
+            wu.say( "  Rows for some queries are not adjacent in", args.blastout, "(e.g. {}); grouping by query".format( split ) )
+            paths.append( wu.grouped_copy( paths[-1], tmpdir=args.tmpdir ) )
+        pool = multiprocessing.Pool( args.workers, init_worker, (paths[-1], args) )
+        # shards are found here as the scan proceeds; they come back in
+        # input order, so the GFF matches serial mode
+        for spans in wu.iter_hit_shards( wu.iter_hit_runs( paths[-1] ), c_shard_bytes ):
+            pending.append( pool.apply_async( run_worker_shard, (spans,) ) )
+            if len( pending ) >= c_worker_backlog * args.workers:
+                fh_gff.write( pending.popleft( ).get( ) )
+        while len( pending ) > 0:
+            fh_gff.write( pending.popleft( ).get( ) )
+        pool.close( )
+    finally:
+        if pool is not None:
+            pool.terminate( )
+            pool.join( )
+        for path in paths:
+            if path != args.blastout:
+                os.remove( path )
 
 # ---------------------------------------------------------------
 # main
@@ -200,35 +344,16 @@ def main( ):
     if args.gff is None:
         name = wu.path2name( args.blastout )
         args.gff = wu.name2path( name, ".", ".gff" )
+    if args.tmpdir is None:
+        args.tmpdir = os.path.dirname( os.path.abspath( args.gff ) )
 
     fh_gff = wu.try_open( args.gff, "w" )
-    writer = csv.writer( fh_gff, csv.excel_tab )
-
-    for contig, hits in wu.iter_contig_hits( args.blastout ):
-        intervals = hits2ints( 
-            hits, 
-            args.min_scov,
-            )
-        intervals = overlap_intervals( 
-            intervals, 
-            args.min_overlap, 
-            args.stranded == "on",
-            )
-        for start, stop, strand in intervals:
-            gene_length = stop - start + 1
-            if gene_length >= args.min_gene_length:
-                items = [
-                    contig,
-                    "waafle_genecaller",
-                    "gene",
-                    start,
-                    stop,
-                    ".",
-                    strand,
-                    0,
-                    ".",
-                    ]
-                writer.writerow( [str( k ) for k in items] )
+    if args.workers > 1:
+        write_parallel_genes( fh_gff, args )
+    else:
+        writer = csv.writer( fh_gff, csv.excel_tab )
+        for contig, hits in wu.iter_contig_hits( args.blastout, columnar=True, tmpdir=args.tmpdir ):
+            writer.writerows( iter_gene_rows( contig, hits, args ) )
 
     fh_gff.close( )
     wu.say( "Finished successfully." )
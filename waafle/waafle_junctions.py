@@ -31,7 +31,12 @@ import sys
 import csv
 import argparse
 import re
-from collections import Counter
+import gzip
+import subprocess
+import multiprocessing
+import bisect
+import itertools
+from collections import Counter, deque
 
 import numpy as np
 
@@ -58,13 +63,6 @@ relative to its flanking genes.
 
 c_formats = {}
 
-c_formats["site_hits"] = """
-contig
-mean
-stdev
-depths
-"""
-
 c_formats["gene_hits"] = """
 contig
 gene1
@@ -110,7 +108,7 @@ def get_args( ):
         help="GFF file for provided contigs",
         )
 
-    g = parser.add_argument_group( "provide paired reads or a .sam file" )
+    g = parser.add_argument_group( "provide paired reads or a .sam/.bam file" )
     g.add_argument( 
         "--reads1",
         metavar="<path>",
@@ -124,7 +122,7 @@ def get_args( ):
     g.add_argument( 
         "--sam",
         metavar="<path>",
-        help="sam file (from existing alignment)",
+        help="sam or bam file (from existing alignment)",
         )
 
     g = parser.add_argument_group( "output options" )
@@ -178,12 +176,40 @@ def get_args( ):
         type=int,
         default=1,
         metavar="<int>",
-        help="number of threads for bowtie2 steps\n[default: 1]",
+        help="number of threads for bowtie2 steps and bam decompression\n[default: 1]",
         )
     g.add_argument( 
         "--resume",
         action="store_true",
-        help="if set, use existing .index and/or .sam if found\n[default: off]",
+        help="if set, use existing .index and/or .sam.gz (or .sam) if found\n(the alignment is only kept on disk when this is set)\n[default: off]",
+        )
+
+    g = parser.add_argument_group( "targeted mode" )
+    g.add_argument( 
+        "--targets",
+        metavar="<path>",
+        help="only analyze these contigs: an lgt table from waafle_orgscorer\n(restricted to its AB/BA junctions, as used by waafle_qc)\nor a list of contig names (all of their junctions); a\nsorted and indexed --sam BAM is then read by seeking\n[default: all contigs]",
+        )
+
+    g = parser.add_argument_group( "performance options" )
+    g.add_argument( 
+        "--workers",
+        type=int,
+        default=1,
+        metavar="<int>",
+        help="processes for post-processing alignments (in chunks that never\nsplit a read's records; results match a single process)\n[default: 1]",
+        )
+    g.add_argument( 
+        "--queue-depth",
+        type=int,
+        default=0,
+        metavar="<int>",
+        help="batches of alignments read ahead on a separate thread while\nearlier ones are counted (0 = read in the main thread;\nsingle-process mode only)\n[default: 0]",
+        )
+    g.add_argument( 
+        "--write-fai",
+        action="store_true",
+        help="save the scan of <contigs> as a samtools-style <contigs>.fai, reused by later runs\n(uncompressed FASTA with regular line widths only)\n[default: off]",
         )
 
     args = parser.parse_args( )
@@ -217,6 +243,7 @@ def bowtie2_build( p_bowtie2_build=None, p_contigs=None, p_index=None,
 
 def bowtie2_align( p_bowtie2=None, p_reads1=None, p_reads2=None, 
                    p_index=None, p_sam=None, args=None, ):
+    """ Stream [refs, data] SAM chunks from bowtie2's stdout (kept as p_sam only for --resume) """
     alias = {
         "PROG":    p_bowtie2,
         "READS1":  p_reads1,
@@ -225,38 +252,82 @@ def bowtie2_align( p_bowtie2=None, p_reads1=None, p_reads2=None,
         "SAM":     p_sam,
         "THREADS": args.threads,
         }
-    if args.resume and os.path.exists( p_sam ):
-        wu.say( "RESUMING: A sam mapping <{SAM}> already exists.".format( **alias ) )
-    else:
-        wu.say( "Performing bowtie2 alignment." )
-        command = [
-            "{PROG}",
-            "-x {INDEX}",
-            "-1 {READS1}",
-            "-2 {READS2}",
-            "-S {SAM}",
-            "--threads {THREADS}",
-            "--no-mixed",
-            "--no-discordant",
-            ]
-        command = " ".join( command )
-        command = command.format( **alias )
-        os.system( command )
-        wu.say( "Alignment complete." )
-    return None
+    # earlier versions kept the mapping uncompressed (.sam)
+    for path in [p_sam, re.sub( r"\.gz$", "", p_sam )]:
+        if args.resume and os.path.exists( path ):
+            wu.say( "RESUMING: A sam mapping <{}> already exists.".format( path ) )
+            for chunk in wu.iter_sam_chunks( path ):
+                yield chunk
+            return
+    wu.say( "Performing bowtie2 alignment." )
+    command = [
+        "{PROG}",
+        "-x {INDEX}",
+        "-1 {READS1}",
+        "-2 {READS2}",
+        "--threads {THREADS}",
+        "--no-mixed",
+        "--no-discordant",
+        ]
+    command = " ".join( command )
+    command = command.format( **alias )
+    tee = None
+    if args.resume:
+        tee = gzip.GzipFile( p_sam + ".part", "wb", compresslevel=1 )
+    process = subprocess.Popen( command, shell=True, stdout=subprocess.PIPE )
+    for data in wu.iter_sam_text_chunks( process.stdout, tee=tee ):
+        yield [None, data]
+    if process.wait( ) != 0:
+        wu.die( "bowtie2 failed with exit status:", process.returncode )
+    if tee is not None:
+        tee.close( )
+        os.rename( p_sam + ".part", p_sam )
+    wu.say( "Alignment complete." )
 
 # ---------------------------------------------------------------
 # utils for parsing SAM/GFF comparison
 # ---------------------------------------------------------------
 
-def concordant_hits( p_sam=None, ):
+def load_targets( path ):
+    """ 
+    contig -> targeted (gene1, gene2) junctions from an lgt table, or
+    contig -> None (all junctions) from a list of contigs
+    """
+    targets = {}
+    with wu.try_open( path ) as fh:
+        headers = fh.readline( ).rstrip( "\n" ).split( "\t" )
+    if "CONTIG_NAME" in headers and "LOCI" in headers and "SYNTENY" in headers:
+        F = wu.Frame( path )
+        for R in F.iter_rowdicts( ):
+            loci = R["LOCI"].split( "|" )
+            synteny = R["SYNTENY"]
+            pairs = targets.setdefault( R["CONTIG_NAME"], set( ) )
+            for i in range( len( loci ) - 1 ):
+                if synteny[i:i+2] in ["AB", "BA"]:
+                    pairs.add( (loci[i], loci[i+1]) )
+    else:
+        with wu.try_open( path ) as fh:
+            for line in fh:
+                items = line.split( )
+                if len( items ) > 0:
+                    targets[items[0]] = None
+    return targets
+
+def target_loci( loci, pairs ):
+    """ loci that are part of a targeted junction (all loci if pairs is None) """
+    if pairs is None:
+        return loci
+    codes = set( [code for pair in pairs for code in pair] )
+    return [L for L in loci if L.code in codes]
+
+def concordant_hits( sam_hits=None, report=True, ):
     counter = 0
     mate1 = None
     mate2 = None
-    for hit in wu.iter_sam_hits( p_sam ):
+    for hit in sam_hits:
         # progress
         counter += 1
-        if counter % int( 1e5 ) == 0:
+        if report and counter % int( 1e5 ) == 0:
             wu.say( "  SAM alignments processed: {:.1f}M".format( counter / 1e6 ) )
         # weave
         mate1 = mate2
@@ -274,35 +345,269 @@ def concordant_hits( p_sam=None, ):
         else:
             yield [mate1, mate2]
 
-def find_hit_loci( mate1=None, mate2=None, loci=None, args=None ):
-    hits = set( )
-    for L in loci:
-        a1, a2 = L.start, L.end
-        for read in [mate1, mate2]:
-            b1, b2 = read.sstart, read.send
-            overlap = wu.calc_overlap( a1, a2, b1, b2, normalize=False )
-            if overlap >= args.min_overlap_sites:
-                hits.add( L.code )
-    return hits
+def indexed_pairs( p_bam, p_bai, contigs, args ):
+    """ 
+    Pairs on <contigs> from a coordinate-sorted BAM, where mates are not
+    adjacent: they are matched by read name within each contig instead
+    """
+    for contig, hits in wu.iter_bam_contig_hits( p_bam, contigs, p_bai, threads=args.threads ):
+        pending = {}
+        for hit in hits:
+            mate1 = pending.pop( hit.qseqid, None )
+            if mate1 is None:
+                pending[hit.qseqid] = hit
+            else:
+                yield [mate1, hit]
+
+def pair_span( mate1, mate2 ):
+    """ sites covered by a pair (note: base-0 start and pythonic end) """
+    coords = [mate1.sstart, mate1.send, mate2.sstart, mate2.send]
+    return min( coords ) - 1, max( coords ) - 1
+
+class LocusHits( ):
+
+    """
+    Read-pair hits to one contig's loci. Loci are coded as small integers
+    (in start order) and indexed by start, so a lookup only visits loci
+    near the read. Self and adjacent-pair counts are NumPy arrays; pairs
+    of non-adjacent loci (rare) go to a Counter. Codes are restored at
+    report time.
+    """
+
+    def __init__( self, loci ):
+        loci = sorted( loci, key=lambda x: x.start )
+        self.index = {}
+        for L in loci:
+            self.index.setdefault( L.code, len( self.index ) )
+        self.codes = sorted( self.index, key=self.index.get )
+        # lookup index: [low, high, int code] sorted by low
+        spans = sorted( [[min( L.start, L.end ), max( L.start, L.end ), self.index[L.code]] for L in loci] )
+        self.lows = [k[0] for k in spans]
+        self.spans = spans
+        self.width = max( [k[1] - k[0] for k in spans] ) if len( spans ) > 0 else 0
+        self.self_hits = np.zeros( len( self.codes ), dtype=np.int64 )
+        self.next_hits = np.zeros( len( self.codes ), dtype=np.int64 )
+        self.other_hits = Counter( )
+
+    def find( self, reads, min_overlap ):
+        """ int codes of loci overlapping any read by >= min_overlap sites """
+        if min_overlap <= 0:
+            return set( [k[2] for k in self.spans] )
+        hits = set( )
+        for read in reads:
+            b1, b2 = sorted( [read.sstart, read.send] )
+            # overlap >= m needs a1 <= b2 - m + 1 and a2 >= b1 + m - 1
+            first = bisect.bisect_left( self.lows, b1 + min_overlap - 1 - self.width )
+            last = bisect.bisect_right( self.lows, b2 - min_overlap + 1 )
+            for a1, a2, code in self.spans[first:last]:
+                if min( a2, b2 ) - max( a1, b1 ) + 1 >= min_overlap:
+                    hits.add( code )
+        return hits
+
+    def add( self, hits ):
+        for i in hits:
+            self.self_hits[i] += 1
+        # note: each unordered pair is stored once
+        for i, j in itertools.combinations( sorted( hits ), 2 ):
+            if j == i + 1:
+                self.next_hits[i] += 1
+            else:
+                self.other_hits[(i, j)] += 1
+
+    def drain( self ):
+        """ take (and zero) the counts added so far, as a sparse part for merge """
+        part = []
+        for counts in [self.self_hits, self.next_hits]:
+            where = np.flatnonzero( counts )
+            part.append( [where, counts[where]] )
+            counts[where] = 0
+        part.append( self.other_hits )
+        self.other_hits = Counter( )
+        return part
+
+    def merge( self, part ):
+        for counts, [where, values] in zip( [self.self_hits, self.next_hits], part ):
+            counts[where] += values
+        self.other_hits.update( part[2] )
+
+    def count( self, code1, code2 ):
+        i, j = sorted( [self.index[code1], self.index[code2]] )
+        if i == j:
+            return self.self_hits[i].item( )
+        elif j == i + 1:
+            return self.next_hits[i].item( )
+        return self.other_hits.get( (i, j), 0 )
+
+    def as_counter( self ):
+        """ (code1, code2) -> hits for all hit pairs, in both orders """
+        counts = Counter( )
+        for i in np.flatnonzero( self.self_hits ):
+            counts[(self.codes[i], self.codes[i])] = self.self_hits[i].item( )
+        pairs = [[i, i + 1, self.next_hits[i].item( )] for i in np.flatnonzero( self.next_hits )]
+        pairs += [[i, j, value] for (i, j), value in self.other_hits.items( )]
+        for i, j, value in pairs:
+            code1, code2 = self.codes[i], self.codes[j]
+            counts[(code1, code2)] = counts[(code2, code1)] = value
+        return counts
+
+# ---------------------------------------------------------------
+# per-site coverage
+# ---------------------------------------------------------------
+
+# fragment endpoints buffered before being added to the difference array
+c_coverage_batch = 2 ** 20
+
+class CoverageCounter( ):
+
+    """
+    Per-site coverage of contigs by [start, stop] fragments (base-0,
+    inclusive). Each fragment only marks its endpoints in a difference
+    array (one array, contigs laid end to end); endpoints are buffered
+    and added in batches, and coverage is prefix-summed once at the end.
+    """
+
+    def __init__( self, contig_lengths ):
+        self.lengths = contig_lengths
+        self.index = {name: i for i, name in enumerate( contig_lengths )}
+        sizes = np.array( list( contig_lengths.values( ) ), dtype=np.int64 )
+        # + 1: a fragment ending on a contig's last site marks the next slot
+        self.offsets = np.concatenate( [[0], np.cumsum( sizes + 1 )] ).astype( np.int64 )
+        self.sizes = sizes
+        self.diff = np.zeros( self.offsets[-1], dtype=np.int32 )
+        self.contigs, self.starts, self.stops = [], [], []
+
+    def add( self, contig, start, stop ):
+        self.contigs.append( contig )
+        self.starts.append( start )
+        self.stops.append( stop )
+        if len( self.starts ) >= c_coverage_batch:
+            self.flush( )
+
+    def add_indexed( self, index, starts, stops ):
+        """ a batch of fragments, with contigs given by their position in contig_lengths """
+        offsets = self.offsets[index]
+        starts = offsets + starts
+        # (clipped) reads can hang off the end of a contig
+        stops = offsets + np.minimum( stops, self.sizes[index] - 1 ) + 1
+        for sites, sign in [[starts, 1], [stops, -1]]:
+            sites, counts = np.unique( sites, return_counts=True )
+            self.diff[sites] += sign * counts.astype( np.int32 )
+
+    def flush( self ):
+        self.add_indexed( 
+            np.array( [self.index[c] for c in self.contigs], dtype=np.int64 ),
+            np.array( self.starts, dtype=np.int64 ),
+            np.array( self.stops, dtype=np.int64 ),
+            )
+        self.contigs, self.starts, self.stops = [], [], []
+
+    def get_coverage( self ):
+        """ contig -> per-site depths, in the smallest unsigned dtype that holds them """
+        self.flush( )
+        coverage = {}
+        for name, length in self.lengths.items( ):
+            offset = self.offsets[self.index[name]]
+            depths = np.cumsum( self.diff[offset:offset+length], dtype=np.int64 )
+            top = depths.max( ) if length > 0 else 0
+            coverage[name] = depths.astype( np.min_scalar_type( top ) )
+        self.diff = None
+        return coverage
+
+# ---------------------------------------------------------------
+# parallel post-processing: workers return partial coverage and
+# pair counts per SAM chunk, which are summed in the main process
+# ---------------------------------------------------------------
+
+# chunks in flight per worker
+c_worker_backlog = 4
+
+g_worker_state = {}
+
+def init_worker( contigs, targets, args ):
+    """ index the (targeted) loci once per worker process """
+    g_worker_state["args"] = args
+    g_worker_state["index"] = {name: i for i, name in enumerate( contigs )}
+    g_worker_state["targets"] = targets
+    g_worker_state["hits"] = {}
+    for name, loci in wu.iter_contig_loci( args.gff ):
+        if targets is None:
+            g_worker_state["hits"][name] = LocusHits( loci )
+        elif name in targets:
+            g_worker_state["hits"][name] = LocusHits( target_loci( loci, targets[name] ) )
+    g_worker_state["lengths"] = {}
+
+def run_worker_chunk( chunk ):
+    """ [fragments, {contig: LocusHits part}] for one [refs, data] chunk """
+    args = g_worker_state["args"]
+    index = g_worker_state["index"]
+    targets = g_worker_state["targets"]
+    contig_hits = g_worker_state["hits"]
+    fragments = [[], [], []]
+    touched = set( )
+    try:
+        sam_hits = wu.parse_sam_chunk( chunk[0], chunk[1], lengths=g_worker_state["lengths"] )
+        for mate1, mate2 in concordant_hits( sam_hits, report=False ):
+            contig = mate1.sseqid
+            if targets is not None and contig not in targets:
+                continue
+            L, R = pair_span( mate1, mate2 )
+            for values, value in zip( fragments, [index[contig], L, R] ):
+                values.append( value )
+            inner = contig_hits.get( contig )
+            if inner is not None:
+                inner.add( inner.find( [mate1, mate2], args.min_overlap_sites ) )
+                touched.add( contig )
+    except SystemExit as e:
+        # wu.die( ) would otherwise take down the worker and hang the pool
+        raise RuntimeError( str( e ) )
+    fragments = [np.array( values, dtype=np.int64 ) for values in fragments]
+    return [fragments, {contig: contig_hits[contig].drain( ) for contig in touched}]
+
+def count_parallel( chunks, contig_lengths, targets, coverage_counter, contig_hits, args ):
+    """ sum worker results into the (serial-mode) accumulators """
+    pending = deque( )
+    def reduce( result ):
+        fragments, parts = result
+        coverage_counter.add_indexed( *fragments )
+        for contig, part in parts.items( ):
+            contig_hits[contig].merge( part )
+    pool = multiprocessing.Pool( args.workers, init_worker, (list( contig_lengths ), targets, args) )
+    try:
+        # chunks are read here, so a fast reader can't outrun the workers
+        for counter, chunk in enumerate( chunks, 1 ):
+            pending.append( pool.apply_async( run_worker_chunk, (chunk,) ) )
+            if len( pending ) >= c_worker_backlog * args.workers:
+                reduce( pending.popleft( ).get( ) )
+            if counter % 100 == 0:
+                wu.say( "  SAM chunks processed:", counter )
+        while len( pending ) > 0:
+            reduce( pending.popleft( ).get( ) )
+        pool.close( )
+    finally:
+        pool.terminate( )
+        pool.join( )
 
 # ---------------------------------------------------------------
 # utils for evaluating a contig
 # ---------------------------------------------------------------
 
-def evaluate_contig( loci=None, coverage=None, gene_hits=None, args=None, ):
+def evaluate_contig( loci=None, coverage=None, gene_hits=None, args=None, pairs=None, ):
     rowdicts = []
     loci = sorted( loci, key=lambda x: x.start )
     for i in range( len( loci ) - 1 ):
         rowdict = {}
         L1 = loci[i]
         L2 = loci[i+1]
+        # targeted mode: skip other junctions
+        if pairs is not None and (L1.code, L2.code) not in pairs:
+            continue
         rowdict["gene1"]             = my_code1 = L1.code
         rowdict["gene2"]             = my_code2 = L2.code
         rowdict["len_gene1"]         = len( L1 )
         rowdict["len_gene2"]         = len( L2 )
         rowdict["gap"]               = my_gap = L2.start - L1.end - 1
         # check hits
-        rowdict["junction_hits"]     = my_hits = gene_hits.get( (my_code1, my_code2), 0 )
+        rowdict["junction_hits"]     = my_hits = gene_hits.count( my_code1, my_code2 )
         # check coverage (note: base-0 start and pythonic end)
         rowdict["coverage_gene1"]    = my_cov1 = np.mean( coverage[L1.start-1:L1.end] )
         rowdict["coverage_gene2"]    = my_cov2 = np.mean( coverage[L2.start-1:L2.end] )
@@ -322,28 +627,14 @@ def evaluate_contig( loci=None, coverage=None, gene_hits=None, args=None, ):
 def write_detailed_output( basename=None, outdir=None,
                            contig_coverage=None, contig_hits=None, ):
 
-    # first file can get pretty big, hence gzip
-    p_site_hits = wu.name2path( basename, outdir, ".site_hits.tsv.gz" )
+    # per-site depths are stored compactly (waafle_coverage converts
+    # them to the .site_hits.tsv.gz text format on demand)
+    p_coverage  = wu.name2path( basename, outdir, ".coverage" + wu.c_coverage_ext )
     p_gene_hits = wu.name2path( basename, outdir, ".gene_hits.tsv" )
 
-    # write: site_hits
-    wu.say( "Writing site hits." )
-    with wu.try_open( p_site_hits, "w" ) as fh:
-        wu.write_rowdict( 
-            format=c_formats["site_hits"], 
-            file=fh, )
-        for c in sorted( contig_coverage ):
-            depths = contig_coverage[c]
-            rowdict = {
-                "contig" : c,
-                "mean"   : np.mean( depths ),
-                "stdev"  : np.std( depths ),
-                "depths" : " ".join( ["{:.0f}".format( k ) for k in depths] ),
-                }
-            wu.write_rowdict( 
-                rowdict=rowdict, 
-                format=c_formats["site_hits"], 
-                file=fh, )
+    # write: per-site coverage
+    wu.say( "Writing site coverage." )
+    wu.write_coverage( p_coverage, {c: contig_coverage[c] for c in sorted( contig_coverage )} )
 
     # write: gene_hits
     wu.say( "Writing gene-pair hits." )
@@ -352,10 +643,11 @@ def write_detailed_output( basename=None, outdir=None,
             format=c_formats["gene_hits"], 
             file=fh, )
         for c in sorted( contig_hits ):
-            for code1, code2 in sorted( contig_hits[c] ):
+            counts = contig_hits[c].as_counter( )
+            for code1, code2 in sorted( counts ):
                 if code2 > code1:
                     continue
-                value = contig_hits[c][(code1, code2)]
+                value = counts[(code1, code2)]
                 rowdict = {
                     "contig" : c,
                     "gene1"  : code1,
@@ -385,13 +677,26 @@ def main( ):
     if basename is None:
         basename = wu.path2name( p_contigs )
     p_index     = wu.name2path( basename, p_tmpdir, ".index" )
-    p_sam       = wu.name2path( basename, p_tmpdir, ".sam" )
+    p_sam       = wu.name2path( basename, p_tmpdir, ".sam.gz" )
     p_junctions = wu.name2path( basename, p_outdir, ".junctions.tsv" )
 
+    # targeted mode
+    targets = None
+    if args.targets is not None:
+        wu.say( "Loading targets:", args.targets )
+        targets = load_targets( args.targets )
+
     # alignment workflow
+    p_bai = None
     if args.sam is not None:
         p_sam = args.sam
         wu.say( "Using specified SAM file:", p_sam )
+        if targets is not None and wu.is_bam( p_sam ):
+            p_bai = wu.find_bam_index( p_sam )
+        if p_bai is not None:
+            wu.say( "Reading targeted contigs via the BAM index:", p_bai )
+        else:
+            chunks = wu.iter_sam_chunks( p_sam, threads=args.threads )
     elif args.reads1 is not None and args.reads2 is not None:
         # build process
         bowtie2_build( 
@@ -400,8 +705,8 @@ def main( ):
             p_index=p_index,
             args=args,
             )
-        # alignment process
-        bowtie2_align(
+        # alignment process (consumed as it runs)
+        chunks = bowtie2_align(
             p_bowtie2=args.bowtie2,
             p_reads1=args.reads1, 
             p_reads2=args.reads2,
@@ -411,44 +716,57 @@ def main( ):
             )
     else:
         wu.die( "Must provide READS or SAM file." )
+    if p_bai is None and args.workers <= 1:
+        sam_hits = wu.iter_chunk_hits( chunks )
+        if args.queue_depth > 0:
+            sam_hits = wu.iter_threaded( sam_hits, args.queue_depth )
 
     # load contig data
     wu.say( "Loading contig lengths." )
-    contig_lengths = wu.read_contig_lengths( p_contigs )
-    contig_coverage = {}
-    for name, length in contig_lengths.items( ):
-        contig_coverage[name] = np.zeros( length )
+    contig_lengths = wu.read_contig_lengths( p_contigs, write_index=args.write_fai )
+    if targets is not None:
+        for name in targets:
+            if name not in contig_lengths:
+                wu.say( "  Targeted contig not in contigs file:", name )
+        targets = {name: pairs for name, pairs in targets.items( ) if name in contig_lengths}
+        contig_lengths = {name: contig_lengths[name] for name in contig_lengths if name in targets}
+        wu.say( "  Restricted to {} targeted contigs.".format( len( contig_lengths ) ) )
+    coverage_counter = CoverageCounter( contig_lengths )
     wu.say( "Loading contig gene coordinates." )
     contig_loci = {}
+    contig_hits = {}
     for name, loci in wu.iter_contig_loci( p_gff ):
+        if targets is None:
+            contig_hits[name] = LocusHits( loci )
+        elif name in targets:
+            contig_hits[name] = LocusHits( target_loci( loci, targets[name] ) )
+        else:
+            continue
         contig_loci[name] = loci
-    contig_hits = {}
 
     # post-processing workflow
-    wu.say( "Processing SAM file." )
-    for mate1, mate2 in concordant_hits( p_sam ):
-        contig = mate1.sseqid
-        inner = contig_hits.setdefault( contig, Counter( ) )
-        # update pers-site coverage (note: base-0 start and pythonic end)
-        coords = [mate1.sstart, mate1.send, mate2.sstart, mate2.send]
-        L = min( coords ) - 1
-        R = max( coords ) - 1
-        contig_coverage[contig][L:R+1] += 1
-        # find hit loci
-        hits = find_hit_loci( 
-            mate1=mate1, 
-            mate2=mate2, 
-            loci=contig_loci.get( contig, [] ),
-            args=args,
-            )
-        # attach self counts
-        for code in hits:
-            inner[(code, code)] += 1
-        # attach pair counts (note: symmetric storage for safer lookup)
-        for code1 in hits:
-            for code2 in hits:
-                if code1 != code2:
-                    inner[(code1, code2)] += 1
+    if p_bai is None and args.workers > 1:
+        wu.say( "Processing SAM file on {} workers.".format( args.workers ) )
+        count_parallel( chunks, contig_lengths, targets, coverage_counter, contig_hits, args )
+    else:
+        wu.say( "Processing SAM file." )
+        if p_bai is not None:
+            mate_pairs = indexed_pairs( p_sam, p_bai, targets, args )
+        else:
+            mate_pairs = concordant_hits( sam_hits )
+        for mate1, mate2 in mate_pairs:
+            contig = mate1.sseqid
+            if targets is not None and contig not in targets:
+                continue
+            # update pers-site coverage
+            L, R = pair_span( mate1, mate2 )
+            coverage_counter.add( contig, L, R )
+            # find hit loci; attach self and pair counts
+            inner = contig_hits.get( contig )
+            if inner is not None:
+                inner.add( inner.find( [mate1, mate2], args.min_overlap_sites ) )
+
+    contig_coverage = coverage_counter.get_coverage( )
 
     # detailed output?
     if args.write_detailed_output:
@@ -469,8 +787,9 @@ def main( ):
             rowdicts = evaluate_contig( 
                 loci=contig_loci.get( c, [] ),
                 coverage=contig_coverage[c], 
-                gene_hits=contig_hits.get( c, {} ),
+                gene_hits=contig_hits.get( c ),
                 args=args,
+                pairs=targets[c] if targets is not None else None,
                 )
             for rowdict in rowdicts:
                 rowdict["contig"] = c
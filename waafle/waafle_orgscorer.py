@@ -31,7 +31,20 @@ import os
 import sys
 import re
 import argparse
-from collections import Counter
+import heapq
+import pickle
+import hashlib
+import sqlite3
+import time
+import shutil
+import tempfile
+import itertools
+import multiprocessing
+from collections import Counter, deque
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 import numpy as np
 
@@ -68,6 +81,24 @@ c_delim3             = ":"
 c_synchar_ambiguous  = "*"
 c_synchar_ignored    = "~"
 c_synchar_error      = "!"
+# max sorted runs merged at once by the --stream result spool
+c_spool_fanin        = 64
+# --stream: GFF groups held out of order before warning that memory will grow
+c_stash_warn         = 10000
+# max (pairs x loci) values scored at once by explain_two
+c_pair_block         = 2 ** 20
+# contigs sent to a --workers process at a time
+c_worker_chunksize   = 16
+# batches in flight per --workers process
+c_worker_backlog     = 4
+# result cache: new records per transaction
+c_cache_commit       = 1000
+# args that don't affect a contig's result (left out of cache keys)
+c_cache_ignored_args = [
+    "contigs", "blastout", "gff", "taxonomy", "outdir", "basename", "write_details", "quiet", 
+    "stream", "stream_buffer", "workers", "tmpdir", "cache", "cache_size",
+    "db", "blastn", "threads", "write_fai",
+    ]
 
 # ---------------------------------------------------------------
 # output formats
@@ -155,8 +186,14 @@ def get_args( ):
         )
     g.add_argument(
         "taxonomy",
-        help="taxonomy file for the blast database used to make <blastout>",
+        help="taxonomy file for the blast database used to make <blastout>\n(.tsv, or compiled with waafle_taxonomy_compile)",
         )
+    attach_analysis_args( parser )
+    args = parser.parse_args( )
+    return args
+
+def attach_analysis_args( parser ):
+    """ these arguments are shared with waafle_pipeline """
 
     # output params
     g = parser.add_argument_group( "output formatting" )
@@ -298,9 +335,51 @@ def get_args( ):
     # ****some gene-level params imported from waafle_genecaller for consistency****
     attach_shared_args( g )
 
-    # wrap-up
-    args = parser.parse_args( )
-    return args
+    # performance
+    g = parser.add_argument_group( "performance options" )
+    g.add_argument(
+        "--stream",
+        action="store_true",
+        help="write each contig's result as soon as it is evaluated, spilling sorted runs to disk\n(memory still grows with the number of contigs, and with the GFF if it is not in <blastout> order)\n[default: off]",
+        )
+    g.add_argument(
+        "--stream-buffer",
+        type=int,
+        default=10000,
+        metavar="<int>",
+        help="in --stream mode, number of contig results to hold in memory before spilling a sorted run\n[default: 10000]",
+        )
+    g.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        metavar="<int>",
+        help="number of processes for evaluating contigs\n[default: 1]",
+        )
+    g.add_argument(
+        "--tmpdir",
+        default=None,
+        metavar="<path>",
+        help="where to place temp outputs (e.g. --stream runs)\n[default: <outdir>]",
+        )
+    g.add_argument(
+        "--write-fai",
+        action="store_true",
+        help="save the scan of <contigs> as a samtools-style <contigs>.fai, reused by later runs\n(uncompressed FASTA with regular line widths only)\n[default: off]",
+        )
+    g.add_argument(
+        "--cache",
+        default=None,
+        metavar="<path>",
+        help="persistent (SQLite) cache of per-contig results; on re-runs, contigs with\nunchanged hits, loci, taxonomy, and parameters are not re-evaluated\n[default: off]",
+        )
+    g.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        metavar="<MB>",
+        help="evict least recently used <--cache> entries beyond this size\n[default: 1024]",
+        )
 
 # ---------------------------------------------------------------
 # object to store contig-specific data
@@ -324,9 +403,17 @@ class Contig( ):
         self.mask = None
         # map: locus name -> object
         self.locus_map = {}
-        # map: clade -> locus -> np array of per-site scores
-        self.site_scores = {}
-        # map: clade -> np array of per-gene scores
+        # interned clades with site scores (row index -> clade name)
+        self.site_clades = []
+        # per locus (aligned with self.loci): array of site_clades rows
+        self.locus_rows = []
+        # per locus: np array (rows x sites) of per-site scores for those rows
+        self.locus_sites = []
+        # clades with gene scores (row index -> clade name; may add "Unknown")
+        self.gene_clades = []
+        # np array (gene_clades x loci) of per-gene scores
+        self.gene_matrix = None
+        # map: clade -> np array of per-gene scores (rows of gene_matrix)
         self.gene_scores = {}
         # set of clades _currently_ represented on the contig
         self.clades = set( )
@@ -357,30 +444,58 @@ class Contig( ):
             self.locus_map[L.name] = L
 
     def attach_hits( self, hits ):
-        """ Figure out which BLAST hits correspond to which loci """
-        for H in hits:
-            if H.scov_modified >= self.args.min_scov:
-                for i, L in enumerate( self.loci ):
-                    # note: <s>strand in Hit specifically
-                    if self.args.stranded and H.sstrand != L.strand:
-                        continue
-                    if hit_locus_overlap( H, L ) >= self.args.min_overlap:
-                        self.score_hit( H, L )
-        self.clades = set( self.site_scores.keys( ) )
-                    
-    def score_hit( self, hit, locus ):
-        """ Assign site-level scores for hit to appropriate locus """
-        l1, l2 = sorted( [locus.start, locus.end] )
-        h1, h2 = sorted( [hit.qstart, hit.qend] )
-        # get hit into this gene's coordinate system
-        h1 = max( 0, h1 - l1 )
-        h2 = min( len( locus ) - 1, h2 - l1 )
-        # update gene with this hit's score
-        ldict = self.site_scores.setdefault( hit.taxon, {} )
-        if locus.name not in ldict:
-            ldict[locus.name] = np.zeros( len( locus ) )
-        ldict[locus.name][h1:h2+1] = np.maximum( ldict[locus.name][h1:h2+1], hit.waafle_score )
-        # (potentially) update locus with this hit's annotations
+        """ Figure out which BLAST hits (a wu.HitBatch) correspond to which loci """
+        select = np.nonzero( hits.scov_modified >= self.args.min_scov )[0]
+        # only loci that actually overlap a hit can pass a positive <min_overlap>
+        if self.args.min_overlap > 0:
+            index = wu.IntervalIndex( 
+                [L.start for L in self.loci], 
+                [L.end for L in self.loci],
+                )
+            candidates = index.iter_overlaps( hits.qstart[select], hits.qend[select] )
+        else:
+            candidates = (range( len( self.loci ) ) for i in select)
+        locus_hits = [[] for L in self.loci]
+        for H, indices in zip( hits.iter_rows( select ), candidates ):
+            for i in indices:
+                L = self.loci[i]
+                # note: <s>strand in Hit specifically
+                if self.args.stranded and H.sstrand != L.strand:
+                    continue
+                if hit_locus_overlap( H, L ) >= self.args.min_overlap:
+                    locus_hits[i].append( H )
+                    self.transfer_annotations( H, L )
+        self.score_hits( locus_hits )
+        self.clades = set( self.site_clades )
+
+    def score_hits( self, locus_hits ):
+        """ Assign site-level scores for each locus's hits (one block per locus) """
+        rows = {}
+        for L, hits in zip( self.loci, locus_hits ):
+            # intern this locus's clades
+            local = {}
+            for hit in hits:
+                if hit.taxon not in local:
+                    local[hit.taxon] = len( local )
+                    if hit.taxon not in rows:
+                        rows[hit.taxon] = len( self.site_clades )
+                        self.site_clades.append( hit.taxon )
+            block = np.zeros( (len( local ), len( L )) )
+            l1, l2 = sorted( [L.start, L.end] )
+            for hit in hits:
+                h1, h2 = sorted( [hit.qstart, hit.qend] )
+                # get hit into this gene's coordinate system
+                h1 = max( 0, h1 - l1 )
+                h2 = min( len( L ) - 1, h2 - l1 )
+                # update gene with this hit's score
+                scores = block[local[hit.taxon], h1:h2+1]
+                np.maximum( scores, hit.waafle_score, out=scores )
+            order = sorted( local, key=lambda clade: local[clade] )
+            self.locus_rows.append( np.array( [rows[clade] for clade in order], dtype=int ) )
+            self.locus_sites.append( block )
+
+    def transfer_annotations( self, hit, locus ):
+        """ (potentially) update locus with this hit's annotations """
         for system, value in hit.annotations.items( ):
             ref = locus.annotation_scores.get( system, self.annotation_threshold )
             if ref is None:
@@ -391,56 +506,71 @@ class Contig( ):
                 locus.annotations[system] = value
                 locus.annotation_scores[system] = hit.waafle_score
 
+    def get_site_scores( self, clade, index ):
+        """ per-site scores of a clade at the <index>-th locus (None if it has no hits there) """
+        rows = self.locus_rows[index]
+        match = np.nonzero( np.array( self.site_clades )[rows] == clade )[0] if len( rows ) > 0 else []
+        return self.locus_sites[index][match[0]] if len( match ) > 0 else None
+
     def update_gene_scores( self ):
         """ Convert nucleotide-level clade scores to gene scores, handle bad loci """
-        # clear existing scores (if any)
-        self.gene_scores = {}
-        # collapse site scores to genes by averaging
-        for clade, ldict in self.site_scores.items( ):
-            scores = []
-            for locus in self.loci:
-                if locus.name in ldict:
-                    scores.append( np.mean( ldict[locus.name] ) )
-                else:
-                    scores.append( 0 )
-            self.gene_scores[clade] = np.array( scores )
+        # collapse site scores to genes by averaging (one reduction per locus)
+        self.gene_clades = list( self.site_clades )
+        self.gene_matrix = np.zeros( (len( self.gene_clades ), len( self.loci )) )
+        for index, [rows, block] in enumerate( zip( self.locus_rows, self.locus_sites ) ):
+            if len( rows ) > 0:
+                self.gene_matrix[rows, index] = block.mean( axis=1 )
         # compute max per-gene scores (used below)
+        known = [i for i, clade in enumerate( self.gene_clades ) if clade != wu.c_unknown]
         maxes = np.zeros( len( self.loci ) )
-        for clade, values in self.gene_scores.items( ):
-            if clade != wu.c_unknown:
-                maxes = np.maximum( maxes, values )
+        if len( known ) > 0:
+            maxes = np.maximum( maxes, self.gene_matrix[known].max( axis=0 ) )
         # weak loci option 1: do nothing
         if self.args.weak_loci == "penalize":
             pass
         # weak loci option 2: spike unknown taxon
         elif self.args.weak_loci == "assign-unknown":
-            self.gene_scores[wu.c_unknown] = 1 - maxes
-            self.clades.add( wu.c_unknown )
+            if wu.c_unknown in self.gene_clades:
+                self.gene_matrix[self.gene_clades.index( wu.c_unknown )] = 1 - maxes
+            else:
+                self.gene_clades.append( wu.c_unknown )
+                self.gene_matrix = np.vstack( [self.gene_matrix, 1 - maxes] )
         # weak loci option 3: mask
         elif self.args.weak_loci == "ignore":
-            ok_list = []
-            for index, value in enumerate( maxes ):
-                self.loci[index].ignore = True
-                if value >= self.min_threshold:
-                    ok_list.append( index )
-                    self.loci[index].ignore = False
-            self.mask = None if len( ok_list ) == len( self.loci ) else np.array( ok_list )
+            ok = maxes >= self.min_threshold
+            for L, value in zip( self.loci, ok ):
+                L.ignore = not value
+            self.mask = None if ok.all( ) else np.nonzero( ok )[0]
+        self.gene_scores = {clade:self.gene_matrix[i] for i, clade in enumerate( self.gene_clades )}
         # update contig clades (will include "Unknown" if added above)
-        self.clades = {clade for clade in self.gene_scores}
+        self.clades = set( self.gene_clades )
 
     def raise_taxonomy( self, taxonomy ):
         """ Recombines hits according to clade parents, then converts to new gene scores """
-        new_site_scores = {}
-        for clade, ldict in self.site_scores.items( ):
+        new_clades, new_rows = [], {}
+        parent_rows = []
+        for clade in self.site_clades:
             parent = taxonomy.get_parent( clade )
-            if parent is None:
+            if parent not in new_rows:
+                new_rows[parent] = len( new_clades )
+                new_clades.append( parent )
+            parent_rows.append( new_rows[parent] )
+        parent_rows = np.array( parent_rows, dtype=int )
+        # grouped max of each locus block by parent row
+        for index, [rows, block] in enumerate( zip( self.locus_rows, self.locus_sites ) ):
+            if len( rows ) == 0:
                 continue
-            inner = new_site_scores.setdefault( parent, {} )
-            for name in ldict:
-                if name not in inner:
-                    inner[name] = np.zeros( len( self.locus_map[name] ) )
-                inner[name] = np.maximum( inner[name], ldict[name] )
-        self.site_scores = new_site_scores
+            groups, inverse = np.unique( parent_rows[rows], return_inverse=True )
+            if len( groups ) < len( rows ):
+                order = np.argsort( inverse, kind="mergesort" )
+                starts = np.searchsorted( inverse[order], np.arange( len( groups ) ) )
+                block = np.maximum.reduceat( block[order], starts, axis=0 )
+            else:
+                block = block[np.argsort( inverse )]
+            # note: parent scores start from 0 (as if maxed into zeros)
+            self.locus_rows[index] = groups
+            self.locus_sites[index] = np.maximum( block, 0, out=block )
+        self.site_clades = new_clades
         # use the new site scores to update gene scores
         self.update_gene_scores( )
 
@@ -563,6 +693,19 @@ def hit_locus_overlap( hit, locus ):
     # calc_overlap sorts start/end internally
     return wu.calc_overlap( a1, a2, b1, b2 )
 
+def process_contig( contig, hits, taxonomy, details, args ):
+    """ score a contig's hits against its loci and find its best explanation(s) """
+    # attach hits to genes
+    contig.attach_hits( hits )
+    contig.update_gene_scores( )
+    # initial jumps?
+    if args.jump_taxonomy is not None:
+        for j in range( args.jump_taxonomy ):
+            contig.raise_taxonomy( taxonomy )
+    # evaluate; note: the 'ignore' option can result in "empty" contigs
+    if not all( [L.ignore for L in contig.loci] ):
+        evaluate_contig( contig, taxonomy, details, args )
+
 def evaluate_contig( contig, taxonomy, details, args ):
     iteration = 1
     write_details( details, contig, iteration )
@@ -603,21 +746,51 @@ def explain_two( contig, taxonomy, args ):
     for clade in contig.clades:
         if max( contig.gene_scores[clade] ) >= args.two_clade_threshold:
             potential_clades.append( clade )
-    for clade1 in potential_clades:
-        for clade2 in potential_clades:
-            if clade1 < clade2:
-                crit, rank = contig.score( clade1, clade2 )
-                if crit >= args.two_clade_threshold:
-                    option = Option( contig )
-                    option.rank    = rank
-                    option.crit    = crit
-                    option.clade1  = clade1
-                    option.clade2  = clade2
-                    option.set_synteny_two( )
-                    options.append( option )
+    for clade1, clade2, crit, rank in iter_scored_pairs( 
+            contig, potential_clades, args.two_clade_threshold ):
+        option = Option( contig )
+        option.rank    = rank
+        option.crit    = crit
+        option.clade1  = clade1
+        option.clade2  = clade2
+        option.set_synteny_two( )
+        options.append( option )
     best = meld_two( options, taxonomy, args ) if len( options ) > 0 else None
     return best
 
+def iter_scored_pairs( contig, clades, threshold ):
+    """
+    Batched contig.score( clade1, clade2 ) for pairs of <clades> with clade1 < clade2.
+    Yields [clade1, clade2, crit, rank] for pairs with crit >= <threshold>, in the
+    same order as a nested loop over <clades>. Pairs are pruned by an upper bound
+    (their loci at >= threshold must cover the contig) and scored in blocks.
+    """
+    if len( clades ) < 2:
+        return
+    scores = np.array( [contig.gene_scores[c] for c in clades] )
+    # ignore masked positions, if applicable
+    scores = scores if contig.mask is None else scores[:, contig.mask]
+    counts = (scores >= threshold).sum( axis=1 )
+    required = scores.shape[1]
+    # name order of the clades (pairs are clade1 < clade2)
+    ranks = np.zeros( len( clades ), dtype=int )
+    ranks[sorted( range( len( clades ) ), key=lambda i: clades[i] )] = np.arange( len( clades ) )
+    # rows of clade1 per block, sized to cap the pair x loci work arrays
+    step = max( 1, c_pair_block // max( 1, len( clades ) * required ) )
+    for start in range( 0, len( clades ), step ):
+        rows = np.arange( start, min( start + step, len( clades ) ) )
+        candidates = (ranks[rows, None] < ranks[None, :]) & \
+            (counts[rows, None] + counts[None, :] >= required)
+        I, J = np.nonzero( candidates )
+        if len( I ) == 0:
+            continue
+        I = rows[I]
+        maxes = np.maximum( scores[I], scores[J] )
+        crits = maxes.min( axis=1 )
+        ranks_ = maxes.mean( axis=1 )
+        for k in np.nonzero( crits >= threshold )[0]:
+            yield [clades[I[k]], clades[J[k]], crits[k], ranks_[k]]
+
 def meld_one( options, taxonomy, args ):
     # note: unlike LGTs, "melds" never invalidate a one-bug explanation
     options = sorted( options, key=lambda x: x.rank )
@@ -770,16 +943,12 @@ def make_gene_scores_field( contig, clade ):
 
 def make_gene_spans_field( contig, clade ):
     gene_spans = []
-    for L in contig.loci:
-        if clade not in contig.site_scores:
-            # no site scores for this clade, e.g. spiked unknown
-            gene_spans.append( c_missing_annotation )
-        elif L.name not in contig.site_scores[clade]:
-            # no hits for this gene in this clade
+    for index, L in enumerate( contig.loci ):
+        site_scores = contig.get_site_scores( clade, index )
+        if site_scores is None:
+            # no hits for this gene in this clade (or no site scores at all, e.g. spiked unknown)
             gene_spans.append( c_missing_annotation )
         else:
-            # scores exist
-            site_scores = contig.site_scores[clade][L.name]
             # non-zero indices (base-1)
             nzi = 1 + np.nonzero( site_scores )[0]
             # isolate interesting indices (step-1 to left or right but not both)
@@ -790,12 +959,12 @@ def make_gene_spans_field( contig, clade ):
             gene_spans.append( c_delim3.join( [str( k ) for k in nzi] ) )
     return c_delim2.join( gene_spans )
 
-def attach_rowdict_functions( rowdict, contig, systems ):
-    """ update rowdict with contig functions """
+def attach_rowdict_functions( rowdict, annotations, systems ):
+    """ update rowdict with contig functions (one annotation dict per locus) """
     for s in systems:
         items = []
-        for locus in contig.loci:
-            items.append( locus.annotations.get( s, c_missing_annotation ) )
+        for locus_annotations in annotations:
+            items.append( locus_annotations.get( s, c_missing_annotation ) )
         # note: key here must match definition in headers
         rowdict[c_annotation_prefix + s] = c_delim2.join( items )
 
@@ -811,7 +980,66 @@ def write_details( details, contig, iteration ):
                 }
             wu.write_rowdict( rowdict, c_formats["details"], details )
 
-def write_main_output_files( contigs, taxonomy, args ):
+def make_main_rowdict( contig, taxonomy ):
+    """ build the main output row for an evaluated contig; returns call, rowdict """
+    best_one = contig.best_one
+    best_two = contig.best_two
+    call, rowdict = None, None
+    # unclassified
+    if not_ok( best_one ) and not_ok( best_two ):
+        call = "unclassified"
+        rowdict = {
+            "contig_name":   contig.name,
+            "call":          "unclassified",
+            "contig_length": contig.length,
+            "loci":          make_loci_field( contig.loci ),
+            }
+    # no_lgt
+    elif is_ok( best_one ):
+        clade = best_one.clade1
+        call = "no_lgt"
+        rowdict = {
+            "contig_name":   contig.name,
+            "call":          "no_lgt",
+            "contig_length": contig.length,
+            "min_score":     best_one.crit,
+            "avg_score":     best_one.rank,
+            "synteny":       best_one.synteny,
+            "clade":         clade,
+            "taxonomy":      c_delim2.join( taxonomy.get_lineage( clade ) ),
+            "melded":        make_tails_field( best_one.tails1 ),
+            "loci":          make_loci_field( contig.loci ),
+            }
+    # lgt
+    elif is_ok( best_two ):
+        clade1, clade2 = best_two.clade1, best_two.clade2
+        call = "lgt"
+        rowdict = {
+            "contig_name":   contig.name,
+            "call":         "lgt",
+            "contig_length": contig.length,
+            "min_max_score": best_two.crit,
+            "avg_max_score": best_two.rank,
+            "synteny":       best_two.synteny,
+            "direction":     best_two.direction,
+            "clade_A":       clade1, 
+            "clade_B":       clade2,
+            "lca":           taxonomy.get_lca( clade1, clade2 ),
+            "taxonomy_A":    c_delim2.join( taxonomy.get_lineage( clade1 ) ),
+            "taxonomy_B":    c_delim2.join( taxonomy.get_lineage( clade2 ) ),
+            "melded_A":      make_tails_field( best_two.tails1 ),
+            "melded_B":      make_tails_field( best_two.tails2 ),
+            "loci":          make_loci_field( contig.loci ),
+            }
+    return call, rowdict
+
+def summarize_contig( contig, taxonomy ):
+    """ reduce an evaluated contig to a light [name, call, rowdict, annotations] record """
+    call, rowdict = make_main_rowdict( contig, taxonomy )
+    annotations = [L.annotations for L in contig.loci]
+    return [contig.name, call, rowdict, annotations]
+
+def write_main_output_files( spool, taxonomy, args ):
 
     # open output file handles
     wu.say( "Initializing outputs." )
@@ -820,12 +1048,8 @@ def write_main_output_files( contigs, taxonomy, args ):
         file_name = ".".join( [args.basename, option, "tsv"] )
         handles[option] = open( os.path.join( args.outdir, file_name ), "w" )
 
-    # determine possible function annotation systems
-    systems = set( )
-    for contig in contigs.values( ):
-        for locus in contig.loci:
-            for system in locus.annotations:
-                systems.add( system )
+    # possible function annotation systems were noted by the spool
+    systems = spool.systems
     for option in c_main_formats:
         for s in sorted( systems ):
             c_formats[option].append( c_annotation_prefix + s )
@@ -835,64 +1059,308 @@ def write_main_output_files( contigs, taxonomy, args ):
         wu.write_rowdict( None, c_main_formats[name], file=handles[name] )
         
     # write results (sorted loop over contigs)
-    for contig_name in sorted( contigs ):
-        contig = contigs[contig_name]
-        best_one = contig.best_one
-        best_two = contig.best_two
-        # unclassified
-        if not_ok( best_one ) and not_ok( best_two ):
-            rowdict = {
-                "contig_name":   contig_name,
-                "call":          "unclassified",
-                "contig_length": contig.length,
-                "loci":          make_loci_field( contig.loci ),
-                }
-            attach_rowdict_functions( rowdict, contig, systems )
-            wu.write_rowdict( rowdict, c_formats["unclassified"], handles["unclassified"] )
-        # no_lgt
-        elif is_ok( best_one ):
-            clade = best_one.clade1
-            rowdict = {
-                "contig_name":   contig_name,
-                "call":          "no_lgt",
-                "contig_length": contig.length,
-                "min_score":     best_one.crit,
-                "avg_score":     best_one.rank,
-                "synteny":       best_one.synteny,
-                "clade":         clade,
-                "taxonomy":      c_delim2.join( taxonomy.get_lineage( clade ) ),
-                "melded":        make_tails_field( best_one.tails1 ),
-                "loci":          make_loci_field( contig.loci ),
-                }
-            attach_rowdict_functions( rowdict, contig, systems )
-            wu.write_rowdict( rowdict, c_formats["no_lgt"], handles["no_lgt"] )
-        # lgt
-        elif is_ok( best_two ):
-            clade1, clade2 = best_two.clade1, best_two.clade2
-            rowdict = {
-                "contig_name":   contig_name,
-                "call":         "lgt",
-                "contig_length": contig.length,
-                "min_max_score": best_two.crit,
-                "avg_max_score": best_two.rank,
-                "synteny":       best_two.synteny,
-                "direction":     best_two.direction,
-                "clade_A":       clade1, 
-                "clade_B":       clade2,
-                "lca":           taxonomy.get_lca( clade1, clade2 ),
-                "taxonomy_A":    c_delim2.join( taxonomy.get_lineage( clade1 ) ),
-                "taxonomy_B":    c_delim2.join( taxonomy.get_lineage( clade2 ) ),
-                "melded_A":      make_tails_field( best_two.tails1 ),
-                "melded_B":      make_tails_field( best_two.tails2 ),
-                "loci":          make_loci_field( contig.loci ),
-                }
-            attach_rowdict_functions( rowdict, contig, systems )
-            wu.write_rowdict( rowdict, c_formats["lgt"], handles["lgt"] )
+    for contig_name, call, rowdict, annotations in spool.iter_sorted( ):
+        attach_rowdict_functions( rowdict, annotations, systems )
+        wu.write_rowdict( rowdict, c_formats[call], handles[call] )
 
     # wrap up
     for h in handles.values( ):
         h.close( )
 
+# ---------------------------------------------------------------
+# bounded-memory helpers for contig results
+# ---------------------------------------------------------------
+
+class ResultSpool( ):
+
+    """
+    Collects contig summary records for sorted output.
+    If <buffer_size> is set, records are spilled to disk as sorted runs
+    whenever the buffer fills, and the runs are merged on the way out.
+    The runs live in a temp dir under <tmpdir> that close() removes.
+    """
+
+    def __init__( self, buffer_size=None, tmpdir="." ):
+        self.buffer_size = buffer_size
+        self.tmpdir = tmpdir
+        self.buffer = []
+        self.runs = []
+        self.workdir = None
+        # annotation systems seen across all records
+        self.systems = set( )
+
+    def add( self, record ):
+        for locus_annotations in record[3]:
+            self.systems.update( locus_annotations )
+        self.buffer.append( record )
+        if self.buffer_size is not None and len( self.buffer ) >= self.buffer_size:
+            self.spill( )
+
+    def spill( self ):
+        """ write the buffer to disk as one sorted run """
+        self.buffer.sort( key=lambda record: record[0] )
+        self.runs.append( self.write_run( self.buffer ) )
+        self.buffer = []
+        # keep the number of open runs (and the final merge) bounded
+        if len( self.runs ) >= c_spool_fanin:
+            runs, self.runs = self.runs, []
+            self.runs.append( self.write_run( self.merge_runs( runs ) ) )
+
+    def write_run( self, records ):
+        if self.workdir is None:
+            self.workdir = tempfile.mkdtemp( prefix="waafle_spool.", dir=self.tmpdir )
+        fd, path = tempfile.mkstemp( suffix=".run", dir=self.workdir )
+        with os.fdopen( fd, "wb" ) as fh:
+            for record in records:
+                pickle.dump( record, fh, pickle.HIGHEST_PROTOCOL )
+        return path
+
+    def merge_runs( self, runs, extra=None ):
+        streams = [iter_run( path ) for path in runs]
+        if extra is not None:
+            streams.append( iter( extra ) )
+        # note: contig names are unique, so records never tie on [0]
+        return heapq.merge( *streams )
+
+    def iter_sorted( self ):
+        self.buffer.sort( key=lambda record: record[0] )
+        for record in self.merge_runs( self.runs, extra=self.buffer ):
+            yield record
+        self.buffer = []
+        self.runs = []
+
+    def close( self ):
+        """ remove any runs left on disk (e.g. after an error) """
+        if self.workdir is not None:
+            shutil.rmtree( self.workdir, ignore_errors=True )
+            self.workdir = None
+
+def iter_run( path ):
+    """ yield the records of one spilled run, then delete it """
+    with open( path, "rb" ) as fh:
+        while True:
+            try:
+                record = pickle.load( fh )
+            except EOFError:
+                break
+            yield record
+    os.remove( path )
+
+class LociSource( ):
+
+    """
+    Serves the loci for each contig from the GFF. By default the whole GFF
+    is loaded up front; in <lazy> mode it is read incrementally, only
+    holding the groups that have been passed over on the way to a contig
+    (i.e. nothing extra when the GFF and blastout share contig order).
+    Groups of contigs without hits are held until the end of the run.
+    """
+
+    def __init__( self, gff, contigs, lazy=False ):
+        self.contigs = contigs
+        self.lazy = lazy
+        self.warned = False
+        self.stash = {}
+        self.reader = wu.iter_contig_loci( gff, attach_annotations=False )
+        if not lazy:
+            self.advance( )
+
+    def advance( self, target=None ):
+        """ read GFF groups into the stash until <target> is found """
+        for contig_name, loci in self.reader:
+            if contig_name not in self.contigs:
+                wu.say( "  Unknown contig in <gff> file", contig_name )
+                continue
+            self.stash[contig_name] = loci
+            if self.lazy and not self.warned and len( self.stash ) >= c_stash_warn:
+                self.warned = True
+                wu.say( "  Holding loci for {:,} contigs; <gff> may not be in <blastout> contig order".format( c_stash_warn ) )
+            if contig_name == target:
+                break
+
+    def pop( self, contig_name ):
+        if contig_name not in self.stash:
+            self.advance( contig_name )
+        return self.stash.pop( contig_name, [] )
+
+# ---------------------------------------------------------------
+# persistent per-contig result cache
+# ---------------------------------------------------------------
+
+class ResultCache( ):
+
+    """
+    SQLite store of contig summary records from earlier runs. Records are
+    keyed on a hash of the contig's hits and loci, salted with the scoring
+    parameters and the taxonomy's content. The cache is cleared when the
+    code that filled it changes, and the least recently used records are
+    evicted beyond <max_bytes> on close.
+    """
+
+    # hit columns (beyond subject ids) that go into a contig's key
+    c_key_fields = [fname for fname, ftype in wu.c_blast_fields if ftype is not str] + ["sstrand"]
+
+    def __init__( self, path, max_bytes, args ):
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect( path )
+        self.db.execute( "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)" )
+        self.db.execute( "CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, record BLOB, size INTEGER, used REAL)" )
+        version = get_code_version( )
+        row = self.db.execute( "SELECT value FROM meta WHERE name = 'code_version'" ).fetchone( )
+        if row is not None and row[0] != version:
+            wu.say( "  Code version changed; clearing result cache", path )
+            self.db.execute( "DELETE FROM records" )
+        self.db.execute( "INSERT OR REPLACE INTO meta VALUES ('code_version', ?)", (version,) )
+        self.db.commit( )
+        # everything besides hits/loci that affects a contig's result
+        settings = [[k, v] for k, v in sorted( vars( args ).items( ) ) if k not in c_cache_ignored_args]
+        self.salt = repr( [settings, wu.hash_file( args.taxonomy )] ).encode( "utf-8" )
+        self.pending = 0
+        self.recalled = 0
+
+    def make_key( self, task ):
+        contig_name, length, loci, hits = task[:4]
+        h = hashlib.sha1( self.salt )
+        h.update( repr( [contig_name, length] ).encode( "utf-8" ) )
+        h.update( repr( [[getattr( L, fname ) for fname, ftype in wu.c_gff_fields] for L in loci] ).encode( "utf-8" ) )
+        h.update( "\n".join( hits.sseqid ).encode( "utf-8" ) )
+        for fname in self.c_key_fields:
+            h.update( np.ascontiguousarray( getattr( hits, fname ) ).tobytes( ) )
+        return h.hexdigest( )
+
+    def get( self, key ):
+        row = self.db.execute( "SELECT record FROM records WHERE key = ?", (key,) ).fetchone( )
+        if row is None:
+            return None
+        self.db.execute( "UPDATE records SET used = ? WHERE key = ?", (time.time( ), key) )
+        self.bump( )
+        self.recalled += 1
+        return pickle.loads( bytes( row[0] ) )
+
+    def put( self, key, record ):
+        blob = pickle.dumps( record, pickle.HIGHEST_PROTOCOL )
+        self.db.execute( "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)", 
+                         (key, sqlite3.Binary( blob ), len( blob ), time.time( )) )
+        self.bump( )
+
+    def bump( self ):
+        """ batch writes into transactions of c_cache_commit """
+        self.pending += 1
+        if self.pending >= c_cache_commit:
+            self.db.commit( )
+            self.pending = 0
+
+    def iter_resolved( self, tasks, recall=True ):
+        """ set each task's cache key, and its record if the cache has it (and <recall>) """
+        for task in tasks:
+            task[4] = self.make_key( task )
+            record = self.get( task[4] ) if recall else None
+            if record is not None:
+                # nothing left to evaluate (or to ship to a worker)
+                task[2:4] = [None, None]
+                task[5] = record
+            yield task
+
+    def close( self ):
+        """ evict least recently used records beyond max_bytes """
+        total = self.db.execute( "SELECT COALESCE(SUM(size), 0) FROM records" ).fetchone( )[0]
+        if total > self.max_bytes:
+            evict = []
+            for key, size in self.db.execute( "SELECT key, size FROM records ORDER BY used" ).fetchall( ):
+                if total <= self.max_bytes:
+                    break
+                evict.append( [key] )
+                total -= size
+            self.db.executemany( "DELETE FROM records WHERE key = ?", evict )
+            wu.say( "  Evicted {:,} records from result cache.".format( len( evict ) ) )
+        self.db.commit( )
+        self.db.close( )
+
+def get_code_version( ):
+    """ hash of the interpreter version and the sources used to score contigs """
+    h = hashlib.sha1( repr( sys.version_info[:2] ).encode( "utf-8" ) )
+    for module in [__name__, wu.__name__, attach_shared_args.__module__]:
+        path = sys.modules[module].__file__
+        path = path[:-1] if path.endswith( ".pyc" ) else path
+        h.update( wu.hash_file( path ).encode( "utf-8" ) )
+    return h.hexdigest( )
+
+# ---------------------------------------------------------------
+# contig tasks (serial or --workers)
+# ---------------------------------------------------------------
+
+# per-process state for --workers (see init_worker)
+g_worker_state = {}
+
+def iter_contig_tasks( contig_hits, contig_lengths, loci_source, seen ):
+    """ yield [name, length, loci, hits, cache key, cached record] for each known contig in <contig_hits> """
+    for contig_name, hits in contig_hits:
+        if contig_name not in contig_lengths:
+            wu.say( "  Unknown contig in <blastout> file", contig_name )
+            continue
+        if contig_name in seen:
+            wu.say( "  Contig split in <blastout> file (not sorted by query?)", contig_name )
+            continue
+        seen.add( contig_name )
+        yield [contig_name, contig_lengths[contig_name], loci_source.pop( contig_name ), hits, None, None]
+
+def evaluate_task( task, taxonomy, details, args ):
+    """ evaluate one contig task and reduce it to a summary record """
+    contig_name, length, loci, hits = task[:4]
+    C = Contig( contig_name, args )
+    C.length = length
+    C.attach_loci( loci )
+    process_contig( C, hits, taxonomy, details, args )
+    return summarize_contig( C, taxonomy )
+
+def resolve_task( task, taxonomy, details, args ):
+    """ evaluate a task unless it was recalled from the cache; returns [record, key to cache] """
+    key, record = task[4:]
+    if record is not None:
+        return [record, None]
+    return [evaluate_task( task, taxonomy, details, args ), key]
+
+def init_worker( args ):
+    """ load the taxonomy once per worker process """
+    g_worker_state["args"] = args
+    g_worker_state["taxonomy"] = wu.Taxonomy( args.taxonomy )
+
+def run_worker_task( task ):
+    """ evaluate a task in a worker; details rows are returned as text """
+    args = g_worker_state["args"]
+    taxonomy = g_worker_state["taxonomy"]
+    details = StringIO( ) if args.write_details else None
+    try:
+        result = resolve_task( task, taxonomy, details, args )
+    except SystemExit as e:
+        # wu.die( ) would otherwise take down the worker and hang the pool
+        raise RuntimeError( str( e ) )
+    return result + [details.getvalue( ) if details is not None else None]
+
+def run_worker_batch( batch ):
+    return [run_worker_task( task ) for task in batch]
+
+def iter_parallel_results( tasks, args ):
+    """ evaluate tasks in a process pool; yield results in task order """
+    pending = deque( )
+    pool = multiprocessing.Pool( args.workers, init_worker, (args,) )
+    try:
+        # tasks are read here (not in a pool thread), so errors raised while
+        # reading reach the caller, and a fast reader can't outrun the workers
+        batches = iter( lambda: list( itertools.islice( tasks, c_worker_chunksize ) ), [] )
+        for batch in batches:
+            pending.append( pool.apply_async( run_worker_batch, (batch,) ) )
+            if len( pending ) >= c_worker_backlog * args.workers:
+                for result in pending.popleft( ).get( ):
+                    yield result
+        while len( pending ) > 0:
+            for result in pending.popleft( ).get( ):
+                yield result
+        pool.close( )
+    finally:
+        pool.terminate( )
+        pool.join( )
+
 # ---------------------------------------------------------------
 # main
 # ---------------------------------------------------------------
@@ -904,30 +1372,29 @@ def main( ):
     taxonomy = wu.Taxonomy( args.taxonomy )
 
     # initialize contigs
-    wu.say( "Initializing contigs." )
-    contigs = {}
-    contig_lengths = wu.read_contig_lengths( args.contigs )
-    index = 0
-    for contig_name, length in contig_lengths.items( ):
-        C = Contig( contig_name, args )
-        C.length = length
-        index += 1
-        C.index = index
-        contigs[contig_name] = C
+    wu.say( "Loading contig lengths." )
+    contig_lengths = wu.read_contig_lengths( args.contigs, write_index=args.write_fai )
 
     # process gff
     wu.say( "Adding gene coordinates." )
-    for contig_name, loci in wu.iter_contig_loci( args.gff, attach_annotations=False ):
-        if contig_name not in contigs:
-            wu.say( "  Unknown contig in <gff> file", contig_name )
-            continue
-        C = contigs[contig_name]
-        C.attach_loci( loci )
+    loci_source = LociSource( args.gff, contig_lengths, lazy=args.stream )
 
     # check basename in preparation for writing output
+    set_output_defaults( args )
+
+    contig_hits = wu.iter_contig_hits( args.blastout, columnar=True, tmpdir=args.tmpdir )
+    analyze_contigs( contig_hits, contig_lengths, loci_source, taxonomy, args )
+    wu.say( "Finished successfully." )
+
+def set_output_defaults( args ):
     if args.basename is None:
         args.basename = os.path.split( args.contigs )[1].split( "." )[0]
-        
+    if args.tmpdir is None:
+        args.tmpdir = args.outdir
+
+def analyze_contigs( contig_hits, contig_lengths, loci_source, taxonomy, args ):
+    """ evaluate the contigs in <contig_hits> and write the output files """
+
     # prepare details file
     details = None
     if args.write_details:
@@ -936,32 +1403,56 @@ def main( ):
         # headers
         wu.write_rowdict( None, c_formats["details"], file=details )
 
-    # parse hits, process contigs
-    wu.say( "Analyzing contigs." )
-
-    # major contig loop
-    for contig_name, hits in wu.iter_contig_hits( args.blastout ):
-        if contig_name not in contigs:
-            wu.say( "  Unknown contig in <blastout> file", contig_name )
-            continue
-        # this is a good contig
-        C = contigs[contig_name]
-        if not args.quiet:
-            wu.say( "  #{:>7,} of {:>7,}".format( C.index, len( contigs ) ) )
-        # attach hits to genes
-        C.attach_hits( hits )
-        C.update_gene_scores( )
-        # initial jumps?
-        if args.jump_taxonomy is not None:
-            for j in range( args.jump_taxonomy ):
-                C.raise_taxonomy( taxonomy )
-        # evaluate; note: the 'ignore' option can result in "empty" contigs
-        if not all( [L.ignore for L in C.loci] ):
-            evaluate_contig( C, taxonomy, details, args )
+    # evaluated contigs are reduced to light records as we go
+    spool = ResultSpool( 
+        buffer_size=args.stream_buffer if args.stream else None,
+        tmpdir=args.tmpdir,
+        )
 
-    # wrap up
-    write_main_output_files( contigs, taxonomy, args )
-    wu.say( "Finished successfully." )
+    try:
+        # results from earlier runs
+        cache = None
+        if args.cache is not None:
+            wu.say( "Opening result cache." )
+            cache = ResultCache( args.cache, args.cache_size * 2 ** 20, args )
+
+        # parse hits, process contigs
+        wu.say( "Analyzing contigs." )
+
+        # major contig loop
+        seen = set( )
+        tasks = iter_contig_tasks( contig_hits, contig_lengths, loci_source, seen )
+        if cache is not None:
+            # details rows are only made by evaluating, so don't recall when writing them
+            tasks = cache.iter_resolved( tasks, recall=not args.write_details )
+        if args.workers > 1:
+            results = iter_parallel_results( tasks, args )
+        else:
+            results = (resolve_task( task, taxonomy, details, args ) + [None] for task in tasks)
+        for counter, [record, key, details_text] in enumerate( results, 1 ):
+            if not args.quiet:
+                wu.say( "  #{:>7,} of {:>7,}".format( counter, len( contig_lengths ) ) )
+            if details_text is not None:
+                print( details_text, end="", file=details )
+            if key is not None:
+                cache.put( key, record )
+            spool.add( record )
+        if cache is not None:
+            wu.say( "  Recalled {:,} of {:,} contigs from result cache.".format( cache.recalled, len( seen ) ) )
+            cache.close( )
+
+        # contigs without hits are unclassified
+        for contig_name, length in contig_lengths.items( ):
+            if contig_name not in seen:
+                C = Contig( contig_name, args )
+                C.length = length
+                C.attach_loci( loci_source.pop( contig_name ) )
+                spool.add( summarize_contig( C, taxonomy ) )
+
+        # wrap up
+        write_main_output_files( spool, taxonomy, args )
+    finally:
+        spool.close( )
     if details is not None:
         details.close( )
                     
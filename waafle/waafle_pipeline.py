@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""
+This module is a part of:
+WAAFLE, a [W]orkflow to [A]nnotate [A]ssemblies and [F]ind [L]GT [E]vents
+
+Copyright (c) 2019 Harvard T.H. Chan School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from __future__ import print_function # Python 2.7+ required
+import os
+import sys
+import csv
+import argparse
+import subprocess
+
+from waafle import utils as wu
+from waafle import waafle_orgscorer as wo
+from waafle.waafle_search import get_command
+from waafle.waafle_genecaller import iter_gene_rows
+
+# ---------------------------------------------------------------
+# description
+# ---------------------------------------------------------------
+
+description = wu.describe( """
+{SCRIPT}: Steps 1-2 of the WAAFLE pipeline in one pass
+
+Runs the blastn search of waafle_search and consumes its output as it
+is produced: each contig's hits are parsed once, merged into genes
+(as in waafle_genecaller, written to a GFF), and then analyzed (as in
+waafle_orgscorer) without writing or re-reading a .blastout file.
+Optionally, a (compressed) copy of the raw blast output can be kept.
+""" )
+
+# ---------------------------------------------------------------
+# cli
+# ---------------------------------------------------------------
+
+def get_args( ):
+    parser = argparse.ArgumentParser(
+        description=description, 
+        formatter_class=argparse.RawTextHelpFormatter,
+        )
+
+    # input params
+    g = parser.add_argument_group( "required inputs" )
+    g.add_argument(
+        "contigs",
+        help="contigs file (.fasta format)",
+        )
+    g.add_argument( 
+        "db",
+        help="path to WAAFLE BLAST database",
+        )
+    g.add_argument(
+        "taxonomy",
+        help="taxonomy file for <db>\n(.tsv, or compiled with waafle_taxonomy_compile)",
+        )
+
+    # search params
+    g = parser.add_argument_group( "search options" )
+    g.add_argument( 
+        "--blastn",
+        default="blastn",
+        metavar="<path>",
+        help="path to blastn binary\n[default: $PATH]",
+        )
+    g.add_argument( 
+        "--threads",
+        default="1",
+        metavar="<int>",
+        help="number of CPU cores to use in blastn search\n[default: 1]",
+        )
+    g.add_argument(
+        "--blastout",
+        default=None,
+        metavar="<path>",
+        help="also keep a copy of the blast output here (compressed if .gz/.bz2)\n[default: off]",
+        )
+    g.add_argument(
+        "--gff",
+        default=None,
+        metavar="<path>",
+        help="path for (output) waafle gene calls (.gff)\n[default: <outdir>/<basename>.gff]",
+        )
+
+    wo.attach_analysis_args( parser )
+    args = parser.parse_args( )
+    return args
+
+# ---------------------------------------------------------------
+# streaming search + gene calls
+# ---------------------------------------------------------------
+
+def iter_blastn_blocks( args ):
+    """ run blastn; yield its output in blocks of whole contigs (see wu.iter_stream_hit_blocks) """
+    command = get_command( args.contigs, args.db, args.blastn, args.threads )
+    wu.say( "Executing command:", command )
+    tee = None if args.blastout is None else wu.try_open( args.blastout, "wb" )
+    process = subprocess.Popen( command, shell=True, stdout=subprocess.PIPE )
+    try:
+        for text in wu.iter_stream_hit_blocks( process.stdout, tee ):
+            yield text
+    finally:
+        process.stdout.close( )
+        status = process.wait( )
+        if tee is not None:
+            tee.close( )
+    if status != 0:
+        wu.die( "blastn exited with status", status )
+
+class GeneCalls( ):
+
+    """
+    Calls genes on each contig's hits as they stream past, writing them
+    to the GFF and holding the loci until the contig is analyzed
+    (serves the same role as waafle_orgscorer's LociSource)
+    """
+
+    def __init__( self, fh_gff, contigs, args ):
+        self.writer = csv.writer( fh_gff, csv.excel_tab )
+        self.contigs = contigs
+        self.args = args
+        self.stash = {}
+
+    def iter_contig_hits( self, contig_hits ):
+        for contig_name, hits in contig_hits:
+            if contig_name is not None:
+                rows = list( iter_gene_rows( contig_name, hits, self.args ) )
+                self.writer.writerows( rows )
+                if contig_name in self.contigs:
+                    self.stash[contig_name] = [wu.Locus( row, attach_annotations=False ) for row in rows]
+            yield contig_name, hits
+
+    def pop( self, contig_name ):
+        return self.stash.pop( contig_name, [] )
+
+# ---------------------------------------------------------------
+# main
+# ---------------------------------------------------------------
+
+def main( ):
+
+    args = get_args( )
+    wu.say( "Loading taxonomy." )
+    taxonomy = wu.Taxonomy( args.taxonomy )
+
+    # initialize contigs
+    wu.say( "Loading contig lengths." )
+    contig_lengths = wu.read_contig_lengths( args.contigs, write_index=args.write_fai )
+
+    # check basename in preparation for writing output
+    wo.set_output_defaults( args )
+    if args.gff is None:
+        args.gff = os.path.join( args.outdir, args.basename + ".gff" )
+
+    # blastn -> hits -> genes -> orgscorer, one contig at a time
+    fh_gff = wu.try_open( args.gff, "w" )
+    gene_calls = GeneCalls( fh_gff, contig_lengths, args )
+    contig_hits = gene_calls.iter_contig_hits( wu.iter_block_contigs( iter_blastn_blocks( args ) ) )
+    wo.analyze_contigs( contig_hits, contig_lengths, gene_calls, taxonomy, args )
+    fh_gff.close( )
+    wu.say( "Finished successfully." )
+
+if __name__ == "__main__":
+    main( )
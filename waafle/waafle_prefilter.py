@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+"""
+This module is a part of:
+WAAFLE, a [W]orkflow to [A]nnotate [A]ssemblies and [F]ind [L]GT [E]vents
+
+Copyright (c) 2019 Harvard T.H. Chan School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from __future__ import print_function # Python 2.7+ required
+import os
+import sys
+import csv
+import argparse
+
+from waafle import utils as wu
+from waafle.waafle_genecaller import attach_shared_args
+
+# ---------------------------------------------------------------
+# description
+# ---------------------------------------------------------------
+
+description = wu.describe( """
+{SCRIPT}: (Optional) Step 0.5 in the WAAFLE pipeline
+
+Remove contigs that can never be scored from a contigs file before
+running waafle_search. waafle_orgscorer ignores genes shorter than
+--min-gene-length, so a contig shorter than that (or, if a GFF is
+given, a contig with no gene that long) is always unclassified. BLAST
+need not search it. Writes the reduced contigs file and a manifest of
+kept/skipped contigs. Pass the ORIGINAL contigs file to waafle_orgscorer,
+which then reports the skipped contigs as unclassified.
+""" )
+
+# ---------------------------------------------------------------
+# constants
+# ---------------------------------------------------------------
+
+c_manifest_fields = ["contig_name", "contig_length", "status", "reason"]
+c_empty_field     = "--"
+
+# ---------------------------------------------------------------
+# cli
+# ---------------------------------------------------------------
+
+def get_args( ):
+    parser = argparse.ArgumentParser(
+        description=description, 
+        formatter_class=argparse.RawTextHelpFormatter,
+        )
+    parser.add_argument( 
+        "contigs",
+        help="contigs file (fasta format)",
+        )
+    parser.add_argument( 
+        "--gff",
+        default=None,
+        metavar="<path>",
+        help="(pre-existing) gene calls for <contigs>; skip contigs without a long-enough gene\n[default: off]",
+        )
+    parser.add_argument( 
+        "--out",
+        default=None,
+        metavar="<path>",
+        help="path for the reduced contigs file\n[default: <derived from input>]",
+        )
+    parser.add_argument( 
+        "--manifest",
+        default=None,
+        metavar="<path>",
+        help="path for the kept/skipped contigs manifest (.tsv)\n[default: <derived from input>]",
+        )
+    # only --min-gene-length affects which contigs are kept, but accepting all of
+    # the shared args lets users pass the same settings as to waafle_orgscorer
+    attach_shared_args( parser )
+    args = parser.parse_args( )
+    return args
+
+# ---------------------------------------------------------------
+# utils
+# ---------------------------------------------------------------
+
+def iter_fasta_records( fasta ):
+    """ yield [header, lines] for each record in <fasta> """
+    header, lines = None, []
+    with wu.try_open( fasta ) as fh:
+        for line in fh:
+            if line.startswith( ">" ):
+                if header is not None:
+                    yield header, lines
+                header, lines = line, []
+            elif header is not None:
+                lines.append( line )
+        # last case cleanup
+        if header is not None:
+            yield header, lines
+
+def get_longest_loci( gff ):
+    """ contig -> length of its longest locus in <gff> """
+    longest = {}
+    for contig, loci in wu.iter_contig_loci( gff, attach_annotations=False ):
+        if contig is not None:
+            longest[contig] = max( [longest.get( contig, 0 )] + [len( L ) for L in loci] )
+    return longest
+
+def check_contig( length, longest_locus, args ):
+    """ reason a contig can't be scored (or None) """
+    reason = None
+    if length < args.min_gene_length:
+        reason = "shorter than --min-gene-length"
+    elif longest_locus is not None and longest_locus < args.min_gene_length:
+        reason = "no gene in <gff> as long as --min-gene-length"
+    return reason
+
+# ---------------------------------------------------------------
+# main
+# ---------------------------------------------------------------
+
+def main( ):
+    args = get_args( )
+    name = wu.path2name( args.contigs )
+    if args.out is None:
+        args.out = wu.name2path( name, ".", ".prefiltered.fna" )
+    if args.manifest is None:
+        args.manifest = wu.name2path( name, ".", ".prefilter.tsv" )
+    longest = None
+    if args.gff is not None:
+        wu.say( "Loading gene coordinates." )
+        longest = get_longest_loci( args.gff )
+    wu.say( "Filtering contigs." )
+    kept = skipped = kept_bases = skipped_bases = 0
+    with wu.try_open( args.out, "w" ) as fh_out, wu.try_open( args.manifest, "w" ) as fh_manifest:
+        writer = csv.writer( fh_manifest, csv.excel_tab )
+        writer.writerow( c_manifest_fields )
+        for header, lines in iter_fasta_records( args.contigs ):
+            contig = header[1:].split( )[0]
+            length = sum( len( line.strip( ) ) for line in lines )
+            reason = check_contig( length, None if longest is None else longest.get( contig, 0 ), args )
+            if reason is None:
+                fh_out.write( header )
+                fh_out.writelines( lines )
+                kept, kept_bases = kept + 1, kept_bases + length
+                writer.writerow( [contig, length, "kept", c_empty_field] )
+            else:
+                skipped, skipped_bases = skipped + 1, skipped_bases + length
+                writer.writerow( [contig, length, "skipped", reason] )
+    wu.say( "Kept {:,} contigs ({:,} bp); skipped {:,} contigs ({:,} bp).".format( 
+            kept, kept_bases, skipped, skipped_bases ) )
+    wu.say( "Finished successfully." )
+
+if __name__ == "__main__":
+    main( )
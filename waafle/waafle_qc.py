@@ -31,6 +31,11 @@ import sys
 import csv
 import argparse
 import re
+import heapq
+import pickle
+import shutil
+import tempfile
+import zlib
 from collections import Counter
 
 from waafle import utils as wu
@@ -54,6 +59,15 @@ c_formats = {}
 for name, items in c_formats.items( ):
     c_formats[name] = [k for k in items.split( "\n" ) if k != ""]
 
+# ---------------------------------------------------------------
+# constants
+# ---------------------------------------------------------------
+
+# junction report columns used for QC (CONTIG first)
+c_junction_fields = ["CONTIG", "GENE1", "GENE2", "JUNCTION_HITS", "RATIO"]
+# contig buckets for the --stream join of inputs that aren't co-sorted
+c_join_partitions = 64
+
 # ---------------------------------------------------------------
 # cli
 # ---------------------------------------------------------------
@@ -122,10 +136,171 @@ def get_args( ):
         metavar="<path>",
         help="Path for filtered outputs\n[default: derive from input]",
         )
+    g.add_argument( 
+        "--stream",
+        action="store_true",
+        help="stream both inputs in contig order rather than loading the junctions (bounded memory);\ninputs that aren't sorted by contig are joined via temp files\n[default: off]",
+        )
+    g.add_argument( 
+        "--tmpdir",
+        default=None,
+        metavar="<path>",
+        help="where to place temp files (--stream on unsorted inputs)\n[default: <outfile dir>]",
+        )
 
     args = parser.parse_args( )
     return args
 
+# ---------------------------------------------------------------
+# reading junctions
+# ---------------------------------------------------------------
+
+class JunctionReader( ):
+
+    """
+    Reads the junctions report as runs of rows from one contig. Rows are
+    kept as raw lines until parse( ) is called, so only the contigs that
+    are needed for QC pay for parsing.
+    """
+
+    def __init__( self, path ):
+        self.fh = wu.try_open( path )
+        headers = next( self.fh ).rstrip( "\r\n" ).split( "\t" )
+        for field in c_junction_fields:
+            if field not in headers:
+                wu.die( "Junctions report is missing the column:", field, path )
+        self.columns = [headers.index( field ) for field in c_junction_fields]
+
+    def iter_groups( self, fh=None ):
+        """ [contig, lines] for each run of rows from one contig """
+        fh = self.fh if fh is None else fh
+        column = self.columns[0]
+        contig, lines = None, []
+        for line in fh:
+            name = line.split( "\t", column + 1 )[column]
+            if name != contig and len( lines ) > 0:
+                yield [contig, lines]
+                lines = []
+            contig = name
+            lines.append( line )
+        if len( lines ) > 0:
+            yield [contig, lines]
+
+    def parse( self, lines ):
+        """ {(gene1, gene2): [hits, ratio]} from one contig's lines """
+        gene1, gene2, hits, ratio = self.columns[1:]
+        junctions = {}
+        for line in lines:
+            row = line.rstrip( "\r\n" ).split( "\t" )
+            junctions[(row[gene1], row[gene2])] = [int( row[hits] ), float( row[ratio] )]
+        return junctions
+
+def is_sorted( keys ):
+    """ True if <keys> never decrease """
+    last = None
+    for key in keys:
+        if last is not None and key < last:
+            return False
+        last = key
+    return True
+
+# ---------------------------------------------------------------
+# joining lgt calls with their junctions
+# ---------------------------------------------------------------
+
+def qc_contig( R, junctions, args ):
+    """ True if the AB/BA junctions of lgt row <R> are supported; None if no junction data """
+    if junctions is None:
+        return None
+    loci = R["LOCI"].split( "|" )
+    synteny = R["SYNTENY"]
+    qc_pass = True
+    for i in range( len( loci ) - 1 ):
+        spair = synteny[i] + synteny[i+1]
+        if spair not in ["AB", "BA"]:
+            continue
+        gpair = (loci[i], loci[i+1])
+        my_hits, my_covs = junctions.get( gpair, [-1, -1] )
+        my_test = my_hits >= args.min_junction_hits or my_covs >= args.min_junction_ratio
+        qc_pass = qc_pass and my_test
+    return qc_pass
+
+def memory_join( rowdicts, reader, args ):
+    """ yield [R, verdict] for lgt rows, with all junctions in memory """
+    wu.say( "Loading junctions report." )
+    junctions = {}
+    for contig, lines in reader.iter_groups( ):
+        junctions.setdefault( contig, {} ).update( reader.parse( lines ) )
+    for R in rowdicts:
+        yield [R, qc_contig( R, junctions.get( R["CONTIG_NAME"] ), args )]
+
+def merge_join( rowdicts, reader, args ):
+    """ yield [R, verdict] for lgt rows; both inputs sorted by contig """
+    groups = reader.iter_groups( )
+    group = next( groups, None )
+    for R in rowdicts:
+        contig = R["CONTIG_NAME"]
+        # contigs without lgt calls are passed over unparsed
+        while group is not None and group[0] < contig:
+            group = next( groups, None )
+        junctions = None
+        if group is not None and group[0] == contig:
+            junctions = reader.parse( group[1] )
+        yield [R, qc_contig( R, junctions, args )]
+
+def partition_join( rowdicts, reader, args ):
+    """
+    yield [R, verdict] for lgt rows (in their input order) from inputs in
+    any order: both are split into partitions by a hash of the contig name,
+    each partition is joined in memory, and the numbered results are merged
+    """
+    tmpdir = tempfile.mkdtemp( prefix="waafle_qc.", dir=args.tmpdir )
+    try:
+        bucket = lambda contig: zlib.crc32( contig.encode( "utf-8" ) ) % c_join_partitions
+        paths = [os.path.join( tmpdir, str( i ) ) for i in range( c_join_partitions )]
+        # partition: lgt rows (numbered) and junction lines
+        handles = [open( path + ".lgt", "wb" ) for path in paths]
+        for index, R in enumerate( rowdicts ):
+            pickle.dump( [index, R], handles[bucket( R["CONTIG_NAME"] )], pickle.HIGHEST_PROTOCOL )
+        for fh in handles:
+            fh.close( )
+        handles = [open( path + ".junctions", "w" ) for path in paths]
+        for contig, lines in reader.iter_groups( ):
+            handles[bucket( contig )].writelines( lines )
+        for fh in handles:
+            fh.close( )
+        # join each partition
+        for path in paths:
+            rows = list( iter_pickles( path + ".lgt" ) )
+            contigs = {R["CONTIG_NAME"] for index, R in rows}
+            junctions = {}
+            with open( path + ".junctions" ) as fh:
+                for contig, lines in reader.iter_groups( fh ):
+                    if contig in contigs:
+                        junctions.setdefault( contig, {} ).update( reader.parse( lines ) )
+            os.remove( path + ".junctions" )
+            with open( path + ".qc", "wb" ) as fh:
+                for index, R in rows:
+                    verdict = qc_contig( R, junctions.get( R["CONTIG_NAME"] ), args )
+                    pickle.dump( [index, R, verdict], fh, pickle.HIGHEST_PROTOCOL )
+        # restore lgt order
+        streams = [iter_pickles( path + ".qc" ) for path in paths]
+        for index, R, verdict in heapq.merge( *streams ):
+            yield [R, verdict]
+    finally:
+        shutil.rmtree( tmpdir, ignore_errors=True )
+
+def iter_pickles( path ):
+    """ yield the records pickled to a file, then delete it """
+    with open( path, "rb" ) as fh:
+        while True:
+            try:
+                record = pickle.load( fh )
+            except EOFError:
+                break
+            yield record
+    os.remove( path )
+
 # ---------------------------------------------------------------
 # main
 # ---------------------------------------------------------------
@@ -134,58 +309,41 @@ def main( ):
 
     args = get_args( )
 
-    # load junctions data
-    hits = {}
-    covs = {}
-    wu.say( "Loading junctions report." )
-    F = wu.Frame( args.junctions )
-    # loop over junctions
-    for R in F.iter_rowdicts( ):
-        contig = R["CONTIG"]
-        gene1 = R["GENE1"]
-        gene2 = R["GENE2"]
-        hits.setdefault( contig, {} )[(gene1, gene2)] = int( R["JUNCTION_HITS"] )
-        covs.setdefault( contig, {} )[(gene1, gene2)] = float( R["RATIO"] )
-
     # filter contigs
     total = 0
     failed = 0
     outfile = args.outfile
     if outfile is None:
         outfile = args.contig_profile + ".qc_pass"
-    # load results, open new file, write headers
+    if args.tmpdir is None:
+        args.tmpdir = os.path.dirname( os.path.abspath( outfile ) )
+    # pair lgt rows with their junction data
     F = wu.Frame( args.contig_profile )
+    if not args.stream:
+        verdicts = memory_join( F.iter_rowdicts( ), JunctionReader( args.junctions ), args )
+    elif is_sorted( R["CONTIG_NAME"] for R in wu.Frame( args.contig_profile ).iter_rowdicts( ) ) \
+            and is_sorted( contig for contig, lines in JunctionReader( args.junctions ).iter_groups( ) ):
+        wu.say( "Streaming inputs (sorted by contig)." )
+        verdicts = merge_join( F.iter_rowdicts( ), JunctionReader( args.junctions ), args )
+    else:
+        wu.say( "Inputs not sorted by contig; joining via temp files in:", args.tmpdir )
+        verdicts = partition_join( F.iter_rowdicts( ), JunctionReader( args.junctions ), args )
+    # open new file, write headers
     fh = wu.try_open( outfile, "w" )
     wu.write_rowdict( None, F.headers, file=fh )
     # loop over contigs
-    for R in F.iter_rowdicts( ):
+    for R, qc_pass in verdicts:
         total += 1
         contig = R["CONTIG_NAME"]
-        # contig-level filters
-        if contig not in hits or contig not in covs:
+        if qc_pass is None:
             failed += 1
             wu.say( "Missing junction data for contig:", contig )
-            continue        
-        loci = R["LOCI"].split( "|" )
-        synteny = R["SYNTENY"]
-        qc_pass = True
-        for i in range( len( loci ) - 1 ):
-            my_test = True
-            spair = synteny[i] + synteny[i+1]
-            if spair not in ["AB", "BA"]:
-                continue
-            gpair = (loci[i], loci[i+1])
-            my_hits = hits[contig].get( gpair, -1 )
-            my_hits = my_hits >= args.min_junction_hits
-            my_covs = covs[contig].get( gpair, -1 )
-            my_covs = my_covs >= args.min_junction_ratio
-            my_test = my_hits or my_covs
-            qc_pass = qc_pass and my_test
-        if not qc_pass:
+        elif not qc_pass:
             failed += 1
             wu.say( "Failed QC:", contig )
         else:
             wu.write_rowdict( R, F.headers, file=fh )
+    fh.close( )
 
     # wrap-up
     wu.say( "Failure rate: {} of {} ({:.1f}%)".format( failed, total, 100 * failed / float( total ) ) )
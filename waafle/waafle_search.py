@@ -30,6 +30,11 @@ import os
 import sys
 import csv
 import argparse
+import json
+import shutil
+import threading
+import subprocess
+from multiprocessing.pool import ThreadPool
 
 from waafle import utils as wu
 
@@ -71,7 +76,7 @@ def get_args( ):
         "--threads",
         default="1",
         metavar="<int>",
-        help="number of CPU cores to use in blastn search\n[default: 1]",
+        help="number of CPU cores to use in blastn search (split among <--processes>)\n[default: 1]",
         )
     parser.add_argument( 
         "--out",
@@ -79,25 +84,53 @@ def get_args( ):
         metavar="<path>",
         help="path for blast output file\n[default: <derived from input>]",
         )
+    parser.add_argument( 
+        "--processes",
+        default=1,
+        type=int,
+        metavar="<int>",
+        help="run this many blastn processes at once on base-balanced chunks of <query>\n[default: 1]",
+        )
+    parser.add_argument( 
+        "--chunks",
+        default=None,
+        type=int,
+        metavar="<int>",
+        help="number of <query> chunks for <--processes> (more chunks balance load better)\n[default: 4 x <--processes>]",
+        )
+    parser.add_argument( 
+        "--tmpdir",
+        default=None,
+        metavar="<path>",
+        help="where to place the <query> chunks directory (<--out>.chunks)\n[default: <directory of --out>]",
+        )
+    parser.add_argument( 
+        "--write-fai",
+        action="store_true",
+        help="save the scan of <query> as a samtools-style <query>.fai, reused by later runs\n(uncompressed FASTA with regular line widths only)\n[default: off]",
+        )
+    parser.add_argument( 
+        "--resume",
+        action="store_true",
+        help=("if set, search in chunks (even with 1 process) and keep chunks finished\n"
+              "by an earlier, interrupted run if their inputs are unchanged\n[default: off]"),
+        )
     args = parser.parse_args( )
     return args
 
 # ---------------------------------------------------------------
-# main
+# blastn command
 # ---------------------------------------------------------------
 
-def main( ):
-    args = get_args( )
-    if args.out is None:
-        name = wu.path2name( args.query )
-        args.out = wu.name2path( name, ".", ".blastout" )
+def get_command( query, db, blastn, threads, outfile=None ):
+    """ blastn command line; results go to stdout if no <outfile> """
     params = {
-        "QUERY"   : args.query,
-        "OUTFILE" : args.out,
-        "BLASTN"  : args.blastn,
-        "DB"      : args.db,
+        "QUERY"   : query,
+        "OUTFILE" : outfile,
+        "BLASTN"  : blastn,
+        "DB"      : db,
         "MAXTAR"  : wu.c_max_target_seqs,
-        "THREADS" : args.threads,
+        "THREADS" : threads,
         "FORMAT"  : wu.c_blast_format_string,
         }
     command = [
@@ -109,9 +142,230 @@ def main( ):
         "-num_threads {THREADS}",
         "-outfmt \'{FORMAT}\'",
         ]
-    command = " ".join( command ).format( **params )
-    wu.say( "Executing command:", command )
-    os.system( command )
+    if outfile is None:
+        command.remove( "-out {OUTFILE}" )
+    return " ".join( command ).format( **params )
+
+# ---------------------------------------------------------------
+# chunked search (--processes, --resume)
+# ---------------------------------------------------------------
+
+"""
+Chunked searches work in <out>.chunks/, which holds the chunk FASTAs,
+their finished outputs, and a manifest.json recording the search
+settings and, for each finished chunk, the SHA-1 of its FASTA and of
+its output. blastn writes to <chunk>.blastout.part, which is checked
+and renamed into place before the chunk is recorded, so a killed run
+leaves at most some .part files behind. On --resume, a chunk is skipped
+only if its FASTA and output still match the manifest. Once merged, the
+search is recorded in <out>.manifest.json (settings and the SHA-1 of
+<query> and <out>), which --resume checks before skipping the search.
+"""
+
+def split_query( query, nchunks, workdir, write_index=False ):
+    """
+    Split <query> into up to <nchunks> runs of consecutive contigs with
+    ~equal total bases; returns the paths of the chunk FASTAs in order
+    """
+    lengths = wu.read_contig_lengths( query, write_index=write_index )
+    total = float( sum( lengths.values( ) ) )
+    # a contig goes to the chunk where its first base falls; bases are counted
+    # while writing (by name, contigs with duplicate names would collapse)
+    paths, fh, last, done = [], None, None, 0
+    with wu.try_open( query ) as fh_query:
+        for line in fh_query:
+            if line.startswith( ">" ):
+                chunk = min( nchunks - 1, int( nchunks * done / total ) ) if total > 0 else 0
+                if chunk != last:
+                    if fh is not None:
+                        fh.close( )
+                    path = os.path.join( workdir, "chunk.{:05d}.fna".format( len( paths ) ) )
+                    fh = open( path, "w" )
+                    paths.append( path )
+                    last = chunk
+            else:
+                done += len( line.strip( ) )
+            if fh is not None:
+                fh.write( line )
+    if fh is not None:
+        fh.close( )
+    return paths
+
+def check_blastout( path ):
+    """ True if every row of <path> is complete (all fields + newline) """
+    nfields = len( wu.c_blast_fields )
+    with open( path ) as fh:
+        for line in fh:
+            if not line.endswith( "\n" ) or line.count( "\t" ) != nfields - 1:
+                return False
+    return True
+
+class Manifest( ):
+
+    """ record of a chunked search's settings and finished chunks (see above) """
+
+    def __init__( self, path, settings, resume ):
+        self.path = path
+        self.lock = threading.Lock( )
+        data = None
+        if resume and os.path.exists( path ):
+            with open( path ) as fh:
+                data = json.load( fh )
+            if data.get( "settings" ) != settings:
+                wu.say( "  Search settings changed; not resuming from", path )
+                data = None
+        self.data = data if data is not None else {"settings": settings, "chunks": {}}
+
+    def is_done( self, fna, fna_hash, output ):
+        entry = self.data["chunks"].get( os.path.basename( fna ) )
+        return entry is not None \
+            and entry["query_sha1"] == fna_hash \
+            and os.path.exists( output ) \
+            and os.path.getsize( output ) == entry["output_bytes"] \
+            and wu.hash_file( output ) == entry["output_sha1"]
+
+    def set_done( self, fna, fna_hash, output ):
+        entry = {
+            "query_sha1"   : fna_hash,
+            "output_sha1"  : wu.hash_file( output ),
+            "output_bytes" : os.path.getsize( output ),
+            }
+        with self.lock:
+            self.data["chunks"][os.path.basename( fna )] = entry
+            self.write( )
+
+    def write( self ):
+        write_json( self.path, self.data )
+
+def write_json( path, data ):
+    """ replace <path> atomically """
+    temp = path + ".part"
+    with open( temp, "w" ) as fh:
+        json.dump( data, fh, indent=1, sort_keys=True )
+    os.rename( temp, path )
+
+def get_search_record( query, out, settings ):
+    return {
+        "settings"     : settings,
+        "query_sha1"   : wu.hash_file( query ),
+        "output_sha1"  : wu.hash_file( out ),
+        "output_bytes" : os.path.getsize( out ),
+        }
+
+def is_searched( query, out, record, settings ):
+    """ True if <out> is the merged output of a search of <query> with <settings> """
+    if not os.path.exists( record ):
+        return False
+    with open( record ) as fh:
+        data = json.load( fh )
+    # cheap checks first, then the hashes
+    return data.get( "settings" ) == settings \
+        and data.get( "output_bytes" ) == os.path.getsize( out ) \
+        and data == get_search_record( query, out, settings )
+
+def run_chunked_search( args ):
+    """ blastn base-balanced chunks of <query> in parallel; merge outputs in <query> order """
+    nprocs = args.processes
+    nchunks = args.chunks if args.chunks is not None else 4 * nprocs
+    tmpdir = args.tmpdir if args.tmpdir is not None else os.path.dirname( os.path.abspath( args.out ) )
+    workdir = os.path.join( tmpdir, os.path.basename( args.out ) + ".chunks" )
+    record = args.out + ".manifest.json"
+    # anything besides <query> that changes the output
+    settings = {
+        "db"              : os.path.abspath( args.db ),
+        "max_target_seqs" : wu.c_max_target_seqs,
+        "format"          : wu.c_blast_format_string,
+        }
+    if args.resume and os.path.exists( args.out ) and not os.path.exists( workdir ):
+        # the merged output is only renamed into place once complete
+        if is_searched( args.query, args.out, record, settings ):
+            wu.say( "RESUMING: The search output <{}> already exists.".format( args.out ) )
+            return
+        wu.say( "  <{}> was not written by a search of <query> with these settings; not resuming".format( args.out ) )
+    if not args.resume and os.path.exists( workdir ):
+        shutil.rmtree( workdir )
+    if not os.path.exists( workdir ):
+        os.makedirs( workdir )
+    # chunk names (and so the manifest entries) also depend on the chunk count
+    manifest = Manifest( os.path.join( workdir, "manifest.json" ), dict( settings, chunks=nchunks ), args.resume )
+    chunks = split_query( args.query, nchunks, workdir, write_index=args.write_fai )
+    hashes = [wu.hash_file( path ) for path in chunks]
+    outputs = [path[:-len( ".fna" )] + ".blastout" for path in chunks]
+    todo = [k for k in range( len( chunks ) ) if not manifest.is_done( chunks[k], hashes[k], outputs[k] )]
+    if len( todo ) < len( chunks ):
+        wu.say( "RESUMING: {:,} of {:,} chunks already searched.".format( len( chunks ) - len( todo ), len( chunks ) ) )
+    manifest.write( )
+    wu.say( "Searching {:,} chunks with {:,} blastn processes.".format( len( todo ), nprocs ) )
+    # split the cores among the processes: chunks are dispatched in order, so the
+    # first ones (running together at the start) take the remainder
+    threads = int( args.threads )
+    shares = [max( 1, threads // nprocs + (1 if i < threads % nprocs else 0) ) for i in range( len( todo ) )]
+    # blastn processes still running, so that a failure can stop them
+    running = set( )
+    lock = threading.Lock( )
+    def run_chunk( i ):
+        k = todo[i]
+        partial = outputs[k] + ".part"
+        command = get_command( chunks[k], args.db, args.blastn, shares[i], partial )
+        with lock:
+            if running is None:
+                return "search stopped"
+            wu.say( "Executing command:", command )
+            # exec: the shell becomes blastn, so it is blastn that gets killed
+            process = subprocess.Popen( "exec " + command, shell=True )
+            running.add( process )
+        status = process.wait( )
+        with lock:
+            if running is None:
+                return "search stopped"
+            running.discard( process )
+        if status != 0:
+            return "blastn exited with status {}".format( status )
+        if not os.path.exists( partial ) or not check_blastout( partial ):
+            return "incomplete blastn output"
+        os.rename( partial, outputs[k] )
+        manifest.set_done( chunks[k], hashes[k], outputs[k] )
+        return None
+    pool = ThreadPool( nprocs )
+    try:
+        for error in pool.imap_unordered( run_chunk, range( len( todo ) ) ):
+            if error is not None:
+                wu.die( error, "(a later --resume will rerun the failed chunks)" )
+        pool.close( )
+    finally:
+        with lock:
+            for process in running:
+                if process.poll( ) is None:
+                    process.kill( )
+                    process.wait( )
+            running = None
+        pool.terminate( )
+        pool.join( )
+    # chunks hold consecutive contigs, so concatenating outputs keeps <query> order
+    temp = args.out + ".part"
+    with open( temp, "wb" ) as fh_out:
+        for path in outputs:
+            with open( path, "rb" ) as fh:
+                shutil.copyfileobj( fh, fh_out )
+    os.rename( temp, args.out )
+    write_json( record, get_search_record( args.query, args.out, settings ) )
+    shutil.rmtree( workdir )
+
+# ---------------------------------------------------------------
+# main
+# ---------------------------------------------------------------
+
+def main( ):
+    args = get_args( )
+    if args.out is None:
+        name = wu.path2name( args.query )
+        args.out = wu.name2path( name, ".", ".blastout" )
+    if args.processes > 1 or args.resume:
+        run_chunked_search( args )
+    else:
+        command = get_command( args.query, args.db, args.blastn, args.threads, args.out )
+        wu.say( "Executing command:", command )
+        os.system( command )
     wu.say( "Finished successfully." )
 
 if __name__ == "__main__":
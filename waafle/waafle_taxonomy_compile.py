@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""
+This module is a part of:
+WAAFLE, a [W]orkflow to [A]nnotate [A]ssemblies and [F]ind [L]GT [E]vents
+
+Copyright (c) 2019 Harvard T.H. Chan School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from __future__ import print_function # Python 2.7+ required
+import os
+import sys
+import argparse
+
+from waafle import utils as wu
+
+# ---------------------------------------------------------------
+# description
+# ---------------------------------------------------------------
+
+description = wu.describe( """
+{SCRIPT}: (Optional) Taxonomy preparation for the WAAFLE pipeline
+
+Compile a WAAFLE taxonomy file (.tsv) into a compact binary form
+(integer clade ids, parent and child arrays, leaf counts, and a
+string table). waafle_orgscorer accepts the compiled file in place
+of the .tsv; it is memory-mapped rather than parsed, so startup is
+near-instant and parallel workers share its pages.
+""" )
+
+# ---------------------------------------------------------------
+# cli
+# ---------------------------------------------------------------
+
+def get_args( ):
+    parser = argparse.ArgumentParser(
+        description=description, 
+        formatter_class=argparse.RawTextHelpFormatter,
+        )
+    parser.add_argument( 
+        "taxonomy",
+        help="taxonomy file for a WAAFLE BLAST database (.tsv)",
+        )
+    parser.add_argument( 
+        "--out",
+        default=None,
+        metavar="<path>",
+        help="path for the compiled taxonomy\n[default: <derived from input>]",
+        )
+    args = parser.parse_args( )
+    return args
+
+# ---------------------------------------------------------------
+# main
+# ---------------------------------------------------------------
+
+def main( ):
+    args = get_args( )
+    if args.out is None:
+        name = wu.path2name( args.taxonomy )
+        args.out = wu.name2path( name, ".", ".wtax" )
+    wu.say( "Loading taxonomy." )
+    taxonomy = wu.Taxonomy( args.taxonomy )
+    wu.say( "Writing {:,} clades to: {}".format( len( taxonomy.names ), args.out ) )
+    taxonomy.write( args.out )
+    wu.say( "Finished successfully." )
+
+if __name__ == "__main__":
+    main( )